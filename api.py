@@ -0,0 +1,237 @@
+"""Versioned JSON API for Blogly, mounted at /api/v1.
+
+Collections are cursor paginated (?after=, ?before=, ?per_page=) in id
+order. Every endpoint accepts ?fields= to pick fields and ?include= to
+embed relations, e.g. /api/v1/posts?fields=id,title&include=tags,user.
+
+With a cache backend whose versions all workers share (redis), responses
+carry a strong ETag and Last-Modified derived from the fragment cache
+versions of the entities they contain, so a conditional GET for an
+unchanged resource gets a 304 without touching the database. A worker's
+per-process versions miss the other workers' writes, so with those
+collections carry no validators. A single item without ?include= is
+validated by its row's version instead, whatever the backend: one primary
+key lookup, and edits to other rows leave its ETag alone.
+"""
+
+import calendar
+import datetime
+import hashlib
+
+from flask import Blueprint, Response, abort, jsonify, request
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, User, Post, Tag
+from cache import fragment_cache
+from pagination import paginate_request
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+MODELS = {'users': User, 'posts': Post, 'tags': Tag}
+
+FIELDS = {
+    'users': {
+        'id': lambda user: user.id,
+        'first_name': lambda user: user.first_name,
+        'last_name': lambda user: user.last_name,
+        'full_name': lambda user: user.full_name,
+        'image_url': lambda user: user.image_url,
+    },
+    'posts': {
+        'id': lambda post: post.id,
+        'title': lambda post: post.title,
+        'content': lambda post: post.content,
+        'content_html': lambda post: post.content_html,
+        'excerpt': lambda post: post.excerpt,
+        'created_at': lambda post: _iso(post.created_at),
+        'user_id': lambda post: post.user_id,
+    },
+    'tags': {
+        'id': lambda tag: tag.id,
+        'name': lambda tag: tag.name,
+        'post_count': lambda tag: tag.post_count,
+    },
+}
+
+# Columns an item's ETag is made of. The version moves on every ORM update;
+# post counts (triggers) and rendered HTML (flask blogly rerender) change
+# without it.
+ITEM_VALIDATORS = {
+    'users': ['version'],
+    'posts': ['version', 'content_hash'],
+    'tags': ['version', 'post_count'],
+}
+
+# Other cache dependencies of each kind: post writes change tag post counts
+EXTRA_DEPS = {'tags': {'posts'}}
+
+# kind -> relation name -> (kind of the related rows, is it a collection)
+RELATIONS = {
+    'users': {'posts': ('posts', True)},
+    'posts': {'user': ('users', False), 'tags': ('tags', True)},
+    'tags': {'posts': ('posts', True)},
+}
+
+
+def _arg_list(name, allowed):
+    """Comma-separated request arg name, checked against allowed"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    unknown = [item for item in items if item not in allowed]
+    if unknown:
+        abort(400, description=f'Unknown {name}: {", ".join(unknown)}')
+    return items
+
+
+def serialize(kind, obj, fields=None, includes=()):
+    """Dict of the chosen fields (default: all) of obj plus its included
+    relations"""
+    getters = FIELDS[kind]
+    data = {name: getters[name](obj) for name in (fields or getters)}
+    for relation in includes:
+        related_kind, many = RELATIONS[kind][relation]
+        value = getattr(obj, relation)
+        if many:
+            data[relation] = [serialize(related_kind, item) for item in value]
+        else:
+            data[relation] = serialize(related_kind, value) if value else None
+    return data
+
+
+def _loader_options(kind, includes):
+    model = MODELS[kind]
+    return [selectinload(getattr(model, relation))
+            if RELATIONS[kind][relation][1]
+            else joinedload(getattr(model, relation))
+            for relation in includes]
+
+
+def _validators(kind, includes):
+    """(ETag, Last-Modified unix time) for this request, or (None, None)
+    unless every worker sees the same cache versions"""
+    if not fragment_cache.shares_versions:
+        # Counting and summing the tables instead would read every row
+        return None, None
+    deps = sorted({kind} | EXTRA_DEPS.get(kind, set())
+                  | {RELATIONS[kind][r][0] for r in includes})
+    versions = fragment_cache.versions(deps)
+    last_modified = fragment_cache.last_modified(deps)
+    raw = '|'.join([request.path, str(sorted(request.args.items(multi=True))),
+                    str(deps), str(versions), repr(last_modified)])
+    return hashlib.sha1(raw.encode()).hexdigest(), last_modified
+
+
+def _item_validators(kind, obj_id):
+    """(ETag, None) for one item from its row's version"""
+    model = MODELS[kind]
+    row = (db.session.query(*[getattr(model, c) for c in ITEM_VALIDATORS[kind]])
+           .filter(model.id == obj_id).first())
+    if row is None:
+        abort(404)
+    raw = '|'.join([request.path, str(sorted(request.args.items(multi=True))),
+                    str(tuple(row))])
+    return hashlib.sha1(raw.encode()).hexdigest(), None
+
+
+def _is_fresh(etag, last_modified):
+    if request.if_none_match:
+        # Weak comparison (RFC 7232): the compression middleware marks the
+        # ETag of an encoded body weak
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is not None and last_modified is not None:
+        return int(last_modified) <= calendar.timegm(since.utctimetuple())
+    return False
+
+
+def conditional(validators, build):
+    """Respond with jsonify(build()), or a 304 if the client's copy is
+    still current by validators, an (ETag, Last-Modified) pair; build()
+    only runs when a body is needed"""
+    etag, last_modified = validators
+    weak = False
+    if etag is not None and _is_fresh(etag, last_modified):
+        response = Response(status=304)
+        # Confirm the validator the client holds: the weak one when its copy
+        # came gzipped through the compression middleware
+        weak = request.if_none_match.is_weak(etag)
+    else:
+        response = jsonify(build())
+    if etag is not None:
+        response.set_etag(etag, weak=weak)
+        if last_modified is not None:
+            response.last_modified = datetime.datetime.fromtimestamp(
+                int(last_modified), datetime.timezone.utc)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def collection(kind):
+    model = MODELS[kind]
+    fields = _arg_list('fields', FIELDS[kind])
+    includes = _arg_list('include', RELATIONS[kind]) or ()
+
+    def build():
+        query = model.query.options(*_loader_options(kind, includes))
+        page = paginate_request(query, (model.id,))
+        return {'data': [serialize(kind, obj, fields, includes) for obj in page],
+                'next_cursor': page.next_cursor,
+                'prev_cursor': page.prev_cursor}
+    return conditional(_validators(kind, includes), build)
+
+
+def item(kind, obj_id):
+    model = MODELS[kind]
+    fields = _arg_list('fields', FIELDS[kind])
+    includes = _arg_list('include', RELATIONS[kind]) or ()
+
+    def build():
+        obj = (model.query.options(*_loader_options(kind, includes))
+               .filter_by(id=obj_id).first_or_404())
+        return {'data': serialize(kind, obj, fields, includes)}
+    if includes:
+        return conditional(_validators(kind, includes), build)
+    return conditional(_item_validators(kind, obj_id), build)
+
+
+@api.route('/users')
+def list_users():
+    return collection('users')
+
+
+@api.route('/users/<int:user_id>')
+def get_user(user_id):
+    return item('users', user_id)
+
+
+@api.route('/posts')
+def list_posts():
+    return collection('posts')
+
+
+@api.route('/posts/<int:post_id>')
+def get_post(post_id):
+    return item('posts', post_id)
+
+
+@api.route('/tags')
+def list_tags():
+    return collection('tags')
+
+
+@api.route('/tags/<int:tag_id>')
+def get_tag(tag_id):
+    return item('tags', tag_id)
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(e):
+    return jsonify({'error': e.name, 'description': e.description}), e.code
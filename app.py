@@ -1,61 +1,172 @@
 """Blogly application."""
 
-from flask import Flask, request, render_template,  redirect, flash, session
+from flask import Flask, Blueprint, request, render_template,  redirect, flash, session, jsonify, current_app, make_response
+from markupsafe import escape
 from models import db, connect_db, User, Post, Tag, PostTag
-from flask_debugtoolbar import DebugToolbarExtension
-from flask_sqlalchemy import SQLAlchemy
+from replicas import replica_router, replica_reads
+import queries
+from config import get_config, engine_options
+from cli import blogly_cli
+from api import api
+from pagination import Page, encode_cursor, paginate_request, page_size, page_args
+from cache import fragment_cache, tag_keys
+from instrumentation import instrumentation
+from ratelimit import rate_limiter
+from counters import view_counter
+import counters
+from search import search_posts
+from tagging import sync_post_tags, sync_tag_posts
+import feed
+import jobs
+import related
+from jobs import job_runner
+import templating
+import assets
+import avatars
+import compression
+import markup
+from templating import stream_template
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.sql import asc, desc, func
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'dogsaregreat1999'
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.debug = False
-
-debug = DebugToolbarExtension(app)
-
-connect_db(app)
-db.create_all()
-
-
-@app.errorhandler(404)
+import math
+from urllib.parse import urlencode
+
+bp = Blueprint('blogly', __name__)
+
+
+def create_app(config=None):
+    """Build the Blogly app for a config profile name or config class
+    (default: the profile named by $BLOGLY_ENV)"""
+    app = Flask(__name__)
+    if config is None or isinstance(config, str):
+        config = get_config(config)
+    app.config.from_object(config)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    replica_router.init_app(app, db)
+    templating.init_app(app)
+    fragment_cache.init_app(app)
+    instrumentation.init_app(app)
+    rate_limiter.init_app(app)
+    view_counter.init_app(app)
+    job_runner.init_app(app)
+    avatars.init_app(app)
+    assets.init_app(app)
+    markup.init_app(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    app.cli.add_command(blogly_cli)
+    # Outermost, so it sees the finished responses
+    compression.init_app(app)
+    return app
+
+
+def checked_ids(form):
+    """Ids of the checked checkboxes in a form (their names are the ids)"""
+    return [int(key) for key in form if key.isdigit()]
+
+
+def cloud_level(count, top, levels=5):
+    """Size class 1..levels of a tag used count times when the most used
+    tag has top posts, on a log scale"""
+    if top <= 1:
+        return levels // 2 + 1
+    return 1 + round((levels - 1) * math.log(count) / math.log(top))
+
+
+def is_stale(obj):
+    """Whether the submitted edit form was filled in from an older version
+    of obj (forms without a version are not checked)"""
+    version = request.form.get('version', type=int)
+    return version is not None and version != obj.version
+
+
+def conflict(render, obj_id):
+    """409: the edit form again, showing the current data and what was
+    submitted"""
+    db.session.rollback()
+    flash('Someone else changed this while you were editing it; '
+          'your changes were not saved. Review them below and save again.',
+          'error')
+    response = render(obj_id, submitted=request.form)
+    response.status_code = 409
+    return response
+
+
+@bp.app_errorhandler(404)
 def not_found(e):
     flash(f'Error: {e}', 'error')
     return render_template('404.html')
 
 
-@app.route('/')
+@bp.route('/')
+@replica_reads
 def create_user():
     """Redirect to a List of Users"""
-    users = User.query.order_by(User.last_name, User.first_name).all()
-    # Last 5 Posts
-    posts = Post.query.order_by(desc(Post.created_at)).limit(5).all()
-    return render_template('home.html', users=users, posts=posts)
-
-
-@app.route('/users')
+    fragment = fragment_cache.fragment(
+        'home', ['posts', 'users', 'tags'],
+        # Last 5 Posts
+        lambda: render_template('fragments/home.html',
+                                entries=feed.read(feed.GLOBAL, 5)))
+    # Flushed view counts bump "views"
+    trending = fragment_cache.fragment(
+        'trending', ['posts', 'views'],
+        lambda: render_template('fragments/trending.html',
+                                posts=counters.trending()))
+    return render_template('home.html', fragment=fragment, trending=trending)
+
+
+@bp.route('/users')
+@replica_reads
 def list_users():
     """Show all users"""
-    users = User.query.order_by(User.last_name, User.first_name).all()
-    return render_template('list.html', users=users)
+    page = queries.prefetched()
+    if page is None:
+        page = paginate_request(queries.users_by_name(), queries.USER_ORDER)
+    return render_template('list.html', users=page, page=page)
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@replica_reads
 def user_details(user_id):
     """Show Details for User"""
     user = User.query.get_or_404(user_id)
-    return render_template('details.html', user=user)
-
-
-@app.route('/users/new')
+    if request.args.get('after') or request.args.get('before'):
+        # Posts older than the user's feed
+        page = paginate_request(queries.posts_of_user(user_id),
+                                queries.RECENT_ORDER, descending=True)
+        page.items = [feed.entry_for(post) for post in page]
+    else:
+        # The first page comes from the user's feed; a full feed may have
+        # older posts behind it
+        per_page = page_size()
+        limit = min(per_page, feed.feed_size())
+        entries = feed.read(feed.user_scope(user_id), limit + 1)
+        more = len(entries) > limit
+        entries = entries[:limit]
+        if not more and len(entries) == feed.feed_size():
+            last = entries[-1]
+            more = queries.has_older_posts(user_id, last.created_at, last.post_id)
+        older = None
+        if more:
+            older = encode_cursor([entries[-1].created_at, entries[-1].post_id])
+        page = Page(entries, per_page, next_cursor=older)
+    return render_template('details.html', user=user, page=page)
+
+
+@bp.route('/users/new')
 def new_user_form():
     """Show an add form for users"""
     return render_template('new_user.html')
 
 
-@app.route('/users/new', methods=['POST'])
+@bp.route('/users/new', methods=['POST'])
 def add_new_user():
     """Adds new user to Blogly Database"""
     if request.form['first_name'] and request.form['last_name']:
@@ -70,23 +181,28 @@ def add_new_user():
                         last_name=last_name, image_url=image_url)
         db.session.add(new_user)
         db.session.commit()
+        fragment_cache.invalidate('users')
+        avatars.prewarm(new_user)
     else:
         flash('Sorry could not create new user - please try again', 'error')
     return redirect('/users')
 
 
-@app.route('/users/<int:user_id>/edit')
-def edit_user_form(user_id):
+@bp.route('/users/<int:user_id>/edit')
+def edit_user_form(user_id, submitted=None):
     """Shows a form to edit user details"""
     id = user_id
     user = User.query.get(id)
-    return render_template('edit_user.html', id=id, user=user)
+    return make_response(render_template('edit_user.html', id=id, user=user,
+                                         submitted=submitted))
 
 
-@app.route('/users/<int:user_id>/edit', methods=['POST'])
+@bp.route('/users/<int:user_id>/edit', methods=['POST'])
 def edit_user(user_id):
     """Process the edit form, returning the user to the /users page"""
     user = User.query.get_or_404(user_id)
+    if is_stale(user):
+        return conflict(edit_user_form, user_id)
     if request.form['first_name'] or request.form['last_name'] or request.form['image_url']:
         if request.form['first_name']:
             user.first_name = request.form['first_name']
@@ -94,60 +210,97 @@ def edit_user(user_id):
             user.last_name = request.form['last_name']
         if request.form['image_url']:
             user.image_url = request.form['image_url']
-        flash(f'Made changes to {user.full_name}', 'success')
         db.session.add(user)
+        try:
+            db.session.flush()
+        except StaleDataError:
+            return conflict(edit_user_form, user_id)
+        flash(f'Made changes to {user.full_name}', 'success')
+        feed.user_changed(user_id)
         db.session.commit()
+        fragment_cache.invalidate('users')
+        if request.form['image_url']:
+            avatars.prewarm(user)
     else:
         flash('Did not make any changes', 'error')
     return redirect('/users')
 
 
-@app.route('/users/<int:user_id>/delete', methods=['POST'])
+@bp.route('/users/<int:user_id>/delete', methods=['POST'])
 def delete_user(user_id):
     """Delete the user."""
     user = User.query.get_or_404(user_id)
-    if user:
+    threshold = current_app.config['ASYNC_DELETE_THRESHOLD']
+    if Post.query.filter_by(user_id=user_id).limit(threshold).count() >= threshold:
+        name = user.full_name
+        job = jobs.enqueue('delete_user', user_id)
+        flash(f'Deleting User: {name} in the background (job {job.id})',
+              'success')
+    elif user:
         flash(f'Deleted User: {user.full_name}', 'success')
+        tag_ids = queries.tag_ids_of_user(user_id)
+        post_ids = {post_id for (post_id,) in
+                    db.session.query(Post.id).filter_by(user_id=user_id)}
+        referrers = related.referrers(post_ids)
         User.query.filter_by(id=user_id).delete()
+        # The user's entries went with their posts; top up the other feeds
+        feed.refill([feed.GLOBAL, *map(feed.tag_scope, tag_ids)])
+        related.recompute(referrers - post_ids)
         db.session.commit()
+        fragment_cache.invalidate('users', 'posts', *tag_keys(tag_ids))
     else:
         flash('Could not delete user - please try again', 'error')
     return redirect('/users')
 
 
-@app.route('/users/<int:user_id>/posts/new')
+@bp.route('/users/<int:user_id>/posts/new')
 def new_post_form(user_id):
     """Show form to add a post for that user."""
     user = User.query.get_or_404(user_id)
-    tags = Tag.query.order_by(Tag.name).all()
-    return render_template('new_post.html', user=user, tags=tags)
+    tags = queries.tags_by_name().yield_per(templating.STREAM_CHUNK_SIZE)
+    return stream_template('new_post.html', user=user, tags=tags)
 
-@app.route('/posts')
+@bp.route('/posts')
+@replica_reads
 def all_posts():
     """Show list of all posts and tags."""
-    posts = Post.query.order_by(Post.title).all()
-    tags = Tag.query.order_by(Tag.name).all()
-    return render_template('all_posts.html', posts=posts, tags=tags)
+    def render():
+        page = paginate_request(queries.posts_with_authors(), queries.POST_ORDER)
+        tags = queries.tags_by_name().limit(page_size()).all()
+        return render_template('fragments/all_posts.html',
+                               posts=page, page=page, tags=tags)
+    fragment = fragment_cache.fragment('all_posts', ['posts', 'users', 'tags'],
+                                       render, *page_args())
+    return render_template('all_posts.html', fragment=fragment)
     
 
-@app.route('/posts/<int:post_id>')
+@bp.route('/posts/<int:post_id>')
+@replica_reads
 def show_post(post_id):
     """Show post for corresponding Post Id"""
-    post = Post.query.get_or_404(post_id)
+    post = queries.prefetched()
+    if post is None:
+        post = queries.post_with_related(post_id)
     user = post.user
-    return render_template('post_details.html', post=post, user=user)
+    # Written behind: no database write for the view
+    view_counter.record(post.id)
+    views = post.views + view_counter.pending(post.id)
+    return render_template('post_details.html', post=post, user=user,
+                           views=views)
 
 
-@app.route('/posts/<int:post_id>/edit')
-def edit_post_form(post_id):
+@bp.route('/posts/<int:post_id>/edit')
+def edit_post_form(post_id, submitted=None):
     """Show form to edit a post, and to cancel (back to user page)."""
-    post = Post.query.get_or_404(post_id)
+    post = queries.post_with_user_and_tags(post_id)
     user = post.user
-    tags = Tag.query.order_by(Tag.name).all()
-    return render_template('edit_post.html', post=post, user=user, tags=tags)
+    checked = {tag.id for tag in post.tags}
+    tags = queries.tags_by_name().yield_per(templating.STREAM_CHUNK_SIZE)
+    return stream_template('edit_post.html', post=post, user=user, tags=tags,
+                           checked=checked, submitted=submitted)
 
 
-@app.route('/users/<int:user_id>/posts/new', methods=['POST'])
+@bp.route('/users/<int:user_id>/posts/new', methods=['POST'])
 def add_new_post(user_id):
     """Handle add form; add post and redirect to the user detail page."""
     user = User.query.get_or_404(user_id)
@@ -155,120 +308,245 @@ def add_new_post(user_id):
         title = request.form['title']
         flash(f'Created new post: {title}', 'success')
         content = request.form['content']
-        tags_list = list(request.form.listvalues())[2:]
         post = Post(title=title, content=content, user_id=user_id)
-        for item in tags_list:
-            post.tags.append(Tag.query.get(int(item[0])))
         db.session.add(post)
+        db.session.flush()
+        diff = sync_post_tags(post.id, checked_ids(request.form))
+        feed.sync_posts([post.id])
+        related.update([post.id])
         db.session.commit()
+        fragment_cache.invalidate('posts', *tag_keys(diff.added))
     else:
         flash('Could not make post - please try again', 'error')
     return redirect(f'/users/{user_id}')
 
 
-@app.route('/posts/<int:post_id>/edit', methods=['POST'])
+@bp.route('/posts/<int:post_id>/edit', methods=['POST'])
 def edit_post(post_id):
     """Handle editing of a post. Redirect back to the post view."""
     post = Post.query.get_or_404(post_id)
-    user = post.user
+    if is_stale(post):
+        return conflict(edit_post_form, post_id)
     if request.form['title']:
         post.title = request.form['title']
     if request.form['content']:
         post.content = request.form['content']
-    tags_list = list(request.form.listvalues())[2:]
-    post.tags.clear()
-    for item in tags_list:
-        post.tags.append(Tag.query.get(int(item[0])))
-    flash(f'Edited post: {post.title}', 'success')
+    # The tags are part of the post: take a new version even when only
+    # they changed
+    flag_modified(post, 'title')
     db.session.add(post)
+    try:
+        db.session.flush()
+    except StaleDataError:
+        return conflict(edit_post_form, post_id)
+    flash(f'Edited post: {post.title}', 'success')
+    old_tag_ids = queries.tag_ids_of_post(post_id)
+    diff = sync_post_tags(post_id, checked_ids(request.form))
+    feed.sync_posts([post_id])
+    if diff.added or diff.removed:
+        related.update([post_id])
     db.session.commit()
+    fragment_cache.invalidate('posts', *tag_keys(old_tag_ids | diff.added))
     return redirect(f'/posts/{post_id}')
 
 
-@app.route('/posts/<int:post_id>/delete', methods=['POST'])
+@bp.route('/posts/<int:post_id>/delete', methods=['POST'])
 def delete_post(post_id):
     """Delete the post."""
     post = Post.query.get_or_404(post_id)
     if post:
         user = post.user
         flash(f'Deleted Post ({post.title})', 'success')
+        tag_ids = queries.tag_ids_of_post(post_id)
+        referrers = related.referrers([post_id])
         Post.query.filter_by(id=post_id).delete()
+        feed.refill(feed.scopes_for(user.id, tag_ids))
+        related.recompute(referrers - {post_id})
         db.session.commit()
+        fragment_cache.invalidate('posts', *tag_keys(tag_ids))
     else:
         flash('Could not delete post', 'error')
     return redirect(f'/users/{user.id}')
 
 
-@app.route('/tags')
+@bp.route('/tags')
+@replica_reads
 def show_tags():
     """Lists all tags, with links to the tag detail page."""
-    tags = Tag.query.order_by(Tag.name).all()
-    return render_template('tags.html', tags=tags)
-
-@app.route('/tags/new')
+    def render():
+        page = paginate_request(queries.tags_by_name(), queries.TAG_ORDER)
+        return render_template('fragments/tags.html', tags=page, page=page)
+    # Post writes change the tags' post counts
+    fragment = fragment_cache.fragment('tags', ['tags', 'posts'], render,
+                                       *page_args())
+    return render_template('tags.html', fragment=fragment)
+
+@bp.route('/tags/cloud')
+@replica_reads
+def tag_cloud():
+    """Shows the most used tags, sized by how many posts they have."""
+    def render():
+        tags = queries.tag_cloud(current_app.config['TAG_CLOUD_SIZE']).all()
+        top = tags[0].post_count if tags else 1
+        return render_template('fragments/tag_cloud.html',
+                               tags=[(tag, cloud_level(tag.post_count, top))
+                                     for tag in tags])
+    fragment = fragment_cache.fragment('tag_cloud', ['tags', 'posts'], render)
+    return render_template('tag_cloud.html', fragment=fragment)
+
+@bp.route('/tags/new')
 def new_tag():
     """Shows a form to add a new tag."""
-    posts = Post.query.order_by(Post.title).all()
-    return render_template('new_tag.html', posts=posts)
+    page = paginate_request(queries.posts_by_title(), queries.POST_ORDER)
+    return render_template('new_tag.html', posts=page, page=page)
 
-@app.route('/tags/new', methods=['POST'])
+@bp.route('/tags/new', methods=['POST'])
 def add_tag():
     """Process add form, adds tag, and redirect to tag list.""" 
     if request.form['name']:
         name = request.form['name']
         flash(f'Successfully added tag {name}', 'success')
         new_tag = Tag(name=name)
-        post_list = list(request.form.listvalues())[1:]
-        for item in post_list:
-            new_tag.posts.append(Post.query.get(int(item[0])))
         db.session.add(new_tag)
+        db.session.flush()
+        diff = sync_tag_posts(new_tag.id, checked_ids(request.form))
+        feed.sync_posts(diff.added)
+        related.update(diff.added)
         db.session.commit()
+        fragment_cache.invalidate('tags', *tag_keys([new_tag.id]))
     else:
         flash('Could not add tag', 'error')
     return redirect('/tags')
 
-@app.route('/tags/<int:tag_id>')
+@bp.route('/tags/<int:tag_id>')
+@replica_reads
 def tag_details(tag_id):
     """Show detail about a tag. Have links to edit form and to delete."""
-    tag = Tag.query.get_or_404(tag_id)
-    return render_template('tag_details.html', tag=tag)
-
-@app.route('/tags/<int:tag_id>/edit')
-def tag_edit_form(tag_id):
+    deps = [f'tag:{tag_id}']
+    title = fragment_cache.fragment(
+        'tag_title', deps,
+        lambda: escape(Tag.query.get_or_404(tag_id).name), tag_id)
+    def render():
+        tag = Tag.query.get_or_404(tag_id)
+        page = paginate_request(queries.posts_for_tag(tag_id), queries.POST_ORDER)
+        recent = feed.read(feed.tag_scope(tag_id), 5)
+        return render_template('fragments/tag_details.html',
+                               tag=tag, posts=page, page=page, recent=recent)
+    fragment = fragment_cache.fragment('tag_details', deps, render,
+                                       tag_id, *page_args())
+    return render_template('tag_details.html', title=title, fragment=fragment)
+
+@bp.route('/tags/<int:tag_id>/edit')
+def tag_edit_form(tag_id, submitted=None):
     """Show edit form for a tag."""
     tag = Tag.query.get_or_404(tag_id)
-    posts = Post.query.order_by(Post.title).all()
-    return render_template('edit_tag.html', tag=tag, posts=posts)
+    page = paginate_request(queries.posts_by_title(), queries.POST_ORDER)
+    checked = queries.tagged_post_ids(tag_id, [post.id for post in page])
+    return make_response(render_template('edit_tag.html', tag=tag, posts=page,
+                                         page=page, checked=checked,
+                                         submitted=submitted))
 
-@app.route('/tags/<int:tag_id>/edit', methods=['POST'])
+@bp.route('/tags/<int:tag_id>/edit', methods=['POST'])
 def edit_tag(tag_id):
     """Process edit form, edit tag, and redirects to the tags list.""" 
     change_tag = Tag.query.get_or_404(tag_id)
+    if is_stale(change_tag):
+        return conflict(tag_edit_form, tag_id)
     old_name = change_tag.name
     new_name = request.form['name']
     change_tag.name = new_name
-    post_list = list(request.form.listvalues())[1:]
-    change_tag.posts.clear()
-    for item in post_list:
-        change_tag.posts.append(Post.query.get(int(item[0])))
+    # The form only lists one page of posts; leave the other pages alone.
+    # An empty page touches nothing; only a form without the field (e.g.
+    # from a client that predates it) syncs every post of the tag.
+    shown = None
+    if 'shown_posts' in request.form:
+        shown = {int(post_id) for post_id
+                 in request.form['shown_posts'].split(',') if post_id}
+    # As with posts, changing only the tagged posts is a new version
+    flag_modified(change_tag, 'name')
+    db.session.add(change_tag)
+    try:
+        db.session.flush()
+    except StaleDataError:
+        return conflict(tag_edit_form, tag_id)
     if old_name != new_name:
         flash(f'Successfully changed tag from {old_name} to {new_name}', 'success')
     else:
         flash(f'Successfully changed {new_name}', 'success')
-    db.session.add(change_tag)
+    diff = sync_tag_posts(tag_id, checked_ids(request.form), scope=shown)
+    changed = diff.added | diff.removed
+    if old_name != new_name:
+        changed |= feed.tagged_entry_post_ids(tag_id)
+    feed.sync_posts(changed)
+    related.update(diff.added | diff.removed)
     db.session.commit()
+    fragment_cache.invalidate('tags', *tag_keys([tag_id]))
+    # A page button of the form: saved, now show that page
+    for direction in ('after', 'before'):
+        if request.form.get(direction):
+            args = {direction: request.form[direction],
+                    'per_page': request.form.get('per_page', '')}
+            return redirect(f'/tags/{tag_id}/edit?{urlencode(args)}')
     return redirect('/tags')
 
-@app.route('/tags/<int:tag_id>/delete', methods=['POST'])
+@bp.route('/tags/<int:tag_id>/delete', methods=['POST'])
 def delete_tag(tag_id):
     """Delete a tag."""
     tag = Tag.query.get_or_404(tag_id)
-    if tag:
+    if tag.post_count >= current_app.config['ASYNC_DELETE_THRESHOLD']:
+        name = tag.name
+        job = jobs.enqueue('delete_tag', tag_id)
+        flash(f'Deleting Tag ({name}) in the background (job {job.id})',
+              'success')
+    elif tag:
         flash(f'Deleted Tag ({tag.name})', 'success')
+        post_ids = feed.tagged_entry_post_ids(tag_id)
+        tagged = [post_id for (post_id,) in
+                  db.session.query(PostTag.post_id).filter_by(tag_id=tag_id)]
         Tag.query.filter_by(id=tag.id).delete()
+        feed.drop_scope(feed.tag_scope(tag_id))
+        feed.sync_posts(post_ids)
+        related.update(tagged)
         db.session.commit()
+        fragment_cache.invalidate('tags', *tag_keys([tag_id]))
     else:
         flash('Could not delete tag', 'error')
     return redirect('/tags')
-        
-        
\ No newline at end of file
+
+
+def search_request():
+    """Run the search described by the request args"""
+    return search_posts(request.args.get('q', ''),
+                        tag_id=request.args.get('tag', type=int),
+                        user_id=request.args.get('user', type=int),
+                        page=request.args.get('page', 1, type=int),
+                        per_page=page_size())
+
+@bp.route('/search')
+def search():
+    """Search posts by title and content."""
+    results = search_request()
+    return render_template('search.html', results=results,
+                           tag=request.args.get('tag', type=int),
+                           user=request.args.get('user', type=int))
+
+@bp.route('/search.json')
+def search_json():
+    """Search posts, returning JSON."""
+    results = search_request()
+    return jsonify({
+        'query': results.query,
+        'page': results.page,
+        'per_page': results.per_page,
+        'has_next': results.has_next,
+        'results': [{
+            'id': result.post.id,
+            'title': result.post.title,
+            'title_html': str(result.title_html),
+            'snippet_html': str(result.snippet_html),
+            'rank': float(result.rank),
+            'created_at': result.post.created_at.isoformat(),
+            'user': {'id': result.post.user_id,
+                     'full_name': result.post.user.full_name},
+        } for result in results.results],
+    })
@@ -0,0 +1,247 @@
+"""ASGI entry point (optional), for running Blogly under an ASGI server:
+
+    uvicorn --factory asgi:create_asgi_app --workers 4
+
+Every request goes through the same Flask app, routes and templates as
+under WSGI, on a pool of ASGI_THREADS threads. For the read-heavy views in
+PREFETCHERS the rows are loaded first on the event loop, through
+SQLAlchemy's async engine (asyncpg for Postgres, aiosqlite for SQLite), and
+handed to the view (queries.prefetched()); waiting on the database then
+holds no thread, so a worker keeps many such requests in flight at once.
+
+Needs greenlet and the async driver for the database. Without them the
+prefetching is off and every view queries on its thread as usual.
+Responses are buffered, not streamed, and WebSockets are not supported.
+"""
+
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import joinedload, selectinload, sessionmaker
+from werkzeug.exceptions import HTTPException
+
+from app import create_app
+from config import engine_options
+from models import User, Post
+from pagination import keyset_request
+import queries
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+except ImportError:  # greenlet is missing
+    create_async_engine = None
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+log = logging.getLogger('blogly.asgi')
+
+
+def async_url(url):
+    """url with its driver replaced by the async one for its database"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver for {backend}')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def async_engine_options(config):
+    """engine_options() for asyncpg, which takes server settings rather
+    than libpq options"""
+    options = engine_options(config)
+    options.pop('connect_args', None)
+    timeout = config['DB_STATEMENT_TIMEOUT']
+    if timeout and config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        options['connect_args'] = {
+            'server_settings': {'statement_timeout': str(timeout)}}
+    return options
+
+
+# Async equivalents of the views' queries
+
+async def load_users(session, view_args):
+    """list_users: a page of users by name"""
+    statement, finish = keyset_request(select(User), queries.USER_ORDER)
+    return finish((await session.execute(statement)).scalars().all())
+
+
+async def load_post(session, view_args):
+    """show_post: the post with its author, tags and related posts, or
+    None (the view then answers 404)"""
+    result = await session.execute(
+        select(Post)
+        .options(joinedload(Post.user), selectinload(Post.tags),
+                 selectinload(Post.related))
+        .where(Post.id == view_args['post_id']))
+    return result.unique().scalar_one_or_none()
+
+
+# endpoint -> async function(session, view args) loading what it renders
+PREFETCHERS = {
+    'blogly.list_users': load_users,
+    'blogly.show_post': load_post,
+}
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ of an ASGI HTTP request"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_wsgi(app, environ):
+    """(status, headers, body) of a WSGI app's response"""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    result = app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    status, headers = started
+    return int(status.split(' ', 1)[0]), headers, body
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+class BloglyASGI:
+    """ASGI application serving a Flask app; see the module docstring"""
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(app.config['ASGI_THREADS'],
+                                           thread_name_prefix='blogly-asgi')
+        self.engine = None
+        self.sessionmaker = None
+        self._engine_checked = False
+
+    def async_engine(self):
+        """The async engine, made on first use; None without greenlet or
+        the async driver"""
+        if not self._engine_checked:
+            self._engine_checked = True
+            config = self.app.config
+            try:
+                if create_async_engine is None:
+                    raise ImportError('greenlet is not installed')
+                url = config['ASYNC_DATABASE_URL'] or async_url(
+                    config['SQLALCHEMY_DATABASE_URI'])
+                self.engine = create_async_engine(url, **async_engine_options(config))
+            except (ImportError, ValueError) as e:
+                log.warning('Not prefetching with an async engine: %s', e)
+            else:
+                self.sessionmaker = sessionmaker(self.engine, class_=AsyncSession,
+                                                 expire_on_commit=False)
+        return self.engine
+
+    def prefetcher(self, environ):
+        """(loader, view args) for a request PREFETCHERS covers, or None"""
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return None
+        try:
+            endpoint, view_args = (self.app.url_map.bind_to_environ(environ)
+                                   .match())
+        except HTTPException:
+            return None
+        loader = PREFETCHERS.get(endpoint)
+        if loader is None or self.async_engine() is None:
+            return None
+        return loader, view_args
+
+    async def prefetch(self, environ):
+        """Run the request's loader, in a request context for its args"""
+        found = self.prefetcher(environ)
+        if found is None:
+            return
+        loader, view_args = found
+        with self.app.request_context(environ):
+            try:
+                async with self.sessionmaker() as session:
+                    value = await loader(session, view_args)
+            except HTTPException:
+                # e.g. a bad cursor; the view answers it
+                return
+        if value is not None:
+            environ[queries.PREFETCH_KEY] = value
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise NotImplementedError(f'Unsupported ASGI scope: {scope["type"]}')
+        environ = wsgi_environ(scope, await read_body(receive))
+        await self.prefetch(environ)
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(
+            self.executor, call_wsgi, self.app, environ)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'),
+                                 value.encode('latin-1'))
+                                for name, value in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.async_engine()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(config=None):
+    """The ASGI app for a config profile name or class (as create_app)"""
+    return BloglyASGI(create_app(config))
@@ -0,0 +1,172 @@
+"""Fingerprinted, precompressed static files.
+
+`flask blogly build-assets` copies every file under static/ into
+ASSETS_DIR (default: static/dist, not committed) under a name carrying a
+hash of its contents, e.g. style.3f2a9c1b7d4e.css, next to .gz and, when
+the brotli package is installed, .br copies of the text files, and writes
+manifest.json mapping each original name to its hashed one. Run it in the
+deploy step, after the files change.
+
+Templates link files through asset_url('style.css'), which gives the
+hashed file under /assets/ once built (and the plain /static/ URL before,
+as in development). A hashed name never changes content, so /assets/
+serves it as immutable for a year, picking the .br or .gz copy the
+browser accepts; a repeat visit sends no request for it at all.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is then the best encoding
+    brotli = None
+
+MAX_AGE = 365 * 24 * 3600
+MANIFEST = 'manifest.json'
+# Compressing is worth it for text; images and fonts are compressed already
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.svg', '.json', '.txt', '.html',
+                '.xml', '.map', '.ico')
+# Smaller copies than this save less than a packet
+MIN_COMPRESS_SIZE = 256
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def assets_dir(app):
+    return app.config['ASSETS_DIR'] or os.path.join(app.static_folder, 'dist')
+
+
+def hashed_name(name, data):
+    """name with a hash of data before its extension"""
+    stem, extension = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+
+
+def _write(path, data):
+    # Write then rename, so a running server never serves a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def compressed(data):
+    """(suffix, bytes) of each smaller encoding of data"""
+    found = []
+    if brotli is not None:
+        found.append(('.br', brotli.compress(data, quality=11)))
+    # mtime=0: the same input always gives the same bytes
+    found.append(('.gz', gzip.compress(data, compresslevel=9, mtime=0)))
+    return [(suffix, packed) for suffix, packed in found
+            if len(packed) < len(data)]
+
+
+def build(source, target):
+    """Fingerprint and compress the files under source into target and
+    write its manifest; returns the manifest"""
+    target = os.path.abspath(target)
+    manifest = {}
+    for directory, dirnames, filenames in os.walk(source):
+        # Not the built files themselves when target is under source
+        dirnames[:] = sorted(
+            name for name in dirnames
+            if os.path.abspath(os.path.join(directory, name)) != target)
+        for filename in sorted(filenames):
+            if filename.startswith('.'):
+                continue
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = hashed_name(name, data)
+            manifest[name] = hashed
+            out = os.path.join(target, hashed)
+            if os.path.exists(out):
+                continue
+            if name.endswith(COMPRESSIBLE) and len(data) >= MIN_COMPRESS_SIZE:
+                for suffix, packed in compressed(data):
+                    _write(out + suffix, packed)
+            # The plain file last: its presence means the copies are there
+            _write(out, data)
+    _write(os.path.join(target, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(directory):
+    """{name: hashed name} from the manifest in directory, or {}"""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+class Assets:
+    """The manifest of the built assets"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.reload()
+
+    def reload(self):
+        self.manifest = load_manifest(self.directory)
+        self.hashed = set(self.manifest.values())
+
+
+def init_app(app):
+    app.config.setdefault('ASSETS_DIR', None)
+    app.extensions['assets'] = Assets(assets_dir(app))
+    app.add_template_global(asset_url)
+    app.register_blueprint(assets_bp)
+
+
+def asset_url(name):
+    """Link to the built copy of static/<name>, or to name itself before
+    `flask blogly build-assets` (a template global)"""
+    hashed = current_app.extensions['assets'].manifest.get(name)
+    if hashed is None:
+        return url_for('static', filename=name)
+    return url_for('assets.asset', filename=hashed)
+
+
+assets_bp = Blueprint('assets', __name__)
+
+
+@assets_bp.route('/assets/<path:filename>')
+def asset(filename):
+    """A built asset, in the best encoding the client accepts"""
+    assets = current_app.extensions['assets']
+    if filename not in assets.hashed:
+        abort(404)
+    path = os.path.join(assets.directory, filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if request.accept_encodings[name] and os.path.exists(path + suffix):
+            path, encoding = path + suffix, name
+            break
+    etag = filename if encoding is None else f'{filename}-{encoding}'
+    try:
+        response = send_file(path, mimetype=mimetype, etag=etag,
+                             conditional=True, max_age=MAX_AGE)
+    except FileNotFoundError:
+        abort(404)
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@assets_bp.errorhandler(404)
+def not_found(e):
+    # A plain 404, not the site's page: a stylesheet link gets no HTML
+    return 'Not Found', 404, {'Content-Type': 'text/plain; charset=utf-8'}
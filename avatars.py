@@ -0,0 +1,322 @@
+"""Avatar proxy: /avatars/<user_id> serves a user's image as a thumbnail.
+
+The first request for a (image URL, size) pair fetches the image with
+AVATAR_FETCHER (default: urllib, http(s) only, AVATAR_MAX_BYTES at most,
+and only from public addresses, redirects included), scales it down with
+Pillow when it is installed and stores the result on disk under the
+SHA-256 of its bytes, so users sharing an image share the file. A small
+index file maps the pair to that hash. A pair that could not be fetched is
+marked failed in its index file for AVATAR_FAILURE_TTL seconds, during
+which requests go straight to the image URL without fetching it again.
+
+Pages link avatars through avatar_url(), whose ?v= changes with the image
+URL, so responses can be cached for a year; the hash doubles as the ETag.
+Adding or editing a user warms the cache in the background.
+"""
+
+import hashlib
+import http.client
+import io
+import ipaddress
+import logging
+import os
+import socket
+import tempfile
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+from flask import (Blueprint, abort, current_app, redirect, request,
+                   send_file, url_for)
+
+from models import db, User
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; images are then served as fetched
+    Image = None
+
+SIZES = (40, 160)
+DEFAULT_SIZE = 160
+MAX_AGE = 365 * 24 * 3600
+EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif',
+              'image/webp': 'webp'}
+MIMETYPES = {extension: mimetype for mimetype, extension in EXTENSIONS.items()}
+# Index file contents for a pair that could not be fetched
+FAILED = '-'
+
+log = logging.getLogger('blogly.avatars')
+
+
+class AvatarError(Exception):
+    """The image could not be fetched or is not an image"""
+
+
+def public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                      source_address=None):
+    """socket.create_connection() that refuses hosts resolving to anything
+    but public addresses (loopback, private, link-local, ...)"""
+    host, port = address
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError) as e:
+        raise AvatarError(f'Could not resolve {host}: {e}') from e
+    for *_, sockaddr in infos:
+        ip = ipaddress.ip_address(sockaddr[0].split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise AvatarError(f'Not a public address: {host} ({ip})')
+    # Connect to the addresses checked, not to a second lookup's
+    error = None
+    for family, kind, proto, _, sockaddr in infos:
+        sock = socket.socket(family, kind, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+def opener():
+    """urllib opener for http(s) only, without proxies, whose every
+    connection (each redirect's too) goes to a public address"""
+    director = urllib.request.OpenerDirector()
+    for handler in (PublicHTTPHandler(), PublicHTTPSHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(),
+                    urllib.request.HTTPRedirectHandler(),
+                    urllib.request.HTTPErrorProcessor()):
+        director.add_handler(handler)
+    return director
+
+
+def fetch_url(url, timeout, max_bytes):
+    """Default fetcher: (bytes, content type) of an http(s) URL"""
+    if urlsplit(url).scheme not in ('http', 'https'):
+        raise AvatarError(f'Not an http(s) URL: {url}')
+    request = urllib.request.Request(url, headers={'User-Agent': 'Blogly'})
+    try:
+        with opener().open(request, timeout=timeout) as response:
+            data = response.read(max_bytes + 1)
+            content_type = response.headers.get_content_type()
+    except OSError as e:
+        raise AvatarError(f'Could not fetch {url}: {e}') from e
+    if len(data) > max_bytes:
+        raise AvatarError(f'Larger than {max_bytes} bytes: {url}')
+    return data, content_type
+
+
+def sniff(data):
+    """Extension of the image format data starts with, or None"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def thumbnail(data, content_type, size):
+    """(bytes, extension) of the image scaled to fit size x size pixels"""
+    if Image is None:
+        # Served as is, so as what the bytes are, whatever the remote said
+        extension = sniff(data)
+        if extension is None:
+            raise AvatarError(f'Not an image: {content_type}')
+        return data, extension
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+    except Exception as e:
+        raise AvatarError(f'Not an image: {e}') from e
+    out = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(out, 'PNG', optimize=True)
+        return out.getvalue(), 'png'
+    image.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue(), 'jpg'
+
+
+def version(image_url):
+    """Short hash of an image URL, for cache-busting avatar links"""
+    return hashlib.sha256(image_url.encode()).hexdigest()[:12]
+
+
+def avatar_url(user_id, image_url, size=DEFAULT_SIZE):
+    """Link to a user's avatar thumbnail (a template global)"""
+    return url_for('avatars.avatar', user_id=user_id, s=size,
+                   v=version(image_url))
+
+
+class AvatarStore:
+    """Content-addressed thumbnails in directory:
+    objects/<hash[:2]>/<hash>.<ext> and index/<url hash>-<size>"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _index_path(self, image_url, size):
+        key = hashlib.sha256(image_url.encode()).hexdigest()
+        return os.path.join(self.directory, 'index', f'{key}-{size}')
+
+    def _object_path(self, name):
+        return os.path.join(self.directory, 'objects', name[:2], name)
+
+    def _write(self, path, data):
+        # Write then rename, so readers never see a partial file; a temporary
+        # file of its own, as request and prewarm threads may write the same
+        # path at once
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def lookup(self, image_url, size, failure_ttl=0):
+        """(path, object name) of a stored thumbnail, or None; raises
+        AvatarError for a pair marked failed less than failure_ttl
+        seconds ago"""
+        index = self._index_path(image_url, size)
+        try:
+            with open(index) as f:
+                name = f.read().strip()
+            if name == FAILED:
+                if time.time() - os.path.getmtime(index) < failure_ttl:
+                    raise AvatarError(f'Failed recently: {image_url}')
+                return None
+        except FileNotFoundError:
+            return None
+        path = self._object_path(name)
+        return (path, name) if os.path.exists(path) else None
+
+    def store(self, image_url, size, data, extension):
+        name = f'{hashlib.sha256(data).hexdigest()}.{extension}'
+        path = self._object_path(name)
+        if not os.path.exists(path):
+            self._write(path, data)
+        self._write(self._index_path(image_url, size), name.encode())
+        return path, name
+
+    def fail(self, image_url, size):
+        """Mark the pair failed, from now"""
+        self._write(self._index_path(image_url, size), FAILED.encode())
+
+
+def store():
+    return current_app.extensions['avatars']
+
+
+def get(image_url, size):
+    """(path, object name) of the thumbnail, fetching it on a miss"""
+    avatars = store()
+    config = current_app.config
+    found = avatars.lookup(image_url, size, config['AVATAR_FAILURE_TTL'])
+    if found is not None:
+        return found
+    fetcher = config['AVATAR_FETCHER'] or fetch_url
+    try:
+        data, content_type = fetcher(image_url, config['AVATAR_FETCH_TIMEOUT'],
+                                     config['AVATAR_MAX_BYTES'])
+        data, extension = thumbnail(data, content_type, size)
+    except AvatarError:
+        avatars.fail(image_url, size)
+        raise
+    return avatars.store(image_url, size, data, extension)
+
+
+def warm(image_url):
+    """Fetch every size of an image ahead of the first page view"""
+    for size in SIZES:
+        try:
+            get(image_url, size)
+        except AvatarError as e:
+            log.warning('Avatar not cached: %s', e)
+            return
+
+
+def prewarm(user):
+    """Warm user's avatar in the background"""
+    if current_app.config['AVATAR_PREWARM']:
+        current_app.extensions['jobs'].call(warm, user.image_url)
+
+
+def init_app(app):
+    app.config.setdefault('AVATAR_CACHE_DIR', None)
+    app.config.setdefault('AVATAR_FETCHER', None)
+    app.config.setdefault('AVATAR_FETCH_TIMEOUT', 5)
+    app.config.setdefault('AVATAR_MAX_BYTES', 5 * 1024 * 1024)
+    app.config.setdefault('AVATAR_FAILURE_TTL', 300)
+    app.config.setdefault('AVATAR_PREWARM', True)
+    directory = (app.config['AVATAR_CACHE_DIR']
+                 or os.path.join(app.instance_path, 'avatars'))
+    app.extensions['avatars'] = AvatarStore(directory)
+    app.add_template_global(avatar_url)
+    app.register_blueprint(avatars_bp)
+
+
+avatars_bp = Blueprint('avatars', __name__)
+
+
+@avatars_bp.route('/avatars/<int:user_id>')
+def avatar(user_id):
+    """The user's image as a thumbnail of ?s= pixels"""
+    size = request.args.get('s', DEFAULT_SIZE, type=int)
+    if size not in SIZES:
+        abort(400)
+    user = db.session.get(User, user_id)
+    if user is None:
+        abort(404)
+    try:
+        path, name = get(user.image_url, size)
+    except AvatarError as e:
+        log.warning('Avatar not cached: %s', e)
+        if urlsplit(user.image_url).scheme not in ('http', 'https'):
+            abort(404)
+        return redirect(user.image_url)
+    response = send_file(path, mimetype=MIMETYPES[name.rsplit('.', 1)[1]],
+                         etag=name.split('.')[0], conditional=True,
+                         max_age=MAX_AGE)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    # The link changes with the image URL (?v=), so the response never does
+    if request.args.get('v') == version(user.image_url):
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+    return response
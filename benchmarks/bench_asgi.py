@@ -0,0 +1,239 @@
+"""Benchmark throughput of the WSGI and ASGI deployments under high concurrency.
+
+    python benchmarks/bench_asgi.py
+    python benchmarks/bench_asgi.py --database-url postgresql:///blogly_bench
+    python benchmarks/bench_asgi.py --concurrency 256 --workers 2 --duration 20
+
+Seeds the database with seed.py's synthetic data (dropping any existing
+tables), then serves the production config on a local port twice: as WSGI
+(gunicorn with --threads ASGI_THREADS if it is installed, otherwise
+Werkzeug's threaded server in one process) and as ASGI (uvicorn running
+asgi:create_asgi_app). Each server gets --concurrency keep-alive
+connections sending GETs to --paths for --duration seconds.
+
+For each it reports requests per second, latency percentiles and requests
+per CPU-second of the server (its processes' user and system time, read
+when it exits, so including startup and a second of warm-up): that is requests per second per core, the figure to
+compare when the database rather than Python is the bottleneck. The point
+of the ASGI mode shows on Postgres, where prefetching waits on asyncpg
+without holding a thread; on SQLite both spend their time in Python.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+from config import ProductionConfig
+from models import db
+import seed
+
+WERKZEUG_SERVER = r'''
+import logging, sys
+from werkzeug.serving import WSGIRequestHandler, run_simple
+from app import create_app
+# Keep-alive, like gunicorn and uvicorn
+WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+run_simple('127.0.0.1', int(sys.argv[1]), create_app('production'),
+           threaded=True)
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(kind, port, workers, threads):
+    """argv of a server for kind 'wsgi' or 'asgi' and its description"""
+    if kind == 'asgi':
+        return ([sys.executable, '-m', 'uvicorn', '--factory',
+                 'asgi:create_asgi_app', '--port', str(port),
+                 '--workers', str(workers), '--log-level', 'warning',
+                 '--no-access-log'],
+                f'uvicorn, {workers} workers')
+    if importlib.util.find_spec('gunicorn') is not None:
+        return ([sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                 '--workers', str(workers), '--threads', str(threads),
+                 '--log-level', 'warning', "app:create_app('production')"],
+                f'gunicorn, {workers} workers x {threads} threads')
+    return ([sys.executable, '-c', WERKZEUG_SERVER, str(port)],
+            'werkzeug threaded server, 1 process')
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('the server exited during startup')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'the server did not listen on port {port}')
+
+
+def stop(process):
+    """Stop a server; its (and its reaped workers') CPU seconds"""
+    process.send_signal(signal.SIGTERM)
+    try:
+        _, _, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return None
+    process.returncode = 0
+    return usage.ru_utime + usage.ru_stime
+
+
+async def read_response(reader):
+    """(status, keep-alive) of one response, its body read and discarded"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def connection(port, paths, deadline, offset, latencies, errors):
+    """Send requests over one connection, reconnecting when it closes"""
+    writer = None
+    n = offset
+    while time.monotonic() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        path = paths[n % len(paths)]
+        n += 1
+        start = time.perf_counter()
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n'
+                     f'Connection: keep-alive\r\n\r\n'.encode())
+        try:
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors.append(None)
+            writer.close()
+            writer = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(status)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def load(port, paths, concurrency, duration):
+    """(latencies, errors, elapsed seconds) of --duration seconds of load"""
+    latencies, errors = [], []
+    start = time.monotonic()
+    await asyncio.gather(*(
+        connection(port, paths, start + duration, i, latencies, errors)
+        for i in range(concurrency)))
+    return latencies, errors, time.monotonic() - start
+
+
+def percentile(values, p):
+    """The pth percentile of a sorted list (nearest rank)"""
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def run(kind, args, env):
+    port = free_port()
+    command, description = server_command(kind, port, args.workers,
+                                          ProductionConfig.ASGI_THREADS)
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    try:
+        wait_for_port(port, process)
+        # Warm up: connections, template and fragment caches
+        warmup, _, _ = asyncio.run(load(port, args.paths, args.concurrency, 1))
+        latencies, errors, elapsed = asyncio.run(
+            load(port, args.paths, args.concurrency, args.duration))
+    finally:
+        cpu = stop(process)
+    latencies.sort()
+    requests = len(latencies)
+    return {'server': description,
+            'rps': requests / elapsed,
+            # The CPU time covers startup and warm-up too
+            'per_core': (requests + len(warmup)) / cpu if cpu else float('nan'),
+            'p50_ms': percentile(latencies, 50) * 1000 if latencies else 0,
+            'p99_ms': percentile(latencies, 99) * 1000 if latencies else 0,
+            'errors': len(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/blogly_asgi.db')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=128,
+                        help='open connections sending requests')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of load per server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='server worker processes')
+    parser.add_argument('--paths', nargs='+',
+                        default=['/users', '/posts/1', '/posts/2', '/posts/3'],
+                        help='paths requested in turn')
+    parser.add_argument('--modes', nargs='+', default=['wsgi', 'asgi'],
+                        choices=['wsgi', 'asgi'])
+    args = parser.parse_args()
+
+    if 'asgi' in args.modes and importlib.util.find_spec('uvicorn') is None:
+        print('uvicorn is not installed; skipping the ASGI server')
+        args.modes.remove('asgi')
+
+    config = type('BenchConfig', (ProductionConfig,),
+                  {'SQLALCHEMY_DATABASE_URI': args.database_url})
+    app = create_app(config)
+    with app.app_context():
+        start = time.perf_counter()
+        db.drop_all()
+        db.create_all()
+        seed.seed_synthetic(args.users, args.posts, args.tags)
+        print(f'seeded {args.users} users, {args.posts} posts and '
+              f'{args.tags} tags in {time.perf_counter() - start:.1f}s')
+        db.session.remove()
+        db.engine.dispose()
+
+    env = dict(os.environ, BLOGLY_ENV='production',
+               DATABASE_URL=args.database_url, METRICS_SAMPLE_RATE='0')
+    print(f'{args.concurrency} connections, {args.duration:g}s per server, '
+          f'paths {" ".join(urllib.parse.quote(p) for p in args.paths)}')
+    print(f'{"mode":<6}{"req/s":>10}{"req/CPU-s":>11}{"p50 ms":>9}'
+          f'{"p99 ms":>9}{"errors":>8}  server')
+    for kind in args.modes:
+        row = run(kind, args, env)
+        print(f'{kind:<6}{row["rps"]:>10.1f}{row["per_core"]:>11.1f}'
+              f'{row["p50_ms"]:>9.2f}{row["p99_ms"]:>9.2f}{row["errors"]:>8}'
+              f'  {row["server"]}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Benchmark response compression and whitespace collapsing on large pages.
+
+    python benchmarks/bench_compression.py
+    python benchmarks/bench_compression.py --posts 20000 --tags 2000 --requests 200
+
+Seeds a temporary SQLite database (or --database-url, whose tables are
+dropped) and requests the listings with a row per post or tag, at
+MAX_PAGE_SIZE rows, through the Flask test client with each of:
+
+    plain       templates as written, no compression
+    collapsed   TEMPLATE_COLLAPSE_WHITESPACE, no compression
+    gzip        collapsed, gzip at COMPRESS_LEVEL
+    br          collapsed, brotli at COMPRESS_BROTLI_QUALITY (if installed)
+
+For each it reports the body bytes sent and the CPU time per request
+(process time, so the whole request: query, render and compression). The
+fragment cache is off so every request renders its page.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+from config import ProductionConfig
+from models import db, Tag
+import compression
+import feed
+import seed
+
+MODES = [
+    ('plain', {'TEMPLATE_COLLAPSE_WHITESPACE': False}, None),
+    ('collapsed', {}, None),
+    ('gzip', {}, 'gzip'),
+    ('br', {}, 'br'),
+]
+
+
+def paths(user_id, tag_id, per_page):
+    return [f'/posts?per_page={per_page}', f'/tags/new?per_page={per_page}',
+            f'/tags/{tag_id}/edit?per_page={per_page}', f'/tags?per_page={per_page}',
+            f'/users/{user_id}/posts/new']
+
+
+def measure(client, path, encoding, requests):
+    """(body bytes, CPU ms per request)"""
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    size = len(client.get(path, headers=headers).get_data())
+    start = time.process_time()
+    for _ in range(requests):
+        client.get(path, headers=headers).get_data()
+    return size, (time.process_time() - start) / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--tags', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        base = {
+            'SQLALCHEMY_DATABASE_URI': (args.database_url or
+                                        f'sqlite:///{directory}/bench.db'),
+            'CACHE_BACKEND': 'null', 'TEMPLATE_BYTECODE_CACHE': False,
+            'INSTRUMENTATION': False, 'VIEW_FLUSH_SECONDS': 0,
+        }
+        app = create_app(type('BenchConfig', (ProductionConfig,), base))
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed.seed_synthetic(users=args.users, posts=args.posts,
+                                tags=args.tags, fanout=3, seed=0)
+            feed.rebuild()
+            tag_id = Tag.query.order_by(Tag.id).first().id
+            per_page = app.config['MAX_PAGE_SIZE']
+            db.session.remove()
+
+        results = {}
+        for name, overrides, encoding in MODES:
+            if encoding == 'br' and compression.brotli is None:
+                continue
+            mode_app = create_app(type('BenchConfig', (ProductionConfig,),
+                                       {**base, **overrides}))
+            with mode_app.test_client() as client:
+                for path in paths(1, tag_id, per_page):
+                    results[path, name] = measure(client, path, encoding,
+                                                  args.requests)
+            with mode_app.app_context():
+                db.session.remove()
+
+        names = [name for name, _, _ in MODES if any(
+            key[1] == name for key in results)]
+        print(f'{args.posts} posts, {args.tags} tags, {per_page} rows a page; '
+              'bytes / CPU ms per request')
+        print(f'{"path":<34}' + ''.join(f'{name:>18}' for name in names))
+        for path in paths(1, tag_id, per_page):
+            cells = ''.join(f'{results[path, name][0]:>10,}'
+                            f'{results[path, name][1]:>7.2f}ms'
+                            for name in names)
+            print(f'{path:<34}{cells}')
+        if not args.database_url:
+            with app.app_context():
+                db.drop_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
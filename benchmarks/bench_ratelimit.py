@@ -0,0 +1,95 @@
+"""Microbenchmark the rate limiter: time per bucket hit and per request.
+
+    python benchmarks/bench_ratelimit.py
+    python benchmarks/bench_ratelimit.py --clients 100000 --calls 500000
+
+Times MemoryBuckets.hit() and SharedBuckets.hit() (on a temporary file)
+with the two buckets a write request takes, spread over --clients client
+addresses, and RateLimiter.check() as it runs before every POST: inside a
+request context, reading the config and building the bucket keys. The
+rates are high enough that every call is admitted, the slower path.
+
+Exits with status 1 if check() takes more than --budget microseconds.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import create_app
+from config import ProductionConfig
+from ratelimit import MemoryBuckets, SharedBuckets, RateLimiter, fcntl
+
+
+def addresses(count):
+    return [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(count)]
+
+
+def time_hits(backend, clients, calls):
+    """Microseconds per hit() of a request's two buckets"""
+    limits = [[(f'{client} blogly.add_new_user', 1e6, 1e6), (client, 1e6, 1e6)]
+              for client in clients]
+    start = time.perf_counter()
+    for n in range(calls):
+        backend.hit(limits[n % len(limits)])
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def time_checks(app, limiter, clients, calls):
+    """Microseconds per RateLimiter.check() of a POST"""
+    contexts = [app.test_request_context('/users/new', method='POST',
+                                         environ_base={'REMOTE_ADDR': client})
+                for client in clients[:1000]]
+    elapsed = 0
+    per_context = max(1, calls // len(contexts))
+    for context in contexts:
+        with context:
+            start = time.perf_counter()
+            for _ in range(per_context):
+                limiter.check()
+            elapsed += time.perf_counter() - start
+    return elapsed / (per_context * len(contexts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--budget', type=float, default=50,
+                        help='microseconds allowed per check()')
+    args = parser.parse_args()
+
+    clients = addresses(args.clients)
+    print(f'{args.calls} calls over {args.clients} clients')
+    print(f'{"backend":<10}{"hit() us":>10}{"check() us":>12}')
+    worst = 0
+    backends = ['memory'] + (['shared'] if fcntl else [])
+    with tempfile.TemporaryDirectory() as directory:
+        for name in backends:
+            config = type('BenchConfig', (ProductionConfig,), {
+                'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                'RATELIMIT_BACKEND': name,
+                'RATELIMIT_SHARED_PATH': os.path.join(directory, 'buckets'),
+                'RATELIMIT_RATE': 1e6, 'RATELIMIT_BURST': 10 ** 6,
+                'RATELIMIT_IP_RATE': 1e6, 'RATELIMIT_IP_BURST': 10 ** 6})
+            app = create_app(config)
+            limiter = RateLimiter(app)
+            backend = (MemoryBuckets() if name == 'memory' else
+                       SharedBuckets(os.path.join(directory, 'hits')))
+            hit = time_hits(backend, clients, args.calls)
+            check = time_checks(app, limiter, clients, args.calls)
+            worst = max(worst, check)
+            print(f'{name:<10}{hit:>10.2f}{check:>12.2f}')
+    if worst > args.budget:
+        print(f'check() over budget: {worst:.2f} us > {args.budget:g} us')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
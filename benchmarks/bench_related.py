@@ -0,0 +1,114 @@
+"""Benchmark rebuilding the related posts: sparse matrix products vs Python.
+
+    python benchmarks/bench_related.py
+    python benchmarks/bench_related.py --posts 100000 --tags 1000
+    python benchmarks/bench_related.py --python-posts 0
+
+Generates --posts posts with --fanout distinct tags each (on average) out
+of --tags, tag popularity following a Zipf law as real tags do, and times
+related.top_related() on them: the NumPy/SciPy path on every post, and the
+pure-Python fallback on the first --python-posts posts only, as it is
+much slower (and NumPy again on those, for comparison). Tags on more than --max-tag-posts posts are
+left out as in related.rebuild(). Reading posts_tags and writing
+related_posts are not timed; they are the same for both paths.
+"""
+
+import argparse
+import math
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import related
+
+
+def generate_pairs(posts, tags, fanout, seed):
+    """(post id, tag id) pairs with Zipf-distributed tag popularity"""
+    np = related.np
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(fanout - 1, posts) + 1
+    post_ids = np.repeat(np.arange(1, posts + 1), counts)
+    ranks = np.arange(1, tags + 1)
+    popularity = 1 / ranks
+    tag_ids = rng.choice(ranks, size=len(post_ids), p=popularity / popularity.sum())
+    return np.unique(np.stack([post_ids, tag_ids], axis=1), axis=0)
+
+
+def counted(pairs, max_tag_posts):
+    """The pairs of tags on at most max_tag_posts posts, and their weights"""
+    np = related.np
+    tag_posts = np.bincount(pairs[:, 1])
+    kept = pairs[tag_posts[pairs[:, 1]] <= max_tag_posts]
+    top = int(pairs[:, 0].max())
+    weights = {tag_id: math.log(1 + top / count)
+               for tag_id, count in enumerate(tag_posts.tolist())
+               if 0 < count <= max_tag_posts}
+    return kept, weights
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def timed(pairs, weights, count):
+    start = time.perf_counter()
+    rows = sum(1 for _ in related.top_related(pairs, weights, count))
+    return rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1_000_000)
+    parser.add_argument('--tags', type=int, default=10_000)
+    parser.add_argument('--fanout', type=float, default=3,
+                        help='average tags per post')
+    parser.add_argument('--max-tag-posts', type=int,
+                        default=related.DEFAULT_MAX_TAG_POSTS)
+    parser.add_argument('--count', type=int, default=related.DEFAULT_RELATED_POSTS,
+                        help='related posts kept per post')
+    parser.add_argument('--python-posts', type=int, default=20_000,
+                        help='posts to run the pure-Python path on (0: skip)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if related.np is None:
+        print('NumPy and SciPy are not installed')
+        return 1
+
+    start = time.perf_counter()
+    pairs, weights = counted(generate_pairs(args.posts, args.tags, args.fanout,
+                                            args.seed), args.max_tag_posts)
+    print(f'{args.posts} posts, {args.tags} tags: {len(pairs)} counted '
+          f'pairs on {len(weights)} tags, generated in '
+          f'{time.perf_counter() - start:.1f}s')
+
+    pair_list = [tuple(pair) for pair in pairs.tolist()]
+    rows, seconds = timed(pair_list, weights, args.count)
+    print(f'numpy   {args.posts:>9} posts {seconds:>8.2f}s '
+          f'{args.posts / seconds:>10,.0f} posts/s {rows:>9} rows')
+
+    if args.python_posts:
+        subset = [pair for pair in pair_list if pair[0] <= args.python_posts]
+        with_numpy, numpy_seconds = timed(subset, weights, args.count)
+        saved, related.np = related.np, None
+        try:
+            rows, seconds = timed(subset, weights, args.count)
+        finally:
+            related.np = saved
+        print(f'numpy   {args.python_posts:>9} posts {numpy_seconds:>8.2f}s '
+              f'{args.python_posts / numpy_seconds:>10,.0f} posts/s '
+              f'{with_numpy:>9} rows')
+        print(f'python  {args.python_posts:>9} posts {seconds:>8.2f}s '
+              f'{args.python_posts / seconds:>10,.0f} posts/s {rows:>9} rows')
+    print(f'peak RSS {peak_rss_mb():.1f} MB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
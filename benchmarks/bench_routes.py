@@ -0,0 +1,355 @@
+"""Benchmark every route: latency percentiles, queries per request, peak RSS.
+
+    python benchmarks/bench_routes.py
+    python benchmarks/bench_routes.py --users 1000 --posts 100000 --tags 200
+    python benchmarks/bench_routes.py --database-url postgresql:///blogly_bench
+    python benchmarks/bench_routes.py --save-baseline
+
+Seeds the database with seed.py's deterministic synthetic data (dropping
+any existing tables), then sends --requests requests to each route, first
+through the Flask test client and then over HTTP to a local WSGI server
+running in a thread. Routes that delete something are given a fresh row to
+delete on every request; creating it is not timed.
+
+The results are compared with benchmarks/baseline.json: more queries per
+request, or a p95 latency or peak RSS more than --tolerance above the
+baseline, counts as a regression and makes the script exit with status 1.
+Run it with the same sizes as the baseline (they are stored in it); the
+latencies in the committed baseline come from a laptop-class machine, so
+regenerate it with --save-baseline before comparing on other hardware.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import current_app
+from werkzeug.serving import make_server
+
+from app import create_app
+from config import ProductionConfig
+from models import db, User, Post, Tag, PostTag, Job
+from queries import count_queries
+import assets
+import seed
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+
+class Fixtures:
+    """Ids of seeded rows for the routes to use, and throwaway rows for the
+    routes that delete them"""
+
+    def __init__(self, posts):
+        # seed.py gives user 1 and the first generated tag the most posts
+        self.user_id = 1
+        self.tag_name = seed.tag_name(0)
+        self.tag_id = Tag.query.filter_by(name=self.tag_name).one().id
+        self.post_id = posts
+        self.stylesheet = current_app.extensions['assets'].manifest['style.css']
+        self.counter = itertools.count(1)
+        db.session.commit()
+
+    def unique(self, prefix):
+        return f'{prefix} {next(self.counter)}'
+
+    def _add(self, obj):
+        # Read the id before committing, so no read transaction is left
+        # open to block the server thread's writes on SQLite
+        db.session.add(obj)
+        db.session.flush()
+        obj_id = obj.id
+        db.session.commit()
+        return obj_id
+
+    def make_user(self):
+        user_id = self._add(User(first_name='Doomed', last_name='User'))
+        db.session.execute(Post.__table__.insert(), [
+            {'title': f'Post {n}', 'content': 'Soon gone', 'user_id': user_id}
+            for n in range(5)])
+        db.session.commit()
+        return user_id
+
+    def make_post(self):
+        post_id = self._add(Post(title='Doomed post', content='Soon gone',
+                                 user_id=self.user_id))
+        db.session.execute(PostTag.__table__.insert(), [
+            {'post_id': post_id, 'tag_id': self.tag_id}])
+        db.session.commit()
+        return post_id
+
+    def make_tag(self):
+        tag_id = self._add(Tag(name=self.unique('Doomed')))
+        db.session.execute(PostTag.__table__.insert(), [
+            {'post_id': post_id, 'tag_id': tag_id}
+            for post_id in range(1, min(self.post_id, 20) + 1)])
+        db.session.commit()
+        return tag_id
+
+    def make_job(self):
+        return self._add(Job(kind='delete_tag', target_id=0, status='done'))
+
+
+# endpoint -> (method, function of Fixtures returning (path, form data))
+ROUTES = {
+    'blogly.create_user': ('GET', lambda f: ('/', None)),
+    'blogly.list_users': ('GET', lambda f: ('/users', None)),
+    'blogly.user_details': ('GET', lambda f: (f'/users/{f.user_id}', None)),
+    'blogly.new_user_form': ('GET', lambda f: ('/users/new', None)),
+    'blogly.add_new_user': ('POST', lambda f: (
+        '/users/new', {'first_name': 'Bench', 'last_name': f.unique('Mark'),
+                       'image_url': ''})),
+    'blogly.edit_user_form': ('GET', lambda f: (f'/users/{f.user_id}/edit', None)),
+    'blogly.edit_user': ('POST', lambda f: (
+        f'/users/{f.user_id}/edit', {'first_name': '', 'last_name': '',
+                                     'image_url': ''})),
+    'blogly.delete_user': ('POST', lambda f: (
+        f'/users/{f.make_user()}/delete', {})),
+    'blogly.new_post_form': ('GET', lambda f: (
+        f'/users/{f.user_id}/posts/new', None)),
+    'blogly.add_new_post': ('POST', lambda f: (
+        f'/users/{f.user_id}/posts/new',
+        {'title': f.unique('Bench'), 'content': 'Benchmark post',
+         str(f.tag_id): 'on'})),
+    'blogly.all_posts': ('GET', lambda f: ('/posts', None)),
+    'blogly.show_post': ('GET', lambda f: (f'/posts/{f.post_id}', None)),
+    'blogly.edit_post_form': ('GET', lambda f: (f'/posts/{f.post_id}/edit', None)),
+    'blogly.edit_post': ('POST', lambda f: (
+        f'/posts/{f.post_id}/edit', {'title': '', 'content': '',
+                                     str(f.tag_id): 'on'})),
+    'blogly.delete_post': ('POST', lambda f: (
+        f'/posts/{f.make_post()}/delete', {})),
+    'blogly.show_tags': ('GET', lambda f: ('/tags', None)),
+    'blogly.tag_cloud': ('GET', lambda f: ('/tags/cloud', None)),
+    'blogly.new_tag': ('GET', lambda f: ('/tags/new', None)),
+    'blogly.add_tag': ('POST', lambda f: ('/tags/new', {'name': f.unique('Bench')})),
+    'blogly.tag_details': ('GET', lambda f: (f'/tags/{f.tag_id}', None)),
+    'blogly.tag_edit_form': ('GET', lambda f: (f'/tags/{f.tag_id}/edit', None)),
+    'blogly.edit_tag': ('POST', lambda f: (
+        f'/tags/{f.tag_id}/edit', {'name': f.tag_name,
+                                   'shown_posts': ''})),
+    'blogly.delete_tag': ('POST', lambda f: (f'/tags/{f.make_tag()}/delete', {})),
+    'blogly.search': ('GET', lambda f: ('/search?q=jazz+piano', None)),
+    'blogly.search_json': ('GET', lambda f: ('/search.json?q=jazz', None)),
+    'api.list_users': ('GET', lambda f: ('/api/v1/users', None)),
+    'api.get_user': ('GET', lambda f: (f'/api/v1/users/{f.user_id}?include=posts', None)),
+    'api.list_posts': ('GET', lambda f: ('/api/v1/posts?include=tags,user', None)),
+    'api.get_post': ('GET', lambda f: (f'/api/v1/posts/{f.post_id}', None)),
+    'api.list_tags': ('GET', lambda f: ('/api/v1/tags', None)),
+    'api.get_tag': ('GET', lambda f: (f'/api/v1/tags/{f.tag_id}?include=posts', None)),
+    'metrics.metrics': ('GET', lambda f: ('/metrics', None)),
+    'jobs.show_job': ('GET', lambda f: (f'/jobs/{f.make_job()}', None)),
+    'avatars.avatar': ('GET', lambda f: (f'/avatars/{f.user_id}?s=40', None)),
+    'assets.asset': ('GET', lambda f: (f'/assets/{f.stylesheet}', None)),
+}
+
+
+def blank_avatar(url, timeout, max_bytes):
+    """Avatar fetcher that stays off the network: a 1x1 GIF"""
+    return (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00!'
+            b'\xf9\x04\x00\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01'
+            b'\x00\x00\x02\x02D\x01\x00;', 'image/gif')
+
+
+def make_app(url):
+    config = type('BenchConfig', (ProductionConfig,),
+                  {'SQLALCHEMY_DATABASE_URI': url,
+                   # As in TestingConfig: measure the routes, not the limiter,
+                   # and no flusher thread writing views between requests
+                   'RATELIMIT_ENABLED': False,
+                   'VIEW_FLUSH_SECONDS': 0,
+                   # One process, so its simple cache cannot go stale: keep
+                   # the cache hits of the baseline
+                   'CACHE_TTL': 300, 'CACHE_WARN_PER_PROCESS': False,
+                   'AVATAR_FETCHER': blank_avatar,
+                   'AVATAR_CACHE_DIR': tempfile.mkdtemp(prefix='blogly-avatars-'),
+                   'ASSETS_DIR': tempfile.mkdtemp(prefix='blogly-assets-')})
+    app = create_app(config)
+    # As the deploy step would: the pages link the built files
+    assets.build(app.static_folder, app.config['ASSETS_DIR'])
+    app.extensions['assets'].reload()
+    return app
+
+
+def percentile(values, p):
+    """The pth percentile of a sorted list (nearest rank)"""
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def client_sender(app):
+    client = app.test_client()
+
+    def send(method, path, data):
+        return client.open(path, method=method, data=data).status_code
+    return send, lambda: None
+
+
+def server_sender(app):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=False)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_port
+
+    def send(method, path, data):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        body = urllib.parse.urlencode(data) if data is not None else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return response.status
+    return send, server.shutdown
+
+
+def run_route(send, fixtures, method, build, requests, warmup):
+    """Latencies (sorted, seconds), SQL statements and errors for one route"""
+    times, statements, errors = [], 0, 0
+    for n in range(warmup + requests):
+        path, data = build(fixtures)
+        with count_queries() as counter:
+            start = time.perf_counter()
+            status = send(method, path, data)
+            elapsed = time.perf_counter() - start
+        if n < warmup:
+            continue
+        times.append(elapsed)
+        statements += len(counter)
+        errors += status >= 400
+    times.sort()
+    return {'p50_ms': percentile(times, 50) * 1000,
+            'p95_ms': percentile(times, 95) * 1000,
+            'p99_ms': percentile(times, 99) * 1000,
+            'queries': statements / requests,
+            'errors': errors}
+
+
+def compare(results, baseline, tolerance):
+    """Human-readable regressions of results against baseline"""
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = results['routes'].get(name)
+        if current is None:
+            continue
+        if current['queries'] > base['queries'] + 1e-9:
+            regressions.append(f'{name}: {current["queries"]:.2f} queries per '
+                               f'request, baseline {base["queries"]:.2f}')
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {current["p95_ms"]:.2f} ms, '
+                               f'baseline {base["p95_ms"]:.2f} ms')
+        if current['errors'] > base['errors']:
+            regressions.append(f'{name}: {current["errors"]} error responses')
+    if results['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f'peak RSS {results["peak_rss_mb"]:.1f} MB, '
+                           f'baseline {baseline["peak_rss_mb"]:.1f} MB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/blogly_routes.db')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--tags', type=int, default=50)
+    parser.add_argument('--fanout', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='timed requests per route and mode')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--modes', nargs='+', default=['client', 'server'],
+                        choices=['client', 'server'])
+    parser.add_argument('--routes', nargs='+', metavar='ENDPOINT',
+                        help='only these endpoints (default: all)')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed fractional increase in p95 and RSS')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results to --baseline')
+    parser.add_argument('--output', help='also write the results as JSON here')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    sizes = {'users': args.users, 'posts': args.posts, 'tags': args.tags,
+             'fanout': args.fanout, 'seed': args.seed,
+             'requests': args.requests}
+    with app.app_context():
+        start = time.perf_counter()
+        db.drop_all()
+        db.create_all()
+        seed.seed_synthetic(args.users, args.posts, args.tags, args.fanout,
+                            args.seed)
+        print(f'seeded {args.users} users, {args.posts} posts and '
+              f'{args.tags} tags in {time.perf_counter() - start:.1f}s')
+
+        endpoints = {rule.endpoint for rule in app.url_map.iter_rules()} - {'static'}
+        uncovered = sorted(endpoints - set(ROUTES))
+        if uncovered:
+            print(f'not benchmarked (add them to ROUTES): {", ".join(uncovered)}')
+
+        fixtures = Fixtures(args.posts)
+        results = {'sizes': sizes, 'database': db.engine.dialect.name,
+                   'routes': {}}
+        print(f'{"route":<42}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+              f'{"queries":>9}{"errors":>8}')
+        for mode in args.modes:
+            send, stop = (client_sender if mode == 'client' else server_sender)(app)
+            for endpoint in args.routes or ROUTES:
+                method, build = ROUTES[endpoint]
+                row = run_route(send, fixtures, method, build,
+                                args.requests, args.warmup)
+                name = f'{mode} {method} {endpoint}'
+                results['routes'][name] = row
+                print(f'{name:<42}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}'
+                      f'{row["p99_ms"]:>9.2f}{row["queries"]:>9.2f}'
+                      f'{row["errors"]:>8}')
+            stop()
+        results['peak_rss_mb'] = peak_rss_mb()
+        print(f'peak RSS {results["peak_rss_mb"]:.1f} MB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'saved baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline to compare with; run with --save-baseline')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('sizes') != sizes or baseline.get('database') != results['database']:
+        print('warning: the baseline was recorded with different sizes or '
+              f'database: {baseline.get("sizes")} on {baseline.get("database")}')
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print('no regressions against the baseline')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
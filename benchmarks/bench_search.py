@@ -0,0 +1,120 @@
+"""Benchmark post search: inverted index / tsvector against ILIKE scans.
+
+    python benchmarks/bench_search.py --posts 1000000
+    python benchmarks/bench_search.py --database-url postgresql:///blogly_bench
+
+Seeds the database with deterministic synthetic posts (dropping any
+existing tables), then times each query term with an ILIKE scan over title
+and content, with the pure-Python InvertedIndex and, on Postgres, with the
+search_vector GIN index.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import or_
+
+from models import db, connect_db, User, Post
+from search import InvertedIndex, search_posts
+
+NAMED = ('jazz saxophone python flask seed philosophy meaning life practice '
+         'cool query index posts tags users blog coffee music travel code '
+         'garden winter summer river mountain city night morning book').split()
+# A long-tailed vocabulary so that terms have realistic selectivity
+WORDS = NAMED + [f'word{n}' for n in range(20000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(WORDS))))
+QUERIES = ['jazz', 'philosophy meaning', 'garden', 'word1500', 'zebra']
+CHUNK = 10000
+
+
+def make_app(url):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    connect_db(app)
+    return app
+
+
+def seed(posts, rng):
+    db.drop_all()
+    db.create_all()
+    db.session.add(User(first_name='Bench', last_name='Mark'))
+    db.session.commit()
+    table = Post.__table__
+    for start in range(0, posts, CHUNK):
+        rows = [{'title': ' '.join(rng.choices(WORDS, cum_weights=CUM_WEIGHTS, k=3)),
+                 'content': ' '.join(rng.choices(WORDS, cum_weights=CUM_WEIGHTS, k=40)),
+                 'user_id': 1}
+                for _ in range(min(CHUNK, posts - start))]
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def ilike(q):
+    """Every matching post, as ranking them would need"""
+    query = db.session.query(Post.id, Post.title, Post.content)
+    for term in q.split():
+        pattern = f'%{term}%'
+        query = query.filter(or_(Post.title.ilike(pattern),
+                                 Post.content.ilike(pattern)))
+    return query.all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--database-url', default='sqlite:////tmp/blogly_bench.db')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='reuse the posts already in the database')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    with app.app_context():
+        if not args.no_seed:
+            start = time.perf_counter()
+            seed(args.posts, random.Random(args.seed))
+            print(f'seeded {args.posts} posts in {time.perf_counter() - start:.1f}s')
+
+        start = time.perf_counter()
+        index = InvertedIndex()
+        for post_id, title, content in (db.session.query(Post.id, Post.title, Post.content)
+                                        .yield_per(CHUNK)):
+            index.add(post_id, title, content)
+        print(f'built inverted index over {len(index)} posts '
+              f'in {time.perf_counter() - start:.1f}s')
+
+        postgres = db.engine.dialect.name == 'postgresql'
+        print(f'{"query":<22}{"matches":>10}{"ilike ms":>12}{"index ms":>12}'
+              + (f'{"tsvector ms":>14}' if postgres else ''))
+        for q in QUERIES:
+            ilike_time, matches = timed(lambda: ilike(q), args.repeat)
+            index_time, _ = timed(lambda: index.search(q, limit=20), args.repeat)
+            line = (f'{q:<22}{len(matches):>10}'
+                    f'{ilike_time * 1000:>12.2f}{index_time * 1000:>12.2f}')
+            if postgres:
+                ts_time, _ = timed(lambda: search_posts(q), args.repeat)
+                line += f'{ts_time * 1000:>14.2f}'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
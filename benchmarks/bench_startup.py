@@ -0,0 +1,73 @@
+"""Benchmark worker startup and per-request overhead for each config profile.
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --database-url postgresql:///blogly
+
+Each profile is measured in fresh subprocesses: the time to import the app
+and call create_app(), the first request, and the mean of the following
+requests to /users (SQL echo output is captured, not printed).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = r'''
+import json, os, sys, time, logging
+start = time.perf_counter()
+from app import create_app
+from models import db
+app = create_app(sys.argv[1])
+startup = time.perf_counter() - start
+logging.getLogger('sqlalchemy.engine').handlers[:] = [logging.NullHandler()]
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+start = time.perf_counter()
+client.get('/users')
+first = time.perf_counter() - start
+times = []
+for _ in range(int(sys.argv[2])):
+    start = time.perf_counter()
+    client.get('/users')
+    times.append(time.perf_counter() - start)
+print(json.dumps({'startup': startup, 'first': first,
+                  'request': sum(times) / len(times)}))
+'''
+
+
+def run(profile, requests, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url,
+               TEST_DATABASE_URL=database_url)
+    out = subprocess.run([sys.executable, '-c', WORKER, profile, str(requests)],
+                         cwd=ROOT, env=env, check=True, capture_output=True,
+                         text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:////tmp/blogly_startup.db')
+    parser.add_argument('--profiles', nargs='+',
+                        default=['development', 'production'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f'{"profile":<14}{"startup ms":>12}{"first req ms":>14}{"req ms":>10}')
+    for profile in args.profiles:
+        runs = [run(profile, args.requests, args.database_url)
+                for _ in range(args.runs)]
+        startup = statistics.median(r['startup'] for r in runs) * 1000
+        first = statistics.median(r['first'] for r in runs) * 1000
+        request = statistics.median(r['request'] for r in runs) * 1000
+        print(f'{profile:<14}{startup:>12.1f}{first:>14.2f}{request:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark counting post views: a write per view vs written behind.
+
+    python benchmarks/bench_views.py
+    python benchmarks/bench_views.py --views 200000 --posts 1000
+    python benchmarks/bench_views.py --database-url postgresql:///blogly_bench
+
+Seeds --posts posts (dropping any existing tables), then counts --views
+views spread over them with a Zipf law, as popular posts get most of the
+traffic: first with an UPDATE posts SET views = views + 1 committed per
+view, then with view_counter.record() per view and a view_counter.flush()
+every --flush-every views. Reports views per second and the statements
+each way sent to the database.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event
+
+from app import create_app
+from config import ProductionConfig
+from models import db, Post
+from counters import view_counter
+import seed
+
+
+def zipf_views(post_ids, count, rng):
+    weights = [1 / rank for rank in range(1, len(post_ids) + 1)]
+    return rng.choices(post_ids, weights=weights, k=count)
+
+
+class Statements:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.capture)
+
+    def capture(self, *args):
+        self.count += 1
+
+
+def per_view(views):
+    posts = Post.__table__
+    for post_id in views:
+        with db.engine.begin() as connection:
+            connection.execute(posts.update().where(posts.c.id == post_id)
+                               .values(views=posts.c.views + 1))
+
+
+def written_behind(views, flush_every):
+    for n, post_id in enumerate(views, 1):
+        view_counter.record(post_id)
+        if n % flush_every == 0:
+            view_counter.flush()
+    view_counter.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--views', type=int, default=20000)
+    parser.add_argument('--flush-every', type=int, default=1000,
+                        help='views between flushes (a flush interval)')
+    parser.add_argument('--database-url')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.database_url or f'sqlite:///{directory}/bench.db'
+        config = type('BenchConfig', (ProductionConfig,), {
+            'SQLALCHEMY_DATABASE_URI': url, 'VIEW_FLUSH_SECONDS': 0})
+        app = create_app(config)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            seed.seed_synthetic(users=10, posts=args.posts, tags=10, fanout=1,
+                                seed=args.seed)
+            post_ids = [post_id for (post_id,) in db.session.query(Post.id)]
+            db.session.commit()
+            views = zipf_views(post_ids, args.views, random.Random(args.seed))
+            statements = Statements(db.engine)
+            print(f'{args.views} views of {args.posts} posts')
+            print(f'{"":<16}{"views/s":>12}{"statements":>12}')
+            for name, run in (('per view', lambda: per_view(views)),
+                              ('written behind',
+                               lambda: written_behind(views, args.flush_every))):
+                statements.count = 0
+                start = time.perf_counter()
+                run()
+                seconds = time.perf_counter() - start
+                print(f'{name:<16}{args.views / seconds:>12,.0f}'
+                      f'{statements.count:>12}')
+            db.session.remove()
+            db.drop_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""Streaming bulk import and export of users, posts and tags.
+
+Records are read and written as NDJSON (one JSON object per line) or CSV,
+in bounded chunks, so neither direction holds a whole table in memory.
+Imports write each chunk with one COPY (Postgres with psycopg2) or one
+executemany INSERT; exports read through a server-side cursor.
+
+Post records name their tags, e.g.
+    {"title": "Jazz Time", "content": "...", "user_id": 2, "tags": ["Fun"]}
+and in CSV the tags column is "|"-separated. Unknown tag names are created.
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import time
+
+from sqlalchemy import func, select, text
+
+import markup
+from models import db, User, Post, Tag, PostTag
+
+DEFAULT_CHUNK_SIZE = 5000
+TAG_SEPARATOR = '|'
+
+COLUMNS = {
+    'users': ['id', 'first_name', 'last_name', 'image_url'],
+    'posts': ['id', 'title', 'content', 'created_at', 'user_id', 'tags'],
+    'tags': ['id', 'name'],
+}
+TABLES = {'users': User.__table__, 'posts': Post.__table__,
+          'tags': Tag.__table__}
+INT_FIELDS = {'id', 'user_id'}
+# Columns computed on import rather than read (see markup.py)
+RENDERED = {'posts': ['content_html', 'excerpt', 'content_hash']}
+
+
+class TransferStats:
+    """Rows moved and elapsed time for one import or export"""
+
+    def __init__(self):
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f'{self.rows} rows in {self.seconds:.1f}s '
+                f'({self.rows_per_second:,.0f} rows/s)')
+
+
+def chunked(iterable, size):
+    """Lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Readers and writers
+
+def _clean(record):
+    """Normalise a decoded record: ints, datetimes and the tag list"""
+    record = {key: value for key, value in record.items()
+              if value not in (None, '')}
+    for key in INT_FIELDS & set(record):
+        record[key] = int(record[key])
+    if isinstance(record.get('created_at'), str):
+        record['created_at'] = datetime.datetime.fromisoformat(
+            record['created_at'])
+    tags = record.get('tags')
+    if isinstance(tags, str):
+        record['tags'] = [name for name in tags.split(TAG_SEPARATOR) if name]
+    return record
+
+
+def read_records(stream, fmt):
+    """Yield the records in a text stream of the given format"""
+    if fmt == 'ndjson':
+        for line in stream:
+            if line.strip():
+                yield _clean(json.loads(line))
+    elif fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield _clean(row)
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+
+
+def _encode(record, fmt):
+    record = dict(record)
+    if isinstance(record.get('created_at'), datetime.datetime):
+        record['created_at'] = record['created_at'].isoformat()
+    if fmt == 'csv' and 'tags' in record:
+        record['tags'] = TAG_SEPARATOR.join(record['tags'])
+    return record
+
+
+def write_records(stream, records, kind, fmt):
+    """Write records to a text stream; returns the number written"""
+    count = 0
+    if fmt == 'ndjson':
+        for record in records:
+            stream.write(json.dumps(_encode(record, fmt)) + '\n')
+            count += 1
+    elif fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=COLUMNS[kind])
+        writer.writeheader()
+        for record in records:
+            writer.writerow(_encode(record, fmt))
+            count += 1
+    else:
+        raise ValueError(f'Unknown format: {fmt}')
+    return count
+
+
+def format_for(filename, default='ndjson'):
+    """Guess the format from a file name"""
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return default
+
+
+# Writing rows
+
+def _dialect():
+    return db.session().get_bind(User.__mapper__).dialect.name
+
+
+def allocate_ids(table, count):
+    """Reserve count new primary keys for table. Only Postgres has a
+    sequence to take them from; elsewhere they follow max(id), which is
+    only safe while nothing else writes to table (see import_records)"""
+    if _dialect() == 'postgresql':
+        rows = db.session.execute(
+            text('SELECT nextval(pg_get_serial_sequence(:table, \'id\')) '
+                 'FROM generate_series(1, :count)'),
+            {'table': table.name, 'count': count})
+        return [row[0] for row in rows]
+    start = db.session.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+    return list(range(start + 1, start + 1 + count))
+
+
+def _copy(table, columns, rows):
+    """COPY rows into table through psycopg2; False if not available"""
+    raw = db.session.connection().connection
+    cursor = raw.cursor()
+    if not hasattr(cursor, 'copy_expert'):
+        return False
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row.get(c) is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f'COPY {table.name} ({", ".join(columns)}) FROM STDIN '
+        "WITH (FORMAT csv, NULL '\\N')", buffer)
+    return True
+
+
+def insert_rows(table, rows, use_copy=True):
+    """Write a chunk of rows (dicts with the same keys) to table"""
+    if not rows:
+        return
+    columns = list(rows[0])
+    if use_copy and _dialect() == 'postgresql' and _copy(table, columns, rows):
+        return
+    db.session.execute(table.insert(), rows)
+
+
+def sync_sequence(table):
+    """After importing explicit ids, move the Postgres id sequence past them"""
+    if _dialect() == 'postgresql':
+        db.session.execute(text(
+            "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+            f"(SELECT coalesce(max(id), 1) FROM {table.name}))"),
+            {'table': table.name})
+
+
+def resolve_tags(names, use_copy=True):
+    """Map tag names to ids with one lookup, creating the missing tags"""
+    names = set(names)
+    if not names:
+        return {}
+    ids = dict(db.session.execute(
+        select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    missing = sorted(names - set(ids))
+    if missing:
+        new_ids = allocate_ids(Tag.__table__, len(missing))
+        insert_rows(Tag.__table__,
+                    [{'id': i, 'name': n} for i, n in zip(new_ids, missing)],
+                    use_copy)
+        ids.update(zip(missing, new_ids))
+    return ids
+
+
+def _assign_ids(table, chunk, explicit=None):
+    """Give the records of chunk new ids unless they all have one; returns
+    whether they did. Records with and without ids may not be mixed (nor
+    may chunks, once explicit says which the import has): the allocated
+    ids could collide with the given ones, which other records refer to."""
+    given = {'id' in record for record in chunk}
+    if explicit is not None:
+        given.add(explicit)
+    if len(given) > 1:
+        raise ValueError(f'Some {table.name} records have an id and some do '
+                         'not; give every record an id or none of them')
+    explicit = given.pop()
+    if not explicit:
+        for record, new_id in zip(chunk, allocate_ids(table, len(chunk))):
+            record['id'] = new_id
+    return explicit
+
+
+def import_records(kind, records, chunk_size=DEFAULT_CHUNK_SIZE,
+                   use_copy=True, progress=None, exclusive=False):
+    """Bulk insert an iterable of records of kind (users, posts or tags),
+    committing once per chunk. Returns TransferStats.
+
+    Except on Postgres the caller must say, with exclusive=True, that
+    nothing else writes to the database meanwhile: new ids are reserved
+    as max(id) + 1 onwards, without a lock, so a concurrent insert would
+    take the same ones and fail the import partway."""
+    if not exclusive and _dialect() != 'postgresql':
+        raise ValueError(f'Importing into {_dialect()} is only safe while '
+                         'nothing else writes to the database; stop the app '
+                         'and pass exclusive=True (--exclusive)')
+    table = TABLES[kind]
+    columns = [c for c in COLUMNS[kind] if c != 'tags']
+    stats = TransferStats()
+    explicit_ids = None
+    for chunk in chunked(records, chunk_size):
+        if kind == 'tags':
+            resolve_tags((record['name'] for record in chunk), use_copy)
+            db.session.commit()
+            stats.rows += len(chunk)
+            if progress:
+                progress(stats)
+            continue
+        explicit_ids = _assign_ids(table, chunk, explicit_ids)
+        if kind == 'posts':
+            now = datetime.datetime.now()
+            for record in chunk:
+                record.setdefault('created_at', now)
+                if record.get('content') is not None:
+                    record.update(markup.rendered_columns(record['content']))
+        if kind == 'users':
+            for record in chunk:
+                record.setdefault(
+                    'image_url', 'https://randomuser.me/api/portraits/lego/1.jpg')
+        rows = [{c: record.get(c) for c in columns + RENDERED.get(kind, [])}
+                for record in chunk]
+        insert_rows(table, rows, use_copy)
+        if kind == 'posts':
+            tag_ids = resolve_tags(
+                itertools.chain.from_iterable(r.get('tags', ()) for r in chunk),
+                use_copy)
+            insert_rows(PostTag.__table__,
+                        [{'post_id': record['id'], 'tag_id': tag_ids[name]}
+                         for record in chunk
+                         for name in set(record.get('tags', ()))],
+                        use_copy)
+        db.session.commit()
+        stats.rows += len(chunk)
+        if progress:
+            progress(stats)
+    if explicit_ids:
+        sync_sequence(table)
+        db.session.commit()
+    return stats
+
+
+def export_records(kind, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield every record of kind in id order, read through a server-side
+    cursor in chunks of chunk_size"""
+    table = TABLES[kind]
+    columns = [table.c[c] for c in COLUMNS[kind] if c != 'tags']
+    statement = (select(*columns).order_by(table.c.id)
+                 .execution_options(stream_results=True, yield_per=chunk_size))
+    # A separate connection keeps the server-side cursor open while the
+    # tag lookups below run on the session's own connection
+    with db.engine.connect() as connection:
+        result = connection.execute(statement)
+        for partition in result.mappings().partitions(chunk_size):
+            records = [dict(row) for row in partition]
+            if kind == 'posts':
+                tags = {}
+                rows = db.session.execute(
+                    select(PostTag.post_id, Tag.name)
+                    .join(Tag, Tag.id == PostTag.tag_id)
+                    .where(PostTag.post_id.in_([r['id'] for r in records]))
+                    .order_by(Tag.name))
+                for post_id, name in rows:
+                    tags.setdefault(post_id, []).append(name)
+                for record in records:
+                    record['tags'] = tags.get(record['id'], [])
+            yield from records
@@ -0,0 +1,279 @@
+"""Server-side cache for rendered HTML fragments.
+
+Fragments are keyed by the versions of the entities they depend on
+(e.g. "posts", "users", "tag:5"). Write routes bump those versions with
+fragment_cache.invalidate(...), so stale fragments are never read again
+and simply age out of the backend.
+
+The default "simple" backend is an in-process LRU with a TTL; each worker
+process has its own copy, so with several workers use the "redis" backend
+to share fragments and versions between them. Otherwise a worker serves its
+stale fragments until they expire, which is why the production profile cuts
+CACHE_TTL to a few seconds for the simple backend and logs a warning.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import g, has_app_context
+from markupsafe import Markup
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1024
+
+log = logging.getLogger('blogly.cache')
+
+
+class NullCache:
+    """Backend that stores nothing"""
+    tracks_versions = False
+    shares_versions = False
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def versions(self, names):
+        return [0 for name in names]
+
+    def touched(self, names):
+        return [None for name in names]
+
+    def bump(self, names):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    """In-process least-recently-used cache whose entries expire after ttl
+    seconds. Versions are kept apart from the entries so they are never
+    evicted."""
+    tracks_versions = True
+    # Each worker process has its own versions
+    shares_versions = False
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._versions = {}
+        self._touched = {}
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def versions(self, names):
+        with self._lock:
+            return [self._versions.get(name, 0) for name in names]
+
+    def touched(self, names):
+        with self._lock:
+            return [self._touched.get(name, self._started) for name in names]
+
+    def bump(self, names):
+        now = time.time()
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._touched[name] = now
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._versions.clear()
+            self._touched.clear()
+            self._started = time.time()
+
+
+class RedisCache:
+    """Backend on a (local) Redis-compatible server, shared by all workers.
+    Needs the redis package."""
+    tracks_versions = True
+    shares_versions = True
+
+    def __init__(self, url, ttl=DEFAULT_TTL, prefix='blogly:'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis.setnx(self._touched_key('*'), time.time())
+
+    def _version_key(self, name):
+        return f'{self.prefix}version:{name}'
+
+    def _touched_key(self, name):
+        return f'{self.prefix}touched:{name}'
+
+    def get(self, key):
+        value = self._redis.get(self.prefix + key)
+        return None if value is None else value.decode()
+
+    def set(self, key, value, ttl=None):
+        self._redis.set(self.prefix + key, value,
+                        ex=self.ttl if ttl is None else ttl)
+
+    def versions(self, names):
+        if not names:
+            return []
+        values = self._redis.mget([self._version_key(n) for n in names])
+        return [int(value or 0) for value in values]
+
+    def touched(self, names):
+        if not names:
+            return []
+        keys = [self._touched_key(n) for n in names] + [self._touched_key('*')]
+        *values, started = self._redis.mget(keys)
+        return [float(value or started or 0) for value in values]
+
+    def bump(self, names):
+        now = time.time()
+        pipe = self._redis.pipeline()
+        for name in names:
+            pipe.incr(self._version_key(name))
+            pipe.set(self._touched_key(name), now)
+        pipe.execute()
+
+    def clear(self):
+        keys = list(self._redis.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self._redis.delete(*keys)
+        self._redis.setnx(self._touched_key('*'), time.time())
+
+
+def tag_keys(tag_ids):
+    """Fragment cache dependency names for the tag detail pages of tag_ids"""
+    return [f'tag:{tag_id}' for tag_id in tag_ids]
+
+
+def make_backend(config):
+    """Build the backend named by config['CACHE_BACKEND']"""
+    name = config.get('CACHE_BACKEND', 'simple')
+    ttl = config.get('CACHE_TTL', DEFAULT_TTL)
+    if name == 'simple':
+        return LRUCache(config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                        ttl)
+    if name == 'redis':
+        return RedisCache(config.get('CACHE_REDIS_URL',
+                                     'redis://localhost:6379/0'), ttl)
+    if name == 'null':
+        return NullCache()
+    raise ValueError(f'Unknown CACHE_BACKEND: {name}')
+
+
+class FragmentCache:
+    """Caches rendered fragments and counts hits and misses"""
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.hits = Counter()
+        self.misses = Counter()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config)
+        app.extensions['fragment_cache'] = self
+        if (app.config.get('CACHE_WARN_PER_PROCESS')
+                and self.backend.tracks_versions
+                and not self.backend.shares_versions):
+            log.warning('CACHE_BACKEND %r is per process: with several workers '
+                        'a write is only seen by the worker that served it, and '
+                        'the others serve stale pages for up to CACHE_TTL=%ss. '
+                        'Use CACHE_BACKEND=redis.', app.config['CACHE_BACKEND'],
+                        app.config['CACHE_TTL'])
+
+    def key(self, name, deps, parts):
+        versions = self.backend.versions(deps)
+        stamp = ','.join(f'{dep}={version}'
+                         for dep, version in zip(deps, versions))
+        args = ','.join(str(part) for part in parts)
+        return f'fragment:{name}:{args}:{stamp}'
+
+    def fragment(self, name, deps, render, *parts):
+        """Return the cached fragment for name/parts at the current versions
+        of deps, calling render() to build it on a miss."""
+        key = self.key(name, deps, parts)
+        html = self.backend.get(key)
+        if html is None:
+            self.misses[name] += 1
+            html = str(render())
+            if not self._maybe_stale(deps):
+                self.backend.set(key, html)
+        else:
+            self.hits[name] += 1
+        return Markup(html)
+
+    def _maybe_stale(self, deps):
+        """Whether render() read from a replica (g.replica_lag, see
+        replicas.py) that may not have seen the latest change to deps yet"""
+        lag = g.get('replica_lag') if has_app_context() else None
+        if not lag:
+            return False
+        changed = self.last_modified(deps)
+        return changed is not None and time.time() - changed < lag
+
+    @property
+    def tracks_versions(self):
+        return self.backend.tracks_versions
+
+    @property
+    def shares_versions(self):
+        """Whether every worker process sees the same versions"""
+        return self.backend.shares_versions
+
+    def versions(self, deps):
+        """Current versions of deps"""
+        return self.backend.versions(deps)
+
+    def last_modified(self, deps):
+        """Unix time of the latest invalidation of any of deps"""
+        times = [t for t in self.backend.touched(deps) if t is not None]
+        return max(times, default=None)
+
+    def invalidate(self, *deps):
+        """Bump the versions of deps so fragments built on them are stale"""
+        self.backend.bump(deps)
+
+    def clear(self):
+        self.backend.clear()
+        self.hits.clear()
+        self.misses.clear()
+
+    def stats(self):
+        """Hit and miss counts, overall and per fragment name"""
+        names = set(self.hits) | set(self.misses)
+        return {
+            'hits': sum(self.hits.values()),
+            'misses': sum(self.misses.values()),
+            'fragments': {name: {'hits': self.hits[name],
+                                 'misses': self.misses[name]}
+                          for name in sorted(names)},
+        }
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,172 @@
+"""Flask CLI commands for Blogly: flask blogly <command>."""
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import assets
+import bulk
+import feed
+import jobs
+import markup
+import related
+import schema
+import tagging
+import templating
+from cache import fragment_cache
+from models import db
+
+blogly_cli = AppGroup('blogly', help='Blogly maintenance commands.')
+
+
+@blogly_cli.command('init-db')
+@click.option('--drop', is_flag=True, help='Drop existing tables first.')
+def init_db(drop):
+    """Create the database tables by running the migrations."""
+    schema.init_db(drop)
+    if not schema.available():
+        click.echo('Alembic is not installed; created the tables without '
+                   'migrations.', err=True)
+    click.echo('Initialized the database.')
+
+
+@blogly_cli.command('migrate')
+@click.option('--revision', default='head', show_default=True,
+              help='Revision to upgrade to.')
+def migrate(revision):
+    """Bring the database schema up to date."""
+    if not schema.available():
+        raise click.ClickException('Alembic is not installed.')
+    try:
+        before = schema.upgrade(revision)
+    except schema.UnknownSchema as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Migrated the database from {before or "nothing"} '
+               f'to {schema.current()}.')
+
+
+@blogly_cli.command('import')
+@click.argument('kind', type=click.Choice(['users', 'posts', 'tags']))
+@click.argument('source', type=click.File('r'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Input format (default: from the file name, else ndjson).')
+@click.option('--chunk-size', default=bulk.DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option('--no-copy', is_flag=True, help='Use INSERTs even on Postgres.')
+@click.option('--exclusive', is_flag=True,
+              help='Nothing else writes to the database meanwhile; '
+                   'required except on Postgres.')
+def import_command(kind, source, fmt, chunk_size, no_copy, exclusive):
+    """Bulk load KIND records from SOURCE ('-' for stdin)."""
+    fmt = fmt or bulk.format_for(source.name)
+    progress = lambda stats: click.echo(f'{kind}: {stats}', err=True)
+    try:
+        stats = bulk.import_records(kind, bulk.read_records(source, fmt),
+                                    chunk_size=chunk_size, use_copy=not no_copy,
+                                    progress=progress, exclusive=exclusive)
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    if kind in ('users', 'posts'):
+        feed.rebuild()
+    if kind == 'posts':
+        related.rebuild()
+    click.echo(f'Imported {kind}: {stats}', err=True)
+
+
+@blogly_cli.command('export')
+@click.argument('kind', type=click.Choice(['users', 'posts', 'tags']))
+@click.argument('target', type=click.File('w'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']),
+              help='Output format (default: from the file name, else ndjson).')
+@click.option('--chunk-size', default=bulk.DEFAULT_CHUNK_SIZE, show_default=True)
+def export_command(kind, target, fmt, chunk_size):
+    """Stream every KIND record to TARGET ('-' for stdout)."""
+    fmt = fmt or bulk.format_for(target.name)
+    stats = bulk.TransferStats()
+    stats.rows = bulk.write_records(
+        target, bulk.export_records(kind, chunk_size), kind, fmt)
+    click.echo(f'Exported {kind}: {stats}', err=True)
+
+
+@blogly_cli.command('seed')
+@click.option('--users', default=1000, show_default=True)
+@click.option('--posts', default=10000, show_default=True)
+@click.option('--tags', default=100, show_default=True)
+@click.option('--fanout', default=2, show_default=True,
+              help='Average tags per post.')
+@click.option('--seed', 'rng_seed', default=0, show_default=True,
+              help='RNG seed; the same seed gives the same data.')
+@click.option('--chunk-size', default=bulk.DEFAULT_CHUNK_SIZE, show_default=True)
+def seed_command(users, posts, tags, fanout, rng_seed, chunk_size):
+    """Drop all tables and load generated synthetic data."""
+    import seed
+    db.drop_all()
+    db.create_all()
+    seed.seed_synthetic(users, posts, tags, fanout, rng_seed, chunk_size,
+                        progress=lambda stats: click.echo(stats, err=True))
+    click.echo(f'Seeded {users} users, {posts} posts and {tags} tags.')
+
+
+@blogly_cli.command('reconcile-counts')
+@click.option('--batch-size', default=tagging.CHUNK_SIZE, show_default=True,
+              help='Tags checked per UPDATE.')
+@click.option('--dry-run', is_flag=True, help='Only count the drifted tags.')
+def reconcile_counts(batch_size, dry_run):
+    """Recompute tag post counts that disagree with posts_tags."""
+    fixed = tagging.reconcile_post_counts(batch_size, dry_run)
+    verb = 'would fix' if dry_run else 'fixed'
+    click.echo(f'Post counts: {verb} {fixed} tags.')
+
+
+@blogly_cli.command('rebuild-feeds')
+def rebuild_feeds():
+    """Recompute the recent-posts feeds from the posts."""
+    count = feed.rebuild()
+    click.echo(f'Rebuilt the feeds with {count} entries.')
+
+
+@blogly_cli.command('rebuild-related')
+def rebuild_related():
+    """Rescore the related posts of every post."""
+    count = related.rebuild()
+    click.echo(f'Rebuilt the related posts with {count} rows.')
+
+
+@blogly_cli.command('rerender')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Posts rendered per UPDATE.')
+@click.option('--force', is_flag=True,
+              help='Render every post, not just the out-of-date ones.')
+def rerender(batch_size, force):
+    """Render post Markdown stored by an older renderer, or not at all."""
+    count = markup.rerender(batch_size, force)
+    if count:
+        # Listings show the excerpts through the feeds and cached fragments
+        feed.rebuild()
+        fragment_cache.invalidate('posts')
+    click.echo(f'Rendered {count} posts.')
+
+
+@blogly_cli.command('run-jobs')
+def run_jobs():
+    """Finish the background jobs a stopped server left queued or running."""
+    count = jobs.resume()
+    click.echo(f'Ran {count} jobs.')
+
+
+@blogly_cli.command('build-assets')
+def build_assets():
+    """Fingerprint and compress the static files for /assets/."""
+    target = assets.assets_dir(current_app)
+    manifest = assets.build(current_app.static_folder, target)
+    current_app.extensions['assets'] = assets.Assets(target)
+    click.echo(f'Built {len(manifest)} assets in {target}.')
+
+
+@blogly_cli.command('warm-templates')
+def warm_templates():
+    """Compile every template into the bytecode cache."""
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_BYTECODE_CACHE is off.')
+    names = templating.warm(current_app)
+    click.echo(f'Compiled {len(names)} templates.')
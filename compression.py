@@ -0,0 +1,252 @@
+"""Response compression: a WSGI middleware around the Flask app.
+
+Text responses (HTML, CSS, JavaScript, JSON, XML, SVG) of COMPRESS_MIN_SIZE
+bytes or more are sent with brotli (when the brotli package is installed)
+or gzip, whichever the client accepts and prefers. A response without a
+Content-Length, such as a streamed page (templating.stream_template), is
+held back until COMPRESS_MIN_SIZE bytes have been generated; past that it
+is compressed as it streams, flushed every COMPRESS_STREAM_BUFFER bytes of
+input so the browser still gets the page a piece at a time.
+
+Responses that already have a Content-Encoding (the precompressed files
+under /assets/) or say Cache-Control: no-transform are passed through.
+"""
+
+import zlib
+
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is then the only encoding
+    brotli = None
+
+COMPRESSIBLE = ('text/', 'application/json', 'application/javascript',
+                'application/xml', 'application/rss+xml', 'application/atom+xml',
+                'image/svg+xml')
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 4
+DEFAULT_STREAM_BUFFER = 16 * 1024
+
+
+def accepted(header):
+    """{encoding: quality} from an Accept-Encoding header"""
+    found = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        found[name] = quality
+    return found
+
+
+def choose_encoding(header):
+    """'br', 'gzip' or None for an Accept-Encoding header"""
+    qualities = accepted(header or '')
+    wildcard = qualities.get('*', 0)
+    best, best_quality = None, 0
+    for name in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        quality = qualities.get(name, wildcard)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits 31: a gzip header and trailer around the deflate stream
+        self._zlib = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._zlib.compress(data)
+
+    def flush(self):
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self._brotli = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._brotli.process(data)
+
+    def flush(self):
+        return self._brotli.flush()
+
+    def finish(self):
+        return self._brotli.finish()
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def compressible(status, headers, min_size):
+    """Whether a response with this status line and headers may be
+    compressed, at its declared length"""
+    if not status.startswith('200') and not status.startswith('201'):
+        return False
+    content_type = (_header(headers, 'Content-Type') or '').lower()
+    if not content_type.startswith(COMPRESSIBLE):
+        return False
+    if _header(headers, 'Content-Encoding') is not None:
+        return False
+    if 'no-transform' in (_header(headers, 'Cache-Control') or '').lower():
+        return False
+    length = _header(headers, 'Content-Length')
+    return length is None or int(length) >= min_size
+
+
+def compressed_headers(headers, encoding):
+    """headers for the body sent in encoding"""
+    out = []
+    for key, value in headers:
+        lower = key.lower()
+        if lower == 'content-length':
+            continue
+        if lower == 'etag' and not value.startswith('W/'):
+            # The encoded body is a different representation
+            value = f'W/{value}'
+        out.append((key, value))
+    out.append(('Content-Encoding', encoding))
+    return out
+
+
+def with_vary(headers):
+    """headers with Accept-Encoding in Vary, as the response depends on it"""
+    vary = [item.strip() for key, value in headers if key.lower() == 'vary'
+            for item in value.split(',') if item.strip()]
+    if '*' in vary or 'accept-encoding' in (item.lower() for item in vary):
+        return headers
+    rest = [(key, value) for key, value in headers if key.lower() != 'vary']
+    return rest + [('Vary', ', '.join(vary + ['Accept-Encoding']))]
+
+
+class CompressionMiddleware:
+    """Compresses the text responses of a WSGI app"""
+
+    def __init__(self, app, min_size=DEFAULT_MIN_SIZE, level=DEFAULT_LEVEL,
+                 brotli_quality=DEFAULT_BROTLI_QUALITY,
+                 stream_buffer=DEFAULT_STREAM_BUFFER):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.stream_buffer = stream_buffer
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.level)
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            encoding = None
+        started = []
+
+        def capture(status, headers, exc_info=None):
+            # Nothing is sent before the first chunk, so a later call (an
+            # error page) simply replaces the status and headers
+            started[:] = [status, headers]
+            # The body goes through the iterable; Flask never writes
+            return self._refuse_write
+
+        result = self.app(environ, capture)
+        if not started:
+            # start_response comes with the first chunk
+            return self._deferred(result, started, encoding, start_response)
+        status, headers = started
+        headers, compress = self._plan(status, headers, encoding)
+        if not compress:
+            # Untouched, so a file response keeps its wsgi.file_wrapper
+            start_response(status, headers)
+            return result
+        return ClosingIterator(
+            self._compress(iter(result), [], status, headers, encoding,
+                           start_response),
+            getattr(result, 'close', None))
+
+    @staticmethod
+    def _refuse_write(data):
+        raise RuntimeError('CompressionMiddleware does not support write()')
+
+    def _plan(self, status, headers, encoding):
+        """(headers, whether to compress) of a response"""
+        if not compressible(status, headers, self.min_size):
+            return headers, False
+        return with_vary(headers), encoding is not None
+
+    def _deferred(self, result, started, encoding, start_response):
+        try:
+            chunks = iter(result)
+            first = next(chunks, None)
+            held = [] if first is None else [first]
+            status, headers = started
+            headers, compress = self._plan(status, headers, encoding)
+            if compress:
+                yield from self._compress(chunks, held, status, headers,
+                                          encoding, start_response)
+                return
+            start_response(status, headers)
+            yield from held
+            yield from chunks
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    def _compress(self, chunks, held, status, headers, encoding, start_response):
+        # Hold back a response of unknown length until it is worth it
+        size = sum(len(chunk) for chunk in held)
+        while size < self.min_size:
+            chunk = next(chunks, None)
+            if chunk is None:
+                start_response(status, headers)
+                yield b''.join(held)
+                return
+            held.append(chunk)
+            size += len(chunk)
+        start_response(status, compressed_headers(headers, encoding))
+        compressor = self.compressor(encoding)
+        pending, buffered = [compressor.compress(b''.join(held))], size
+        for chunk in chunks:
+            pending.append(compressor.compress(chunk))
+            buffered += len(chunk)
+            if buffered >= self.stream_buffer:
+                pending.append(compressor.flush())
+                out = b''.join(pending)
+                pending, buffered = [], 0
+                if out:
+                    yield out
+        pending.append(compressor.finish())
+        yield b''.join(pending)
+
+
+def init_app(app):
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+    app.config.setdefault('COMPRESS_LEVEL', DEFAULT_LEVEL)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY)
+    app.config.setdefault('COMPRESS_STREAM_BUFFER', DEFAULT_STREAM_BUFFER)
+    if app.config['COMPRESS_ENABLED']:
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app, app.config['COMPRESS_MIN_SIZE'],
+            app.config['COMPRESS_LEVEL'], app.config['COMPRESS_BROTLI_QUALITY'],
+            app.config['COMPRESS_STREAM_BUFFER'])
@@ -0,0 +1,222 @@
+"""Configuration profiles for Blogly.
+
+Pick one with create_app('production') or the BLOGLY_ENV environment
+variable (development, testing or production). Settings that differ between
+deployments are read from the environment.
+"""
+
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def env_list(name):
+    """Comma-separated values of an environment variable"""
+    return [value.strip() for value in os.environ.get(name, '').split(',')
+            if value.strip()]
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    """Settings shared by every profile"""
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'dogsaregreat1999')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             'postgresql:///blogly')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # Connection pool (ignored for SQLite)
+    DB_POOL_SIZE = env_int('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW = env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', 30)
+    DB_POOL_RECYCLE = env_int('DB_POOL_RECYCLE', 1800)
+    DB_POOL_PRE_PING = env_bool('DB_POOL_PRE_PING', True)
+    # Milliseconds; 0 disables the Postgres statement_timeout
+    DB_STATEMENT_TIMEOUT = env_int('DB_STATEMENT_TIMEOUT', 0)
+
+    # Read replicas for the views marked @replica_reads (replicas.py)
+    REPLICA_URLS = env_list('REPLICA_URLS')
+    REPLICA_MAX_LAG = env_float('REPLICA_MAX_LAG', 5.0)
+    REPLICA_LAG_CHECK_SECONDS = env_float('REPLICA_LAG_CHECK_SECONDS', 1.0)
+    # How long a browser reads from the primary after it writes
+    REPLICA_STICKY_SECONDS = env_float('REPLICA_STICKY_SECONDS', 5.0)
+
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'simple')
+    CACHE_TTL = env_int('CACHE_TTL', 300)
+    CACHE_MAX_ENTRIES = env_int('CACHE_MAX_ENTRIES', 1024)
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL',
+                                     'redis://localhost:6379/0')
+
+    PAGE_SIZE = env_int('PAGE_SIZE', 50)
+    MAX_PAGE_SIZE = env_int('MAX_PAGE_SIZE', 200)
+    TAG_CLOUD_SIZE = env_int('TAG_CLOUD_SIZE', 100)
+    # Newest posts kept in each precomputed feed (site, author and tag)
+    FEED_SIZE = env_int('FEED_SIZE', 50)
+    # Related posts shown under a post, and the most posts a tag may have
+    # to count towards them (related.py)
+    RELATED_POSTS = env_int('RELATED_POSTS', 5)
+    RELATED_MAX_TAG_POSTS = env_int('RELATED_MAX_TAG_POSTS', 1000)
+    # Post views are counted in memory and written every VIEW_FLUSH_SECONDS
+    # (counters.py); trending posts weigh the views of the last
+    # TRENDING_HOURS, halving every TRENDING_HALF_LIFE hours back
+    VIEW_FLUSH_SECONDS = env_float('VIEW_FLUSH_SECONDS', 10)
+    TRENDING_HOURS = env_int('TRENDING_HOURS', 48)
+    TRENDING_HALF_LIFE = env_float('TRENDING_HALF_LIFE', 6)
+    TRENDING_SIZE = env_int('TRENDING_SIZE', 5)
+
+    # Request metrics at /metrics and the slow-request log
+    INSTRUMENTATION = env_bool('INSTRUMENTATION', True)
+    # Fraction of requests broken down into SQL and template time
+    METRICS_SAMPLE_RATE = env_float('METRICS_SAMPLE_RATE', 1.0)
+    SLOW_REQUEST_MS = env_int('SLOW_REQUEST_MS', 500)
+    # Who may read /metrics: these addresses or networks, or anyone with
+    # "Authorization: Bearer <METRICS_TOKEN>"
+    METRICS_ALLOWED_IPS = env_list('METRICS_ALLOWED_IPS') or ['127.0.0.0/8', '::1']
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Compiled templates are kept here across restarts (None: a directory
+    # under the system temp dir); warm it with flask blogly warm-templates
+    TEMPLATE_BYTECODE_CACHE = env_bool('TEMPLATE_BYTECODE_CACHE', True)
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+    # Cut the indentation out of the templates as they are compiled
+    TEMPLATE_COLLAPSE_WHITESPACE = env_bool('TEMPLATE_COLLAPSE_WHITESPACE', True)
+
+    # gzip (or brotli, if installed) for text responses of COMPRESS_MIN_SIZE
+    # bytes or more (compression.py); streamed pages are flushed every
+    # COMPRESS_STREAM_BUFFER bytes
+    COMPRESS_ENABLED = env_bool('COMPRESS_ENABLED', True)
+    COMPRESS_MIN_SIZE = env_int('COMPRESS_MIN_SIZE', 1024)
+    COMPRESS_LEVEL = env_int('COMPRESS_LEVEL', 6)
+    COMPRESS_BROTLI_QUALITY = env_int('COMPRESS_BROTLI_QUALITY', 4)
+    COMPRESS_STREAM_BUFFER = env_int('COMPRESS_STREAM_BUFFER', 16 * 1024)
+
+    # Avatar thumbnails (avatars.py); None: <instance path>/avatars
+    AVATAR_CACHE_DIR = os.environ.get('AVATAR_CACHE_DIR')
+    AVATAR_FETCH_TIMEOUT = env_float('AVATAR_FETCH_TIMEOUT', 5)
+    AVATAR_MAX_BYTES = env_int('AVATAR_MAX_BYTES', 5 * 1024 * 1024)
+    # Seconds an image that could not be fetched is not tried again
+    AVATAR_FAILURE_TTL = env_int('AVATAR_FAILURE_TTL', 300)
+    # Fetch a user's avatar when it is added or changed
+    AVATAR_PREWARM = env_bool('AVATAR_PREWARM', True)
+
+    # Fingerprinted static files from flask blogly build-assets (assets.py);
+    # None: static/dist
+    ASSETS_DIR = os.environ.get('ASSETS_DIR')
+
+    # Background jobs (jobs.py): users and tags with this many posts are
+    # deleted by a worker thread, DELETE_BATCH_SIZE rows per transaction
+    JOBS_INLINE = env_bool('JOBS_INLINE', False)
+    JOB_WORKERS = env_int('JOB_WORKERS', 2)
+    DELETE_BATCH_SIZE = env_int('DELETE_BATCH_SIZE', 1000)
+    ASYNC_DELETE_THRESHOLD = env_int('ASYNC_DELETE_THRESHOLD', 1000)
+
+    # Token buckets for the write routes (ratelimit.py): per client IP and
+    # route, with (rate, burst) overrides by endpoint, and per client IP
+    RATELIMIT_ENABLED = env_bool('RATELIMIT_ENABLED', True)
+    RATELIMIT_RATE = env_float('RATELIMIT_RATE', 0.5)
+    RATELIMIT_BURST = env_int('RATELIMIT_BURST', 10)
+    RATELIMIT_ROUTES = {
+        # Deletes cascade through every post of a user or tag
+        'blogly.delete_user': (0.1, 3),
+        'blogly.delete_tag': (0.1, 3),
+    }
+    RATELIMIT_IP_RATE = env_float('RATELIMIT_IP_RATE', 2.0)
+    RATELIMIT_IP_BURST = env_int('RATELIMIT_IP_BURST', 30)
+    RATELIMIT_EXEMPT = env_list('RATELIMIT_EXEMPT')
+    # "memory" (per process) or "shared" (a file mapped by every worker)
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_SHARED_PATH = os.environ.get('RATELIMIT_SHARED_PATH')
+
+    # ASGI server (asgi.py): threads running the views, and the async
+    # engine's URL (None: SQLALCHEMY_DATABASE_URI with an async driver)
+    ASGI_THREADS = env_int('ASGI_THREADS', 16)
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+
+
+class DevelopmentConfig(Config):
+    """Local development: SQL echo and the debug toolbar"""
+    SQLALCHEMY_ECHO = env_bool('SQLALCHEMY_ECHO', True)
+    DEBUG_TOOLBAR = env_bool('DEBUG_TOOLBAR', True)
+
+
+class TestingConfig(Config):
+    """Test runs against the blogly_test database"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL',
+                                             'postgresql:///blogly_test')
+    DB_POOL_SIZE = 2
+    DB_MAX_OVERFLOW = 0
+    # Run background jobs in the request that queues them
+    JOBS_INLINE = True
+    TEMPLATE_BYTECODE_CACHE = False
+    # No network in tests; test_avatars.py stubs the fetcher
+    AVATAR_PREWARM = False
+    # test_ratelimit.py turns it on
+    RATELIMIT_ENABLED = False
+    # Tests flush view counts themselves
+    VIEW_FLUSH_SECONDS = 0
+
+
+class ProductionConfig(Config):
+    """Production: no echo or toolbar, a larger pool, a statement timeout and
+    sampled request breakdowns"""
+    DB_POOL_SIZE = env_int('DB_POOL_SIZE', 10)
+    DB_MAX_OVERFLOW = env_int('DB_MAX_OVERFLOW', 20)
+    DB_STATEMENT_TIMEOUT = env_int('DB_STATEMENT_TIMEOUT', 5000)
+    METRICS_SAMPLE_RATE = env_float('METRICS_SAMPLE_RATE', 0.1)
+    # The simple cache is per worker: a write invalidates only the worker
+    # that served it, and the others serve their stale fragments until they
+    # expire. Keep that short unless the cache is shared (redis); a warning
+    # is logged at startup for a per-process backend.
+    CACHE_TTL = env_int('CACHE_TTL',
+                        Config.CACHE_TTL if Config.CACHE_BACKEND == 'redis' else 5)
+    CACHE_WARN_PER_PROCESS = True
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(name=None):
+    """The config class for a profile name (default: $BLOGLY_ENV)"""
+    name = name or os.environ.get('BLOGLY_ENV', 'development')
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f'Unknown config profile: {name}') from None
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the pool settings in config"""
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite'):
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    timeout = config['DB_STATEMENT_TIMEOUT']
+    if timeout and uri.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
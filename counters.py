@@ -0,0 +1,229 @@
+"""Post view counts, written behind, and the trending posts.
+
+show_post() only adds to a counter in this worker's memory; every
+VIEW_FLUSH_SECONDS a background thread (and the worker on its way out)
+writes the counts gathered since in one transaction: one batched
+UPDATE adding to posts.views, and one batched upsert adding to the
+post's PostView row for the hour the views fell in. A post read a
+thousand times between flushes costs two row writes, not a thousand, and
+a page view never waits on a write. Counts not yet flushed are lost if a
+worker is killed; a view counter can afford that.
+
+The trending posts are those with the most views over the last
+TRENDING_HOURS, each hour's views counting half as much every
+TRENDING_HALF_LIFE hours back. With VIEW_FLUSH_SECONDS 0 (the testing
+profile) nothing flushes on its own; call view_counter.flush().
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import bindparam, case, func, select
+
+from models import db, Post, PostView
+from cache import fragment_cache
+from tagging import CHUNK_SIZE
+
+log = logging.getLogger('blogly.counters')
+
+DEFAULT_FLUSH_SECONDS = 10
+DEFAULT_TRENDING_HOURS = 48
+DEFAULT_TRENDING_HALF_LIFE = 6
+DEFAULT_TRENDING_SIZE = 5
+
+
+def current_hour(now=None):
+    """Hours since the Unix epoch"""
+    return int((time.time() if now is None else now) // 3600)
+
+
+def trending_hours():
+    return db.get_app().config.get('TRENDING_HOURS', DEFAULT_TRENDING_HOURS)
+
+
+def _upsert(connection, rows):
+    """Add each row's views to its (post_id, hour) PostView row"""
+    table = PostView.__table__
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['post_id', 'hour'],
+            set_={'views': table.c.views + stmt.excluded.views})
+        connection.execute(stmt, rows)
+        return
+    update = (table.update()
+              .where(table.c.post_id == bindparam('_post_id'),
+                     table.c.hour == bindparam('_hour'))
+              .values(views=table.c.views + bindparam('_views')))
+    for row in rows:
+        found = connection.execute(update, {'_post_id': row['post_id'],
+                                            '_hour': row['hour'],
+                                            '_views': row['views']})
+        if not found.rowcount:
+            connection.execute(table.insert(), row)
+
+
+class ViewCounter:
+    """Counts post views in memory and writes them in batches"""
+
+    def __init__(self, app=None):
+        self._counts = Counter()
+        self._totals = Counter()
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._pruned = None
+        if hasattr(os, 'register_at_fork'):
+            # A forked worker starts with no counts and no flusher thread
+            os.register_at_fork(after_in_child=self._after_fork)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('VIEW_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS)
+        app.config.setdefault('TRENDING_HOURS', DEFAULT_TRENDING_HOURS)
+        app.config.setdefault('TRENDING_HALF_LIFE', DEFAULT_TRENDING_HALF_LIFE)
+        app.config.setdefault('TRENDING_SIZE', DEFAULT_TRENDING_SIZE)
+        app.extensions['view_counter'] = self
+        if app.config['VIEW_FLUSH_SECONDS'] > 0 and self._app is None:
+            atexit.register(self.stop)
+        self._app = app
+
+    def _after_fork(self):
+        self._counts = Counter()
+        self._totals = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record(self, post_id):
+        """Count a view of post_id; no database access"""
+        key = (post_id, current_hour())
+        with self._lock:
+            self._counts[key] += 1
+            self._totals[post_id] += 1
+        if self._thread is None:
+            self._start()
+
+    def pending(self, post_id):
+        """Views of post_id counted here but not flushed yet"""
+        return self._totals.get(post_id, 0)
+
+    def _start(self):
+        app = current_app._get_current_object()
+        interval = app.config['VIEW_FLUSH_SECONDS']
+        if interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(app, interval),
+                name='blogly-view-flush', daemon=True)
+        self._thread.start()
+
+    def _run(self, app, interval):
+        while not self._stop.wait(interval):
+            self._flush_in_context(app)
+
+    def _flush_in_context(self, app):
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception:
+                log.exception('Flushing post views failed')
+
+    def stop(self):
+        """Stop the flusher thread and write what is left"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._app is not None and self._counts:
+            self._flush_in_context(self._app)
+
+    def flush(self):
+        """Write the counted views in one transaction of its own; returns
+        the number of views written. On failure they are counted again."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            totals, self._totals = self._totals, Counter()
+        if not counts:
+            return 0
+        try:
+            written = self._write(counts, totals)
+        except Exception:
+            with self._lock:
+                self._counts.update(counts)
+                self._totals.update(totals)
+            raise
+        fragment_cache.invalidate('views')
+        return written
+
+    def _write(self, counts, totals):
+        posts = Post.__table__
+        hour = current_hour()
+        with db.engine.begin() as connection:
+            # Posts deleted since they were viewed have nothing to count on
+            existing = set()
+            ids = sorted(totals)
+            for start in range(0, len(ids), CHUNK_SIZE):
+                existing.update(connection.execute(
+                    select(posts.c.id).where(
+                        posts.c.id.in_(ids[start:start + CHUNK_SIZE]))).scalars())
+            if not existing:
+                return 0
+            connection.execute(
+                posts.update().where(posts.c.id == bindparam('_id'))
+                .values(views=posts.c.views + bindparam('_views')),
+                [{'_id': post_id, '_views': totals[post_id]}
+                 for post_id in sorted(existing)])
+            _upsert(connection, [
+                {'post_id': post_id, 'hour': counted_hour, 'views': n}
+                for (post_id, counted_hour), n in sorted(counts.items())
+                if post_id in existing])
+            if self._pruned != hour:
+                table = PostView.__table__
+                connection.execute(table.delete().where(
+                    table.c.hour <= hour - trending_hours()))
+                self._pruned = hour
+        return sum(totals[post_id] for post_id in existing)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._totals.clear()
+
+
+view_counter = ViewCounter()
+
+
+def trending(limit=None, now=None):
+    """(post id, title, score) of the most viewed posts of the last
+    TRENDING_HOURS, recent hours weighing more; best first"""
+    config = db.get_app().config
+    if limit is None:
+        limit = config.get('TRENDING_SIZE', DEFAULT_TRENDING_SIZE)
+    window = config.get('TRENDING_HOURS', DEFAULT_TRENDING_HOURS)
+    half_life = config.get('TRENDING_HALF_LIFE', DEFAULT_TRENDING_HALF_LIFE)
+    hour = current_hour(now)
+    decay = case({hour - age: 0.5 ** (age / half_life) for age in range(window)},
+                 value=PostView.hour, else_=0)
+    score = func.sum(PostView.views * decay).label('score')
+    return (db.session.query(Post.id, Post.title, score)
+            .select_from(PostView).join(Post, Post.id == PostView.post_id)
+            .filter(PostView.hour > hour - window, PostView.hour <= hour)
+            .group_by(Post.id, Post.title)
+            .order_by(score.desc(), Post.id.desc())
+            .limit(limit).all())
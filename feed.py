@@ -0,0 +1,222 @@
+"""Precomputed recent-posts feeds.
+
+Each feed ("scope") holds the FEED_SIZE newest posts of the whole site
+('global'), of one author ('user:<id>') or of one tag ('tag:<id>') as
+FeedEntry rows that already carry the author's name and avatar and the
+tag names, so a listing is one read of the (scope, created_at) index.
+
+Write routes keep the feeds current in the same transaction as the write:
+sync_posts() after a post or its tags change, refill() after posts are
+deleted (their entries go with them through ON DELETE CASCADE), and
+user_changed() after an author is renamed. Each scope always holds exactly
+its newest min(FEED_SIZE, posts in scope) posts.
+"""
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+
+import markup
+from models import db, User, Post, PostTag, FeedEntry
+from tagging import CHUNK_SIZE
+
+DEFAULT_FEED_SIZE = 50
+
+GLOBAL = 'global'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def tag_scope(tag_id):
+    return f'tag:{tag_id}'
+
+
+def feed_size():
+    # db.get_app(): the seed and CLI run the feed code outside requests
+    return db.get_app().config.get('FEED_SIZE', DEFAULT_FEED_SIZE)
+
+
+def scopes_for(user_id, tag_ids):
+    """The scopes of a post by user_id tagged with tag_ids"""
+    return [GLOBAL, user_scope(user_id)] + [tag_scope(tag_id) for tag_id in tag_ids]
+
+
+def scopes_of(post):
+    """The scopes a post belongs to"""
+    return scopes_for(post.user_id, [tag.id for tag in post.tags])
+
+
+def entry_values(post):
+    """Column values of the feed entries for post (user and tags loaded)"""
+    return {
+        'post_id': post.id,
+        'created_at': post.created_at,
+        'title': post.title,
+        'summary': (post.excerpt if post.excerpt is not None
+                    else markup.render(post.content)[1]),
+        'author_id': post.user_id,
+        'author_name': post.user.full_name,
+        'author_image': post.user.image_url,
+        'tags': [[tag.id, tag.name]
+                 for tag in sorted(post.tags, key=lambda tag: tag.name)],
+    }
+
+
+def entry_for(post):
+    """An unsaved FeedEntry for post, to render posts older than the feed
+    with the same templates"""
+    return FeedEntry(scope=None, **entry_values(post))
+
+
+def _posts(query):
+    return query.options(joinedload(Post.user), selectinload(Post.tags))
+
+
+def _scope_posts(scope):
+    """Query for the posts that belong in scope"""
+    query = _posts(Post.query)
+    kind, _, scope_id = scope.partition(':')
+    if kind == 'user':
+        query = query.filter(Post.user_id == int(scope_id))
+    elif kind == 'tag':
+        query = query.join(PostTag, PostTag.post_id == Post.id).filter(
+            PostTag.tag_id == int(scope_id))
+    return query
+
+
+def read(scope, limit=None):
+    """The newest entries of scope, newest first"""
+    return (FeedEntry.query.filter_by(scope=scope)
+            .order_by(FeedEntry.created_at.desc(), FeedEntry.post_id.desc())
+            .limit(limit or feed_size())
+            .all())
+
+
+def trim(scope):
+    """Drop the entries of scope beyond the newest feed_size()"""
+    extra = [post_id for (post_id,) in
+             db.session.query(FeedEntry.post_id).filter_by(scope=scope)
+             .order_by(FeedEntry.created_at.desc(), FeedEntry.post_id.desc())
+             .offset(feed_size())]
+    for start in range(0, len(extra), CHUNK_SIZE):
+        FeedEntry.query.filter(FeedEntry.scope == scope,
+                               FeedEntry.post_id.in_(extra[start:start + CHUNK_SIZE])
+                               ).delete(synchronize_session=False)
+
+
+def refill(scopes):
+    """Top up scopes that lost entries with their next newest posts"""
+    size = feed_size()
+    for scope in set(scopes):
+        present = {post_id for (post_id,) in
+                   db.session.query(FeedEntry.post_id).filter_by(scope=scope)}
+        if len(present) >= size:
+            continue
+        posts = (_scope_posts(scope)
+                 .order_by(Post.created_at.desc(), Post.id.desc())
+                 .limit(size).all())
+        rows = [dict(entry_values(post), scope=scope)
+                for post in posts if post.id not in present]
+        if rows:
+            db.session.execute(FeedEntry.__table__.insert(), rows)
+
+
+def sync_posts(post_ids):
+    """Bring the entries of post_ids in line with the posts: update copied
+    columns, add them to scopes they joined and drop them from scopes they
+    left (or from every scope, for posts that no longer exist)."""
+    post_ids = list(set(post_ids))
+    inserted, emptied = set(), set()
+    for start in range(0, len(post_ids), CHUNK_SIZE):
+        chunk = post_ids[start:start + CHUNK_SIZE]
+        existing = {}
+        for scope, post_id in (db.session.query(FeedEntry.scope, FeedEntry.post_id)
+                               .filter(FeedEntry.post_id.in_(chunk))):
+            existing.setdefault(post_id, set()).add(scope)
+        # populate_existing: the tags may have changed behind the ORM's
+        # back (tagging.py writes posts_tags with core statements)
+        posts = {post.id: post for post in
+                 _posts(Post.query).populate_existing().filter(Post.id.in_(chunk))}
+        rows = []
+        for post_id in chunk:
+            post = posts.get(post_id)
+            have = existing.get(post_id, set())
+            wanted = set(scopes_of(post)) if post is not None else set()
+            gone = have - wanted
+            if gone:
+                FeedEntry.query.filter(FeedEntry.post_id == post_id,
+                                       FeedEntry.scope.in_(gone)
+                                       ).delete(synchronize_session=False)
+                emptied |= gone
+            if post is None:
+                continue
+            values = entry_values(post)
+            if have & wanted:
+                changes = {key: value for key, value in values.items()
+                           if key != 'post_id'}
+                FeedEntry.query.filter(FeedEntry.post_id == post_id,
+                                       FeedEntry.scope.in_(have & wanted)
+                                       ).update(changes, synchronize_session=False)
+            rows.extend(dict(values, scope=scope) for scope in wanted - have)
+            inserted |= wanted - have
+        if rows:
+            db.session.execute(FeedEntry.__table__.insert(), rows)
+    for scope in inserted:
+        trim(scope)
+    refill(emptied)
+
+
+def user_changed(user_id):
+    """Copy a user's new name and avatar into their entries"""
+    user = db.session.get(User, user_id)
+    FeedEntry.query.filter_by(author_id=user_id).update(
+        {'author_name': user.full_name, 'author_image': user.image_url},
+        synchronize_session=False)
+
+
+def tagged_entry_post_ids(tag_id):
+    """Ids of the posts in any feed that carry tag_id"""
+    return {post_id for (post_id,) in
+            db.session.query(FeedEntry.post_id).distinct()
+            .join(PostTag, PostTag.post_id == FeedEntry.post_id)
+            .filter(PostTag.tag_id == tag_id)}
+
+
+def drop_scope(scope):
+    FeedEntry.query.filter_by(scope=scope).delete(synchronize_session=False)
+
+
+def _newest_pairs():
+    """(scope, post id) of every entry the feeds should hold, found with
+    one row_number() window query per kind of scope"""
+    size = feed_size()
+    newest = (Post.created_at.desc(), Post.id.desc())
+    for (post_id,) in (db.session.query(Post.id).order_by(*newest).limit(size)):
+        yield GLOBAL, post_id
+    rank = func.row_number().over(partition_by=Post.user_id, order_by=newest)
+    ranked = db.session.query(Post.id, Post.user_id, rank.label('rank')).subquery()
+    for post_id, user_id in (db.session.query(ranked.c.id, ranked.c.user_id)
+                             .filter(ranked.c.rank <= size)):
+        yield user_scope(user_id), post_id
+    rank = func.row_number().over(partition_by=PostTag.tag_id, order_by=newest)
+    ranked = (db.session.query(PostTag.post_id, PostTag.tag_id, rank.label('rank'))
+              .join(Post, Post.id == PostTag.post_id).subquery())
+    for post_id, tag_id in (db.session.query(ranked.c.post_id, ranked.c.tag_id)
+                            .filter(ranked.c.rank <= size)):
+        yield tag_scope(tag_id), post_id
+
+
+def rebuild():
+    """Recompute every feed from the posts; returns the number of entries"""
+    FeedEntry.query.delete(synchronize_session=False)
+    pairs = list(_newest_pairs())
+    for start in range(0, len(pairs), CHUNK_SIZE):
+        chunk = pairs[start:start + CHUNK_SIZE]
+        posts = {post.id: post for post in _posts(Post.query).filter(
+            Post.id.in_({post_id for scope, post_id in chunk}))}
+        db.session.execute(FeedEntry.__table__.insert(),
+                           [dict(entry_values(posts[post_id]), scope=scope)
+                            for scope, post_id in chunk])
+        db.session.commit()
+    return len(pairs)
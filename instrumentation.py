@@ -0,0 +1,319 @@
+"""Per-request timing and SQL instrumentation.
+
+Every request is counted and timed. A sample of them (METRICS_SAMPLE_RATE)
+is also broken down into template render time, the number and total time
+of its SQL statements, and its slowest statement. The numbers are served
+in the Prometheus text format at /metrics, and requests slower than
+SLOW_REQUEST_MS are logged as one JSON object each to the "blogly.slow"
+logger.
+
+/metrics answers clients in METRICS_ALLOWED_IPS (addresses or networks;
+default: loopback) and requests carrying "Authorization: Bearer
+<METRICS_TOKEN>" when a token is set; anyone else gets a 403.
+
+Metrics are kept per worker process; Prometheus adds them up across
+workers when they are scraped separately.
+"""
+
+import bisect
+import contextvars
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from flask import (Blueprint, Response, abort, current_app, request,
+                   request_started, request_finished, got_request_exception,
+                   before_render_template, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from cache import fragment_cache
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_CHARS = 500
+
+slow_log = logging.getLogger('blogly.slow')
+
+_current = contextvars.ContextVar('blogly_request_stats', default=None)
+
+
+class RequestStats:
+    """Measurements for the request being handled"""
+    __slots__ = ('started', 'sampled', 'sql_count', 'sql_seconds',
+                 'slowest_seconds', 'slowest_statement', 'template_seconds',
+                 'template_depth', 'template_started')
+
+    def __init__(self, sampled):
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.template_started = 0.0
+
+
+class EndpointMetrics:
+    """Running totals for one endpoint"""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.statuses = defaultdict(int)
+        self.sampled = 0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.slow = 0
+
+
+# SQLAlchemy and Flask signal hooks; they only do work for sampled requests
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    stats = _current.get()
+    if stats is not None and stats.sampled:
+        conn.info.setdefault('blogly_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = _current.get()
+    if stats is None or not stats.sampled:
+        return
+    started = conn.info.get('blogly_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if elapsed > stats.slowest_seconds:
+        stats.slowest_seconds = elapsed
+        stats.slowest_statement = statement
+
+
+def _before_render(app, template, context, **extra):
+    stats = _current.get()
+    if stats is not None and stats.sampled:
+        if stats.template_depth == 0:
+            stats.template_started = time.perf_counter()
+        stats.template_depth += 1
+
+
+def _rendered(app, template, context, **extra):
+    stats = _current.get()
+    if stats is not None and stats.sampled and stats.template_depth:
+        stats.template_depth -= 1
+        if stats.template_depth == 0:
+            stats.template_seconds += time.perf_counter() - stats.template_started
+
+
+class Instrumentation:
+    """Collects request metrics for an app and serves them at /metrics"""
+
+    def __init__(self, app=None):
+        self.metrics = defaultdict(EndpointMetrics)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION', True)
+        app.config.setdefault('METRICS_SAMPLE_RATE', 1.0)
+        app.config.setdefault('SLOW_REQUEST_MS', 500)
+        app.config.setdefault('METRICS_ALLOWED_IPS', ['127.0.0.0/8', '::1'])
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.extensions['instrumentation'] = self
+        if not app.config['INSTRUMENTATION']:
+            return
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        request_started.connect(self._started, app)
+        request_finished.connect(self._finished, app)
+        got_request_exception.connect(self._failed, app)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_rendered, app)
+        app.teardown_request(self._teardown)
+        app.register_blueprint(metrics_bp)
+
+    def _started(self, app, **extra):
+        rate = app.config['METRICS_SAMPLE_RATE']
+        _current.set(RequestStats(rate >= 1 or random.random() < rate))
+
+    def _finished(self, app, response, **extra):
+        self.record(app, response.status_code)
+
+    def _failed(self, app, exception, **extra):
+        # Flask sends request_finished for the 500 response it builds, but
+        # not when the exception propagates (testing and debug mode)
+        if app.propagate_exceptions:
+            self.record(app, 500)
+
+    def _teardown(self, exc):
+        _current.set(None)
+
+    def record(self, app, status):
+        """Add the current request's measurements to the totals"""
+        stats = _current.get()
+        if stats is None:
+            return
+        _current.set(None)
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unmatched'
+        slow = elapsed * 1000 >= app.config['SLOW_REQUEST_MS']
+        with self._lock:
+            metrics = self.metrics[(endpoint, request.method)]
+            metrics.count += 1
+            metrics.seconds += elapsed
+            metrics.statuses[status] += 1
+            index = bisect.bisect_left(BUCKETS, elapsed)
+            if index < len(BUCKETS):
+                metrics.buckets[index] += 1
+            if stats.sampled:
+                metrics.sampled += 1
+                metrics.sql_count += stats.sql_count
+                metrics.sql_seconds += stats.sql_seconds
+                metrics.template_seconds += stats.template_seconds
+            if slow:
+                metrics.slow += 1
+        if slow:
+            self.log_slow(endpoint, status, elapsed, stats)
+
+    def log_slow(self, endpoint, status, elapsed, stats):
+        entry = {
+            'event': 'slow_request',
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': status,
+            'duration_ms': round(elapsed * 1000, 2),
+            'sampled': stats.sampled,
+        }
+        if stats.sampled:
+            entry.update({
+                'template_ms': round(stats.template_seconds * 1000, 2),
+                'sql_count': stats.sql_count,
+                'sql_ms': round(stats.sql_seconds * 1000, 2),
+                'slowest_sql_ms': round(stats.slowest_seconds * 1000, 2),
+                'slowest_sql': (stats.slowest_statement or '')[:STATEMENT_CHARS],
+            })
+        slow_log.warning(json.dumps(entry))
+
+    def reset(self):
+        with self._lock:
+            self.metrics.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            items = sorted(self.metrics.items())
+            family('blogly_request_duration_seconds', 'histogram',
+                   'Wall time of each request.')
+            for (endpoint, method), m in items:
+                labels = _labels(endpoint=endpoint, method=method)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, m.buckets):
+                    cumulative += count
+                    lines.append('blogly_request_duration_seconds_bucket'
+                                 f'{_labels(endpoint=endpoint, method=method, le=repr(bound))} '
+                                 f'{cumulative}')
+                lines.append('blogly_request_duration_seconds_bucket'
+                             f'{_labels(endpoint=endpoint, method=method, le="+Inf")} '
+                             f'{m.count}')
+                lines.append(f'blogly_request_duration_seconds_sum{labels} {m.seconds!r}')
+                lines.append(f'blogly_request_duration_seconds_count{labels} {m.count}')
+
+            family('blogly_responses_total', 'counter',
+                   'Responses by status code.')
+            for (endpoint, method), m in items:
+                for status, count in sorted(m.statuses.items()):
+                    lines.append('blogly_responses_total'
+                                 f'{_labels(endpoint=endpoint, method=method, status=status)} '
+                                 f'{count}')
+
+            counters = [
+                ('blogly_slow_requests_total', 'slow',
+                 'Requests slower than SLOW_REQUEST_MS.'),
+                ('blogly_sampled_requests_total', 'sampled',
+                 'Requests with SQL and template measurements.'),
+                ('blogly_sql_statements_total', 'sql_count',
+                 'SQL statements run by sampled requests.'),
+                ('blogly_sql_duration_seconds_total', 'sql_seconds',
+                 'Time in SQL statements of sampled requests.'),
+                ('blogly_template_render_seconds_total', 'template_seconds',
+                 'Template render time of sampled requests.'),
+            ]
+            for name, attribute, help_text in counters:
+                family(name, 'counter', help_text)
+                for (endpoint, method), m in items:
+                    lines.append(f'{name}{_labels(endpoint=endpoint, method=method)} '
+                                 f'{getattr(m, attribute)!r}')
+
+        stats = fragment_cache.stats()
+        family('blogly_fragment_cache_hits_total', 'counter',
+               'Fragment cache hits.')
+        for name, counts in stats['fragments'].items():
+            lines.append(f'blogly_fragment_cache_hits_total{_labels(fragment=name)} '
+                         f'{counts["hits"]}')
+        family('blogly_fragment_cache_misses_total', 'counter',
+               'Fragment cache misses.')
+        for name, counts in stats['fragments'].items():
+            lines.append(f'blogly_fragment_cache_misses_total{_labels(fragment=name)} '
+                         f'{counts["misses"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    def escape(value):
+        return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n'))
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in labels.items()) + '}'
+
+
+def scrape_allowed(req):
+    """Whether req may read /metrics: from an allowed address, or with
+    the token"""
+    config = current_app.config
+    token = config['METRICS_TOKEN']
+    if token and hmac.compare_digest(
+            req.headers.get('Authorization', '').encode(),
+            f'Bearer {token}'.encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(req.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in config['METRICS_ALLOWED_IPS'])
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    if not scrape_allowed(request):
+        abort(403)
+    body = current_app.extensions['instrumentation'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,232 @@
+"""Background jobs for deletes too large to run inside a request.
+
+Deleting a user or tag with ASYNC_DELETE_THRESHOLD or more posts is queued
+as a row in the jobs table and run on a small thread pool (JOB_WORKERS).
+The job removes the dependent rows in batches of DELETE_BATCH_SIZE, each in
+its own short transaction, so no lock is held for long and other writes
+interleave with it; the entity itself goes last. Progress and the outcome
+are recorded on the job row and served as JSON at /jobs/<id>.
+
+With JOBS_INLINE (the testing profile) jobs run in the request instead.
+Jobs left queued or running by a stopped worker are resumed with
+`flask blogly run-jobs`; every handler can safely start over.
+"""
+
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import select
+
+from models import db, User, Post, Tag, PostTag, FeedEntry, Job
+from cache import fragment_cache, tag_keys
+import feed
+import related
+
+ACTIVE = ('queued', 'running')
+
+log = logging.getLogger('blogly.jobs')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register a generator function as the handler of a kind of job. It is
+    called with the job's target id and yields the number of rows removed
+    by each batch; the runner commits after every yield."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def batch_size():
+    return current_app.config['DELETE_BATCH_SIZE']
+
+
+@handler('delete_user')
+def delete_user(user_id):
+    """Delete the user's posts a batch at a time, then the user. Their tags
+    and feed entries go with each batch through ON DELETE CASCADE."""
+    while True:
+        post_ids = [post_id for (post_id,) in
+                    db.session.query(Post.id).filter_by(user_id=user_id)
+                    .order_by(Post.id).limit(batch_size())]
+        if not post_ids:
+            break
+        batch_tags = {tag_id for (tag_id,) in
+                      db.session.query(PostTag.tag_id).distinct()
+                      .filter(PostTag.post_id.in_(post_ids))}
+        referrers = related.referrers(post_ids)
+        Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+        feed.refill([feed.GLOBAL, *map(feed.tag_scope, batch_tags)])
+        related.recompute(referrers - set(post_ids))
+        yield len(post_ids)
+        fragment_cache.invalidate('posts', *tag_keys(batch_tags))
+    yield User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    fragment_cache.invalidate('users')
+
+
+@handler('delete_tag')
+def delete_tag(tag_id):
+    """Untag the tag's posts a batch at a time, then delete the tag"""
+    while True:
+        post_ids = [post_id for (post_id,) in
+                    db.session.query(PostTag.post_id).filter_by(tag_id=tag_id)
+                    .order_by(PostTag.post_id).limit(batch_size())]
+        if not post_ids:
+            break
+        PostTag.query.filter(PostTag.tag_id == tag_id,
+                             PostTag.post_id.in_(post_ids)
+                             ).delete(synchronize_session=False)
+        # Only posts that are in some feed carry the tag's name there
+        in_feeds = [post_id for (post_id,) in
+                    db.session.query(FeedEntry.post_id).distinct()
+                    .filter(FeedEntry.post_id.in_(post_ids))]
+        feed.sync_posts(in_feeds)
+        related.update(post_ids)
+        yield len(post_ids)
+        fragment_cache.invalidate('posts', *tag_keys([tag_id]))
+    feed.drop_scope(feed.tag_scope(tag_id))
+    yield Tag.query.filter_by(id=tag_id).delete(synchronize_session=False)
+    fragment_cache.invalidate('tags', *tag_keys([tag_id]))
+
+
+def run(job_id):
+    """Run a queued job to completion in the current app context"""
+    now = datetime.datetime.now()
+    claimed = (Job.query.filter_by(id=job_id, status='queued')
+               .update({'status': 'running', 'started_at': now},
+                       synchronize_session=False))
+    db.session.commit()
+    if not claimed:
+        return
+    job = db.session.get(Job, job_id)
+    try:
+        for removed in HANDLERS[job.kind](job.target_id):
+            job.progress += removed
+            db.session.commit()
+        job.status = 'done'
+    except Exception as e:
+        log.exception('Job %s failed', job_id)
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = f'{type(e).__name__}: {e}'
+    job.finished_at = datetime.datetime.now()
+    db.session.commit()
+
+
+def _run_in_context(app, job_id):
+    _call_in_context(app, run, job_id)
+
+
+def _call_in_context(app, func, *args):
+    with app.app_context():
+        try:
+            return func(*args)
+        except Exception:
+            log.exception('Background call to %s failed', func.__name__)
+            raise
+        finally:
+            db.session.remove()
+
+
+class JobRunner:
+    """Runs jobs on a thread pool, or inline with JOBS_INLINE"""
+
+    def __init__(self, app=None):
+        self._executors = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_INLINE', False)
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('DELETE_BATCH_SIZE', 1000)
+        app.config.setdefault('ASYNC_DELETE_THRESHOLD', 1000)
+        app.extensions['jobs'] = self
+        app.register_blueprint(jobs_bp)
+
+    def executor(self, app):
+        if app not in self._executors:
+            self._executors[app] = ThreadPoolExecutor(
+                app.config['JOB_WORKERS'], thread_name_prefix='blogly-job')
+        return self._executors[app]
+
+    def submit(self, job_id):
+        """Start a committed job; returns a Future, or None when it ran inline"""
+        app = current_app._get_current_object()
+        if app.config['JOBS_INLINE']:
+            run(job_id)
+            return None
+        return self.executor(app).submit(_run_in_context, app, job_id)
+
+    def call(self, func, *args):
+        """Run func(*args) on the pool without a job row, for best-effort
+        work such as cache warming; inline with JOBS_INLINE"""
+        app = current_app._get_current_object()
+        if app.config['JOBS_INLINE']:
+            return func(*args)
+        return self.executor(app).submit(_call_in_context, app, func, *args)
+
+
+job_runner = JobRunner()
+
+
+def enqueue(kind, target_id):
+    """Queue a job unless the same one is already queued or running;
+    returns the Job. Commits the session."""
+    job = (Job.query.filter(Job.kind == kind, Job.target_id == target_id,
+                            Job.status.in_(ACTIVE))
+           .order_by(Job.id).first())
+    if job is not None:
+        return job
+    job = Job(kind=kind, target_id=target_id)
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+    current_app.extensions['jobs'].submit(job_id)
+    return db.session.get(Job, job_id)
+
+
+def resume():
+    """Requeue and run, inline, every job a stopped worker left behind;
+    returns how many. Run it only while no workers are running."""
+    Job.query.filter_by(status='running').update({'status': 'queued'},
+                                                 synchronize_session=False)
+    db.session.commit()
+    job_ids = db.session.execute(
+        select(Job.id).where(Job.status == 'queued').order_by(Job.id)
+    ).scalars().all()
+    for job_id in job_ids:
+        run(job_id)
+    return len(job_ids)
+
+
+def job_status(job):
+    def iso(value):
+        return value.isoformat() if value is not None else None
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'target_id': job.target_id,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': iso(job.created_at),
+        'started_at': iso(job.started_at),
+        'finished_at': iso(job.finished_at),
+    }
+
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+@jobs_bp.route('/jobs/<int:job_id>')
+def show_job(job_id):
+    """Status of a background job as JSON"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(job_status(job))
@@ -0,0 +1,223 @@
+"""Markdown for post content.
+
+Posts are written in a subset of Markdown: paragraphs, # headings, *, -
+and 1. lists, > quotes, ``` code blocks, `code`, **bold**, *italic*,
+[links](https://...) and <https://...> autolinks. The source is HTML
+escaped before any of it is converted, so raw HTML in a post is shown as
+text rather than run.
+
+render() turns content into HTML and a plain-text excerpt for listings.
+Posts store both, with content_hash: the SHA-256 of RENDERER_VERSION and
+the content they were rendered from. A post is only rendered again when
+that hash changes, so bump RENDERER_VERSION whenever the output of render()
+changes and run flask blogly rerender.
+"""
+
+import hashlib
+import html
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam, event, select
+
+from models import db, Post
+
+RENDERER_VERSION = 1
+EXCERPT_CHARS = 280
+
+SAFE_SCHEMES = ('http://', 'https://', 'mailto:')
+
+_FENCE = re.compile(r'^```')
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*$')
+_RULE = re.compile(r'^(?:-{3,}|\*{3,}|_{3,})$')
+_BULLET = re.compile(r'^[*+-]\s+(.*)$')
+_NUMBER = re.compile(r'^\d{1,9}[.)]\s+(.*)$')
+# After escaping, > is &gt;
+_QUOTE = re.compile(r'^&gt; ?(.*)$')
+
+_CODE = re.compile(r'`([^`\n]+)`')
+_LINK = re.compile(r'\[([^\]\n]+)\]\(([^)\s]+)\)')
+_AUTOLINK = re.compile(r'&lt;((?:https?://|mailto:)[^\s&]+)&gt;')
+_STRONG = re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1')
+_EMPHASIS = re.compile(r'(?<![\w*])\*(?=\S)(.+?)(?<=\S)\*(?!\*)'
+                       r'|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)')
+_TAG = re.compile(r'<[^>]*>')
+_BLOCK_END = re.compile(r'</(?:p|h\d|li|blockquote|pre)>|<br>|<hr>')
+
+
+def content_hash(content):
+    """Hash identifying content as rendered by this RENDERER_VERSION"""
+    return hashlib.sha256(
+        f'{RENDERER_VERSION}\n{content}'.encode()).hexdigest()
+
+
+def _safe_url(url):
+    # url is escaped already; &amp; in a query string is fine in an href
+    return url.startswith(SAFE_SCHEMES) or url.startswith('/')
+
+
+def inline(text):
+    """HTML of one escaped line or paragraph of inline Markdown"""
+    # Code spans first, kept out of the other rules by placeholders
+    spans = []
+
+    def keep(html_):
+        spans.append(html_)
+        return f'\x00{len(spans) - 1}\x00'
+
+    text = _CODE.sub(lambda m: keep(f'<code>{m.group(1)}</code>'), text)
+
+    def link(m):
+        label, url = m.groups()
+        if not _safe_url(url):
+            return m.group(0)
+        return keep(f'<a href="{url}" rel="nofollow">{label}</a>')
+
+    text = _LINK.sub(link, text)
+    text = _AUTOLINK.sub(
+        lambda m: keep(f'<a href="{m.group(1)}" rel="nofollow">{m.group(1)}</a>'),
+        text)
+    text = _STRONG.sub(r'<strong>\2</strong>', text)
+    text = _EMPHASIS.sub(lambda m: f'<em>{m.group(1) or m.group(2)}</em>', text)
+    return re.sub('\x00(\\d+)\x00', lambda m: spans[int(m.group(1))], text)
+
+
+def _blocks(lines):
+    """HTML of escaped Markdown lines"""
+    out = []
+    paragraph = []
+    i = 0
+
+    def flush():
+        if paragraph:
+            out.append(f'<p>{inline(chr(10).join(paragraph))}</p>')
+            paragraph.clear()
+
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if _FENCE.match(stripped):
+            flush()
+            code = []
+            i += 1
+            while i < len(lines) and not _FENCE.match(lines[i].strip()):
+                code.append(lines[i])
+                i += 1
+            out.append(f'<pre><code>{chr(10).join(code)}</code></pre>')
+            i += 1
+            continue
+        if not stripped:
+            flush()
+        elif _RULE.match(stripped):
+            flush()
+            out.append('<hr>')
+        elif _HEADING.match(stripped):
+            flush()
+            marks, text = _HEADING.match(stripped).groups()
+            out.append(f'<h{len(marks)}>{inline(text)}</h{len(marks)}>')
+        elif _QUOTE.match(stripped):
+            flush()
+            quoted = []
+            while i < len(lines) and _QUOTE.match(lines[i].strip()):
+                quoted.append(_QUOTE.match(lines[i].strip()).group(1))
+                i += 1
+            out.append(f'<blockquote>{_blocks(quoted)}</blockquote>')
+            continue
+        elif _BULLET.match(stripped) or _NUMBER.match(stripped):
+            flush()
+            pattern, tag = ((_BULLET, 'ul') if _BULLET.match(stripped)
+                            else (_NUMBER, 'ol'))
+            items = []
+            while i < len(lines) and pattern.match(lines[i].strip()):
+                items.append(f'<li>{inline(pattern.match(lines[i].strip()).group(1))}</li>')
+                i += 1
+            out.append(f'<{tag}>{"".join(items)}</{tag}>')
+            continue
+        else:
+            paragraph.append(stripped)
+        i += 1
+    flush()
+    return ''.join(out)
+
+
+def to_html(content):
+    """HTML of Markdown content"""
+    lines = str(escape(content)).replace('\r\n', '\n').split('\n')
+    return _blocks(lines)
+
+
+def to_text(content_html):
+    """Plain text of rendered HTML, one space between blocks and words"""
+    text = _TAG.sub('', _BLOCK_END.sub(' ', content_html))
+    return ' '.join(html.unescape(text).split())
+
+
+def excerpt(text):
+    """The start of text, cut at a word boundary"""
+    if len(text) <= EXCERPT_CHARS:
+        return text
+    return text[:EXCERPT_CHARS].rsplit(' ', 1)[0] + '…'
+
+
+def render(content):
+    """(HTML, plain-text excerpt) of Markdown content"""
+    content_html = to_html(content)
+    return content_html, excerpt(to_text(content_html))
+
+
+def rendered_columns(content):
+    """The Post columns derived from content"""
+    content_html, text = render(content)
+    return {'content_html': content_html, 'excerpt': text,
+            'content_hash': content_hash(content)}
+
+
+def render_post(post):
+    """Fill in post's HTML and excerpt unless its content is unchanged
+    since they were rendered; True if it rendered"""
+    if post.content is None or post.content_hash == content_hash(post.content):
+        return False
+    for name, value in rendered_columns(post.content).items():
+        setattr(post, name, value)
+    return True
+
+
+@event.listens_for(Post, 'before_insert')
+@event.listens_for(Post, 'before_update')
+def _render_on_write(mapper, connection, post):
+    render_post(post)
+
+
+def markdown(content):
+    """Template filter: content rendered as HTML"""
+    return Markup(to_html(content))
+
+
+def rerender(batch_size=500, force=False):
+    """Render every post whose stored HTML is missing or came from another
+    RENDERER_VERSION (every post when force), committing per batch;
+    returns how many were rendered"""
+    table = Post.__table__
+    rendered = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.content, table.c.content_hash)
+            .where(table.c.id > last_id).order_by(table.c.id)
+            .limit(batch_size)).all()
+        if not rows:
+            return rendered
+        last_id = rows[-1].id
+        changes = [{'post_id': row.id, **rendered_columns(row.content)}
+                   for row in rows
+                   if force or row.content_hash != content_hash(row.content)]
+        if changes:
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('post_id')),
+                changes)
+            rendered += len(changes)
+        db.session.commit()
+
+
+def init_app(app):
+    app.add_template_filter(markdown)
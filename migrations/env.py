@@ -0,0 +1,43 @@
+"""Alembic environment for Blogly.
+
+flask blogly migrate (see schema.py) hands this the app's engine; run from
+the alembic command line it builds the app for $BLOGLY_ENV instead.
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+
+from models import db
+from schema import include_object
+
+config = context.config
+engine = config.attributes.get('engine')
+if engine is None:
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name)
+    from app import create_app
+    engine = db.get_engine(create_app())
+
+
+def configure(**options):
+    context.configure(
+        target_metadata=db.Model.metadata,
+        include_object=include_object,
+        # SQLite can only add columns; batch mode copies the table instead
+        render_as_batch=engine.dialect.name == 'sqlite',
+        # Lets a revision create indexes concurrently on Postgres
+        transaction_per_migration=True,
+        **options)
+
+
+if context.is_offline_mode():
+    configure(url=engine.url.render_as_string(hide_password=False),
+              literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+else:
+    with engine.connect() as connection:
+        configure(connection=connection)
+        with context.begin_transaction():
+            context.run_migrations()
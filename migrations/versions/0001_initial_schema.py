@@ -0,0 +1,50 @@
+"""Initial schema: the tables db.create_all() made before migrations
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('first_name', sa.String(50), nullable=False),
+        sa.Column('last_name', sa.String(50), nullable=False),
+        sa.Column('image_url', sa.String(), nullable=False))
+    op.create_table(
+        'posts',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('title', sa.String(50), nullable=False),
+        sa.Column('content', sa.String(5000), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True)),
+        sa.Column('user_id', sa.Integer(),
+                  sa.ForeignKey('users.id', onupdate='CASCADE', ondelete='CASCADE')))
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(50), nullable=False, unique=True))
+    op.create_table(
+        'posts_tags',
+        sa.Column('post_id', sa.Integer(),
+                  sa.ForeignKey('posts.id', onupdate='CASCADE', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('tag_id', sa.Integer(),
+                  sa.ForeignKey('tags.id', onupdate='CASCADE', ondelete='CASCADE'),
+                  primary_key=True))
+
+
+def downgrade():
+    op.drop_table('posts_tags')
+    op.drop_table('tags')
+    op.drop_table('posts')
+    op.drop_table('users')
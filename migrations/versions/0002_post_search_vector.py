@@ -0,0 +1,38 @@
+"""Full-text search vector of posts, on Postgres
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+A generated tsvector column with a GIN index; other databases search
+without one (see search.py), so this does nothing on them.
+"""
+
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR = (
+    "ALTER TABLE posts ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')"
+    ") STORED")
+
+
+def upgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute(SEARCH_VECTOR)
+    op.execute("CREATE INDEX ix_posts_search_vector ON posts "
+               "USING GIN (search_vector)")
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX ix_posts_search_vector")
+    op.execute("ALTER TABLE posts DROP COLUMN search_vector")
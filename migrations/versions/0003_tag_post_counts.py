@@ -0,0 +1,92 @@
+"""Post counts of tags, kept by triggers on posts_tags
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+tags.post_count is filled from posts_tags here; from then on the triggers
+keep it current on every insert, delete and update of posts_tags.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+BACKFILL = (
+    "UPDATE tags SET post_count = "
+    "(SELECT count(*) FROM posts_tags WHERE posts_tags.tag_id = tags.id)")
+
+TRIGGERS = ['posts_tags_insert_count', 'posts_tags_delete_count',
+            'posts_tags_update_count']
+
+POSTGRES_COUNT_FUNCTION = """
+CREATE FUNCTION count_tag_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE tags SET post_count = tags.post_count - changed.n
+        FROM (SELECT tag_id, count(*) AS n FROM old_rows GROUP BY tag_id) AS changed
+        WHERE tags.id = changed.tag_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE tags SET post_count = tags.post_count + changed.n
+        FROM (SELECT tag_id, count(*) AS n FROM new_rows GROUP BY tag_id) AS changed
+        WHERE tags.id = changed.tag_id;
+    END IF;
+    RETURN NULL;
+END
+$$"""
+
+POSTGRES_COUNT_TRIGGERS = (
+    "CREATE TRIGGER posts_tags_insert_count AFTER INSERT ON posts_tags "
+    "REFERENCING NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE count_tag_posts()",
+    "CREATE TRIGGER posts_tags_delete_count AFTER DELETE ON posts_tags "
+    "REFERENCING OLD TABLE AS old_rows "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE count_tag_posts()",
+    "CREATE TRIGGER posts_tags_update_count AFTER UPDATE ON posts_tags "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE PROCEDURE count_tag_posts()")
+
+SQLITE_COUNT_TRIGGERS = (
+    "CREATE TRIGGER posts_tags_insert_count AFTER INSERT ON posts_tags "
+    "BEGIN UPDATE tags SET post_count = post_count + 1 "
+    "WHERE id = NEW.tag_id; END",
+    "CREATE TRIGGER posts_tags_delete_count AFTER DELETE ON posts_tags "
+    "BEGIN UPDATE tags SET post_count = post_count - 1 "
+    "WHERE id = OLD.tag_id; END",
+    "CREATE TRIGGER posts_tags_update_count AFTER UPDATE OF tag_id "
+    "ON posts_tags "
+    "BEGIN UPDATE tags SET post_count = post_count - 1 "
+    "WHERE id = OLD.tag_id; "
+    "UPDATE tags SET post_count = post_count + 1 "
+    "WHERE id = NEW.tag_id; END")
+
+
+def upgrade():
+    dialect = op.get_context().dialect.name
+    op.add_column('tags', sa.Column('post_count', sa.Integer(), nullable=False,
+                                    server_default='0'))
+    op.execute(BACKFILL)
+    if dialect == 'postgresql':
+        op.execute(POSTGRES_COUNT_FUNCTION)
+        for trigger in POSTGRES_COUNT_TRIGGERS:
+            op.execute(trigger)
+    elif dialect == 'sqlite':
+        for trigger in SQLITE_COUNT_TRIGGERS:
+            op.execute(trigger)
+
+
+def downgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'postgresql':
+        for trigger in TRIGGERS:
+            op.execute(f"DROP TRIGGER {trigger} ON posts_tags")
+        op.execute("DROP FUNCTION count_tag_posts()")
+    elif dialect == 'sqlite':
+        for trigger in TRIGGERS:
+            op.execute(f"DROP TRIGGER {trigger}")
+    op.drop_column('tags', 'post_count')
@@ -0,0 +1,35 @@
+"""Background jobs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('kind', sa.String(30), nullable=False),
+        sa.Column('target_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(10), nullable=False),
+        sa.Column('progress', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text()),
+        sa.Column('created_at', sa.DateTime(timezone=True)),
+        sa.Column('started_at', sa.DateTime(timezone=True)),
+        sa.Column('finished_at', sa.DateTime(timezone=True)))
+    op.create_index('ix_jobs_kind_target_id_status', 'jobs',
+                    ['kind', 'target_id', 'status'])
+
+
+def downgrade():
+    op.drop_index('ix_jobs_kind_target_id_status', table_name='jobs')
+    op.drop_table('jobs')
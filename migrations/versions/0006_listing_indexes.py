@@ -0,0 +1,50 @@
+"""Indexes for the listings' sorts and joins
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+Each ends with the primary key so keyset pagination can seek on it. On
+Postgres they are built CONCURRENTLY, outside a transaction, so a live
+database keeps taking writes meanwhile; IF NOT EXISTS skips the ones a
+database made by db.create_all() already has.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# name -> (table, columns)
+INDEXES = {
+    # /users, A-Z
+    'ix_users_last_name_first_name_id': ('users', ['last_name', 'first_name', 'id']),
+    # /posts and the tag pages' post lists, A-Z
+    'ix_posts_title_id': ('posts', ['title', 'id']),
+    # Recent posts
+    'ix_posts_created_at_id': ('posts', ['created_at', 'id']),
+    # A user's posts, newest first; also covers posts.user_id for the
+    # foreign key's cascades
+    'ix_posts_user_id_created_at_id': ('posts', ['user_id', 'created_at', 'id']),
+    # posts_tags' primary key starts with post_id; this joins from a tag
+    'ix_posts_tags_tag_id_post_id': ('posts_tags', ['tag_id', 'post_id']),
+    # Tag cloud, most used first
+    'ix_tags_post_count_name': ('tags', [sa.text('post_count DESC'), 'name']),
+}
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in INDEXES.items():
+            op.create_index(name, table, columns, if_not_exists=True,
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in INDEXES.items():
+            op.drop_index(name, table_name=table, if_exists=True,
+                          postgresql_concurrently=True)
@@ -0,0 +1,32 @@
+"""Rendered Markdown of posts: content_html, excerpt and content_hash
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+The columns start out NULL; run flask blogly rerender afterwards to fill
+them in. Until then posts are rendered as they are shown.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = [sa.Column('content_html', sa.Text()),
+           sa.Column('excerpt', sa.String(300)),
+           sa.Column('content_hash', sa.String(64))]
+
+
+def upgrade():
+    for column in COLUMNS:
+        op.add_column('posts', column)
+
+
+def downgrade():
+    for column in reversed(COLUMNS):
+        op.drop_column('posts', column.name)
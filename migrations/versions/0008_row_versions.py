@@ -0,0 +1,27 @@
+"""Version counters for optimistic locking on users, posts and tags
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+TABLES = ['users', 'posts', 'tags']
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False,
+                                       server_default='1'))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_column(table, 'version')
@@ -0,0 +1,36 @@
+"""Precomputed related posts
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'related_posts',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('related_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['related_id'], ['posts.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('post_id', 'related_id'),
+    )
+    op.create_index('ix_related_posts_related_id', 'related_posts',
+                    ['related_id'])
+    # Filled by flask blogly rebuild-related
+
+
+def downgrade():
+    op.drop_index('ix_related_posts_related_id', table_name='related_posts')
+    op.drop_table('related_posts')
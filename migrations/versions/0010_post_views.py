@@ -0,0 +1,36 @@
+"""Post view counts and hourly views for the trending posts
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('views', sa.Integer(), nullable=False,
+                                     server_default='0'))
+    op.create_table(
+        'post_views',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('hour', sa.Integer(), nullable=False),
+        sa.Column('views', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['post_id'], ['posts.id'],
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('post_id', 'hour'),
+    )
+    op.create_index('ix_post_views_hour_post_id', 'post_views',
+                    ['hour', 'post_id'])
+
+
+def downgrade():
+    op.drop_index('ix_post_views_hour_post_id', table_name='post_views')
+    op.drop_table('post_views')
+    op.drop_column('posts', 'views')
@@ -1,11 +1,14 @@
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.sql import func, asc, desc
 import datetime
-from sqlalchemy import asc, desc
+import sqlite3
+from sqlalchemy import asc, desc, event, DDL
+from sqlalchemy.engine import Engine
+
+from replicas import RoutingSQLAlchemy
 
 """Models for Blogly."""
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 def connect_db(app):
@@ -13,9 +16,23 @@ def connect_db(app):
     db.init_app(app)
 
 
+@event.listens_for(Engine, 'connect')
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys, and runs their ON DELETE CASCADE
+    actions, when asked to on each connection"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
 class User(db.Model):
     """User"""
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_last_name_first_name_id',
+                 'last_name', 'first_name', 'id'),
+    )
 
     def __repr__(self):
         """Show information about user"""
@@ -26,6 +43,13 @@ class User(db.Model):
     last_name = db.Column(db.String(50), nullable=False)
     image_url = db.Column(db.String, nullable=False,
                           default='https://randomuser.me/api/portraits/lego/1.jpg')
+    # Optimistic locking: every ORM update bumps it and only applies while
+    # the row is still at the version it was read at. The edit forms send
+    # it back so edits made from a stale copy are refused (409).
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     @property
     def full_name(self):
@@ -35,17 +59,41 @@ class User(db.Model):
 class Post(db.Model):
     """Post"""
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_title_id', 'title', 'id'),
+        db.Index('ix_posts_created_at_id', 'created_at', 'id'),
+        db.Index('ix_posts_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.String(50), nullable=False)
     content = db.Column(db.String(5000), nullable=False, default=None)
+    # Rendered from content by markup.py on every write; NULL on rows
+    # written before they existed, until flask blogly rerender
+    content_html = db.Column(db.Text)
+    excerpt = db.Column(db.String(300))
+    content_hash = db.Column(db.String(64))
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+    # Written behind in batches by counters.py, which bypasses the version
+    views = db.Column(db.Integer, nullable=False, default=0,
+                      server_default='0')
     created_at = db.Column(db.DateTime(timezone=True),
                            default=datetime.datetime.now)
     user_id = db.Column(db.Integer, db.ForeignKey(
         'users.id', onupdate='CASCADE', ondelete='CASCADE'))
 
+    __mapper_args__ = {'version_id_col': version}
+
     user = db.relationship('User', backref='posts')
     tags = db.relationship('Tag', secondary='posts_tags', backref='posts')
+    # Most similar posts first, as precomputed by related.py
+    related = db.relationship(
+        'Post', secondary='related_posts',
+        primaryjoin='Post.id == RelatedPost.post_id',
+        secondaryjoin='Post.id == RelatedPost.related_id',
+        order_by='[RelatedPost.score.desc(), RelatedPost.related_id.desc()]',
+        viewonly=True)
 
     def __repr__(self):
         """Show information about Post"""
@@ -56,16 +104,186 @@ class Post(db.Model):
         return self.created_at.strftime("%a %b %-d %Y, %-I:%M %p")
 
 
+# Full-text search on Postgres: a generated tsvector over title (weight A)
+# and content (weight B) with a GIN index. It is not mapped on Post; see
+# search.py, which falls back to an in-memory index on other databases.
+event.listen(Post.__table__, 'after_create', DDL(
+    "ALTER TABLE posts ADD COLUMN search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')"
+    ") STORED").execute_if(dialect='postgresql'))
+event.listen(Post.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_posts_search_vector ON posts USING GIN (search_vector)"
+).execute_if(dialect='postgresql'))
+
+
 class Tag(db.Model):
     """Tag"""
     __tablename__ = 'tags'
+    __table_args__ = (
+        db.Index('ix_tags_post_count_name', desc('post_count'), 'name'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
+    # Number of posts_tags rows for this tag, kept by the triggers below;
+    # read-only from Python. flask blogly reconcile-counts repairs drift.
+    post_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
 
 class PostTag(db.Model):
     """Tags on Posts"""
     __tablename__ = 'posts_tags'
+    __table_args__ = (
+        db.Index('ix_posts_tags_tag_id_post_id', 'tag_id', 'post_id'),
+    )
     post_id = db.Column(db.Integer, db.ForeignKey(
         'posts.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
     tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+
+
+class RelatedPost(db.Model):
+    """A post similar to another through their shared tags, with its score
+    (see related.py); each post keeps its RELATED_POSTS best"""
+    __tablename__ = 'related_posts'
+    __table_args__ = (
+        db.Index('ix_related_posts_related_id', 'related_id'),
+    )
+
+    post_id = db.Column(db.Integer, db.ForeignKey(
+        'posts.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey(
+        'posts.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f'<RelatedPost {self.post_id} -> {self.related_id}>'
+
+
+class PostView(db.Model):
+    """Views of a post in one hour, for the trending posts (counters.py)"""
+    __tablename__ = 'post_views'
+    __table_args__ = (
+        db.Index('ix_post_views_hour_post_id', 'hour', 'post_id'),
+    )
+
+    post_id = db.Column(db.Integer, db.ForeignKey(
+        'posts.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    # Hours since the Unix epoch
+    hour = db.Column(db.Integer, primary_key=True)
+    views = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<PostView post={self.post_id} hour={self.hour}: {self.views}>'
+
+
+class FeedEntry(db.Model):
+    """A post in one of the precomputed recent-posts feeds (see feed.py),
+    with what the listing shows of its author and tags copied in"""
+    __tablename__ = 'feed_entries'
+    __table_args__ = (
+        db.Index('ix_feed_entries_scope_created_at_post_id',
+                 'scope', 'created_at', 'post_id'),
+        db.Index('ix_feed_entries_author_id', 'author_id'),
+    )
+
+    # 'global', 'user:<id>' or 'tag:<id>'
+    scope = db.Column(db.String(30), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey(
+        'posts.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    title = db.Column(db.String(50), nullable=False)
+    summary = db.Column(db.String(300), nullable=False)
+    author_id = db.Column(db.Integer, nullable=False)
+    author_name = db.Column(db.String(101), nullable=False)
+    author_image = db.Column(db.String, nullable=False)
+    # [[tag id, tag name], ...] in name order
+    tags = db.Column(db.JSON, nullable=False, default=list)
+
+    def __repr__(self):
+        return f'<FeedEntry {self.scope} post={self.post_id}>'
+
+    @property
+    def date(self):
+        return self.created_at.strftime("%a %b %-d %Y, %-I:%M %p")
+
+
+class Job(db.Model):
+    """A unit of background work (see jobs.py), e.g. deleting a user with
+    many posts in batches"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_kind_target_id_status', 'kind', 'target_id', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(30), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False)
+    # queued, running, done or failed
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    # Rows removed so far
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True),
+                           default=datetime.datetime.now)
+    started_at = db.Column(db.DateTime(timezone=True))
+    finished_at = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.target_id} {self.status}>'
+
+
+# Tag.post_count triggers. On Postgres they run once per statement over its
+# transition tables, so bulk loads and cascaded deletes update each tag once.
+event.listen(PostTag.__table__, 'after_create', DDL("""
+CREATE FUNCTION count_tag_posts() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE tags SET post_count = tags.post_count - changed.n
+        FROM (SELECT tag_id, count(*) AS n FROM old_rows GROUP BY tag_id) AS changed
+        WHERE tags.id = changed.tag_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE tags SET post_count = tags.post_count + changed.n
+        FROM (SELECT tag_id, count(*) AS n FROM new_rows GROUP BY tag_id) AS changed
+        WHERE tags.id = changed.tag_id;
+    END IF;
+    RETURN NULL;
+END
+$$""").execute_if(dialect='postgresql'))
+for trigger in (
+        "CREATE TRIGGER posts_tags_insert_count AFTER INSERT ON posts_tags "
+        "REFERENCING NEW TABLE AS new_rows "
+        "FOR EACH STATEMENT EXECUTE PROCEDURE count_tag_posts()",
+        "CREATE TRIGGER posts_tags_delete_count AFTER DELETE ON posts_tags "
+        "REFERENCING OLD TABLE AS old_rows "
+        "FOR EACH STATEMENT EXECUTE PROCEDURE count_tag_posts()",
+        "CREATE TRIGGER posts_tags_update_count AFTER UPDATE ON posts_tags "
+        "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+        "FOR EACH STATEMENT EXECUTE PROCEDURE count_tag_posts()"):
+    event.listen(PostTag.__table__, 'after_create',
+                 DDL(trigger).execute_if(dialect='postgresql'))
+event.listen(PostTag.__table__, 'after_drop', DDL(
+    "DROP FUNCTION IF EXISTS count_tag_posts()"
+).execute_if(dialect='postgresql'))
+
+for trigger in (
+        "CREATE TRIGGER posts_tags_insert_count AFTER INSERT ON posts_tags "
+        "BEGIN UPDATE tags SET post_count = post_count + 1 "
+        "WHERE id = NEW.tag_id; END",
+        "CREATE TRIGGER posts_tags_delete_count AFTER DELETE ON posts_tags "
+        "BEGIN UPDATE tags SET post_count = post_count - 1 "
+        "WHERE id = OLD.tag_id; END",
+        "CREATE TRIGGER posts_tags_update_count AFTER UPDATE OF tag_id "
+        "ON posts_tags "
+        "BEGIN UPDATE tags SET post_count = post_count - 1 "
+        "WHERE id = OLD.tag_id; "
+        "UPDATE tags SET post_count = post_count + 1 "
+        "WHERE id = NEW.tag_id; END"):
+    event.listen(PostTag.__table__, 'after_create',
+                 DDL(trigger).execute_if(dialect='sqlite'))
@@ -0,0 +1,158 @@
+"""Keyset (cursor) pagination for Blogly listings."""
+
+import base64
+import datetime
+import json
+import operator
+
+from flask import abort, current_app, request
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_MAX_PAGE_SIZE = 200
+
+
+class Page:
+    """One page of rows plus the cursors for the pages around it"""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return datetime.datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(values):
+    """Encode the key values of a row as an opaque, URL-safe cursor"""
+    raw = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor, or raise ValueError"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+    if not isinstance(values, list):
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return [_decode_value(v) for v in values]
+
+
+def _row_key(row, columns):
+    return [getattr(row, column.key) for column in columns]
+
+
+def paginate(query, columns, after=None, before=None, per_page=DEFAULT_PAGE_SIZE,
+             descending=False):
+    """Return the Page of query ordered by columns that follows the
+    after cursor or precedes the before cursor.
+
+    columns must end with a unique column (normally the primary key) so
+    that every row has a distinct position in the ordering. With
+    descending, the ordering is reversed (e.g. newest first).
+    """
+    query, finish = keyset(query, columns, after, before, per_page, descending)
+    return finish(query.all())
+
+
+def keyset(query, columns, after=None, before=None, per_page=DEFAULT_PAGE_SIZE,
+           descending=False):
+    """The paginate() of a query or select() in two steps, for callers that
+    run the statement themselves (asgi.py): (the statement for the page,
+    a function turning its rows into the Page)"""
+    keys = tuple_(*columns)
+    query = query.order_by(None)
+    forward = [column.desc() for column in columns] if descending else list(columns)
+    backward = list(columns) if descending else [column.desc() for column in columns]
+    follows = operator.lt if descending else operator.gt
+    precedes = operator.gt if descending else operator.lt
+    if before is not None:
+        values = decode_cursor(before)
+        if len(values) != len(columns):
+            raise ValueError(f'Invalid cursor: {before}')
+        query = (query.filter(precedes(keys, tuple_(*values)))
+                 .order_by(*backward)
+                 .limit(per_page + 1))
+    else:
+        if after is not None:
+            values = decode_cursor(after)
+            if len(values) != len(columns):
+                raise ValueError(f'Invalid cursor: {after}')
+            query = query.filter(follows(keys, tuple_(*values)))
+        query = query.order_by(*forward).limit(per_page + 1)
+
+    def finish(rows):
+        if before is not None:
+            has_prev = len(rows) > per_page
+            rows = rows[:per_page][::-1]
+            has_next = True
+        else:
+            has_next = len(rows) > per_page
+            rows = rows[:per_page]
+            has_prev = after is not None
+        next_cursor = prev_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(_row_key(rows[-1], columns))
+        if rows and has_prev:
+            prev_cursor = encode_cursor(_row_key(rows[0], columns))
+        return Page(rows, per_page, next_cursor, prev_cursor)
+    return query, finish
+
+
+def page_size():
+    """Page size for this request: ?per_page= bounded by the app config"""
+    default = current_app.config.get('PAGE_SIZE', DEFAULT_PAGE_SIZE)
+    maximum = current_app.config.get('MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+    per_page = request.args.get('per_page', default, type=int)
+    return max(1, min(per_page, maximum))
+
+
+def page_args():
+    """The request args that select a page, for use in cache keys"""
+    return (request.args.get('after'), request.args.get('before'), page_size())
+
+
+def paginate_request(query, columns, descending=False):
+    """Paginate query using the after/before/per_page request args"""
+    query, finish = keyset_request(query, columns, descending)
+    return finish(query.all())
+
+
+def keyset_request(query, columns, descending=False):
+    """keyset() using the after/before/per_page request args"""
+    try:
+        return keyset(query, columns,
+                      after=request.args.get('after'),
+                      before=request.args.get('before'),
+                      per_page=page_size(),
+                      descending=descending)
+    except ValueError:
+        abort(400)
@@ -0,0 +1,142 @@
+"""Page queries for Blogly, with eager loading of the relations each page renders."""
+
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, User, Post, Tag, PostTag
+
+# WSGI environ key of what the ASGI server loaded ahead of the view
+PREFETCH_KEY = 'blogly.prefetched'
+
+
+def prefetched():
+    """What asgi.py loaded for this request with the async engine before
+    handing it to the view, or None to query as usual"""
+    return request.environ.get(PREFETCH_KEY)
+
+
+# Keyset orderings used for pagination; each ends with the primary key
+USER_ORDER = (User.last_name, User.first_name, User.id)
+POST_ORDER = (Post.title, Post.id)
+TAG_ORDER = (Tag.name, Tag.id)
+RECENT_ORDER = (Post.created_at, Post.id)
+
+
+def users_by_name():
+    """Users ordered by last name, then first name"""
+    return User.query.order_by(*USER_ORDER)
+
+
+def posts_of_user(user_id):
+    """user_id's posts with their tags loaded; page them newest first with
+    RECENT_ORDER and descending=True"""
+    return (Post.query
+            .options(selectinload(Post.tags))
+            .filter(Post.user_id == user_id))
+
+
+def has_older_posts(user_id, created_at, post_id):
+    """Whether user_id has a post older than (created_at, post_id)"""
+    older = posts_of_user(user_id).filter(
+        tuple_(*RECENT_ORDER) < tuple_(created_at, post_id))
+    return db.session.query(older.exists()).scalar()
+
+
+def posts_by_title():
+    """All posts ordered by title"""
+    return Post.query.order_by(*POST_ORDER)
+
+
+def posts_with_authors():
+    """All posts ordered by title with their author loaded"""
+    return posts_by_title().options(joinedload(Post.user))
+
+
+def tags_by_name():
+    """All tags ordered by name"""
+    return Tag.query.order_by(*TAG_ORDER)
+
+
+def tag_cloud(limit):
+    """The limit most used tags, most used first (read from the
+    ix_tags_post_count_name index)"""
+    return (Tag.query.filter(Tag.post_count > 0)
+            .order_by(Tag.post_count.desc(), Tag.name)
+            .limit(limit))
+
+
+def post_with_user_and_tags(post_id):
+    """Post for post_id with its author and tags loaded, or 404"""
+    return (Post.query
+            .options(joinedload(Post.user), selectinload(Post.tags))
+            .filter_by(id=post_id)
+            .first_or_404())
+
+
+def post_with_related(post_id):
+    """Post for post_id with its author, tags and related posts loaded, or
+    404"""
+    return (Post.query
+            .options(joinedload(Post.user), selectinload(Post.tags),
+                     selectinload(Post.related))
+            .filter_by(id=post_id)
+            .first_or_404())
+
+
+def posts_for_tag(tag_id):
+    """Posts tagged with tag_id ordered by title"""
+    return (Post.query
+            .join(PostTag, PostTag.post_id == Post.id)
+            .filter(PostTag.tag_id == tag_id)
+            .order_by(*POST_ORDER))
+
+
+def tag_ids_of_post(post_id):
+    """Ids of the tags on post_id"""
+    rows = db.session.query(PostTag.tag_id).filter(PostTag.post_id == post_id)
+    return {tag_id for (tag_id,) in rows}
+
+
+def tag_ids_of_user(user_id):
+    """Ids of the tags on any of user_id's posts"""
+    rows = (db.session.query(PostTag.tag_id).distinct()
+            .join(Post, Post.id == PostTag.post_id)
+            .filter(Post.user_id == user_id))
+    return {tag_id for (tag_id,) in rows}
+
+
+def tagged_post_ids(tag_id, post_ids):
+    """The subset of post_ids that are tagged with tag_id"""
+    if not post_ids:
+        return set()
+    rows = (db.session.query(PostTag.post_id)
+            .filter(PostTag.tag_id == tag_id, PostTag.post_id.in_(post_ids)))
+    return {post_id for (post_id,) in rows}
+
+
+class QueryCounter:
+    """Collects the SQL statements executed while it is active"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Count every SQL statement sent to any engine inside the block"""
+    counter = QueryCounter()
+    event.listen(Engine, 'before_cursor_execute', counter._record)
+    try:
+        yield counter
+    finally:
+        event.remove(Engine, 'before_cursor_execute', counter._record)
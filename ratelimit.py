@@ -0,0 +1,227 @@
+"""Rate limits for the write routes.
+
+Every request that can change data (anything but GET, HEAD and OPTIONS)
+takes a token from two token buckets: one per client IP and route, which
+refills at RATELIMIT_RATE tokens a second up to RATELIMIT_BURST (or the
+(rate, burst) RATELIMIT_ROUTES gives the endpoint), and one per client IP
+across all routes (RATELIMIT_IP_RATE, RATELIMIT_IP_BURST). With either
+empty the request is refused with 429 Too Many Requests and a Retry-After
+of the seconds until both have a token again; nothing is taken from
+either bucket then.
+
+The client is request.remote_addr; behind a reverse proxy, wrap the app
+in werkzeug's ProxyFix so that is the client rather than the proxy.
+
+RATELIMIT_BACKEND "memory" keeps the buckets in a dict in each worker
+process, without a lock: a bucket is replaced in one assignment, so two
+threads spending the same bucket at once can let one extra request
+through, but never block each other. With several worker processes on one
+host, "shared" keeps them in a memory-mapped file (RATELIMIT_SHARED_PATH)
+that every worker maps, locking only the few slots a request touches.
+"""
+
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from flask import current_app, render_template, request
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the memory backend
+    fcntl = None
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+DEFAULT_MAX_KEYS = 100000
+DEFAULT_SHARED_SLOTS = 65536
+
+
+class MemoryBuckets:
+    """Token buckets in a dict: key -> (tokens, updated, full at)"""
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = {}
+
+    def hit(self, limits):
+        """Take a token from each of the (key, rate, burst) buckets, or
+        from none of them; returns 0, or the seconds to wait"""
+        now = self.clock()
+        buckets = self._buckets
+        updates = []
+        wait = 0
+        for key, rate, burst in limits:
+            state = buckets.get(key)
+            if state is None:
+                tokens = burst
+            else:
+                tokens = min(burst, state[0] + (now - state[1]) * rate)
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / rate)
+            updates.append((key, tokens - 1, now + (burst - tokens + 1) / rate))
+        if wait:
+            return wait
+        for key, tokens, full_at in updates:
+            buckets[key] = (tokens, now, full_at)
+        if len(buckets) > self.max_keys:
+            self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        """Forget buckets that have refilled; failing that, the tenth that
+        will refill soonest"""
+        full = [key for key, state in list(self._buckets.items())
+                if state[2] <= now]
+        if not full:
+            items = list(self._buckets.items())
+            full = [key for key, state in heapq.nsmallest(
+                len(items) // 10 or 1, items, key=lambda item: item[1][2])]
+        for key in full:
+            self._buckets.pop(key, None)
+
+    def clear(self):
+        self._buckets.clear()
+
+
+class SharedBuckets:
+    """Token buckets in a memory-mapped file shared by the processes that
+    open it. Keys hash to a set of WAYS slots; a new key takes the slot of
+    that set used least recently. Each set is guarded by an fcntl lock on
+    its bytes."""
+    SLOT = struct.Struct('<Qdd')  # key fingerprint, tokens, updated
+    WAYS = 4
+
+    def __init__(self, path, slots=DEFAULT_SHARED_SLOTS, clock=time.time):
+        if fcntl is None:
+            raise ValueError('The shared rate limit backend needs fcntl')
+        # Wall-clock time: the file outlives the processes that use it
+        self.clock = clock
+        self.sets = max(1, slots // self.WAYS)
+        self.set_size = self.SLOT.size * self.WAYS
+        size = self.sets * self.set_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    @staticmethod
+    def fingerprint(key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        # 0 marks an empty slot
+        return int.from_bytes(digest, 'little') | 1
+
+    def _find(self, offset, fingerprint):
+        """Offset of the slot holding fingerprint in the set at offset, or
+        of the slot to reuse for it; and its (tokens, updated) or None"""
+        oldest = None
+        for way in range(self.WAYS):
+            slot = offset + way * self.SLOT.size
+            found, tokens, updated = self.SLOT.unpack_from(self._map, slot)
+            if found == fingerprint:
+                return slot, (tokens, updated)
+            if oldest is None or updated < oldest[1]:
+                oldest = (slot, updated)
+        return oldest[0], None
+
+    def hit(self, limits):
+        """As MemoryBuckets.hit()"""
+        keyed = []
+        for key, rate, burst in limits:
+            fingerprint = self.fingerprint(key)
+            offset = fingerprint % self.sets * self.set_size
+            keyed.append((offset, fingerprint, rate, burst))
+        offsets = sorted({item[0] for item in keyed})
+        # In offset order, so two processes never wait on each other's lock
+        for offset in offsets:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.set_size, offset)
+        try:
+            now = self.clock()
+            updates = []
+            wait = 0
+            for offset, fingerprint, rate, burst in keyed:
+                slot, state = self._find(offset, fingerprint)
+                if state is None or state[1] > now:
+                    tokens = burst
+                else:
+                    tokens = min(burst, state[0] + (now - state[1]) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                updates.append((slot, fingerprint, tokens - 1))
+            if wait:
+                return wait
+            for slot, fingerprint, tokens in updates:
+                self.SLOT.pack_into(self._map, slot, fingerprint, tokens, now)
+            return 0
+        finally:
+            for offset in offsets:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.set_size, offset)
+
+    def clear(self):
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            self._map[:] = bytes(len(self._map))
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+def make_backend(config):
+    """Build the backend named by config['RATELIMIT_BACKEND']"""
+    name = config.get('RATELIMIT_BACKEND', 'memory')
+    if name == 'memory':
+        return MemoryBuckets(config.get('RATELIMIT_MAX_KEYS', DEFAULT_MAX_KEYS))
+    if name == 'shared':
+        path = config.get('RATELIMIT_SHARED_PATH') or os.path.join(
+            tempfile.gettempdir(), 'blogly-ratelimit')
+        return SharedBuckets(path, config.get('RATELIMIT_SHARED_SLOTS',
+                                              DEFAULT_SHARED_SLOTS))
+    raise ValueError(f'Unknown RATELIMIT_BACKEND: {name}')
+
+
+class RateLimiter:
+    """Refuses write requests over the configured rates with 429"""
+
+    def __init__(self, app=None):
+        self.backend = MemoryBuckets()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        self.backend = make_backend(app.config)
+        app.extensions['rate_limiter'] = self
+        app.before_request(self.check)
+
+    def limits(self, config, client, endpoint):
+        """The (key, rate, burst) buckets a request takes a token from"""
+        rate, burst = config['RATELIMIT_ROUTES'].get(
+            endpoint, (config['RATELIMIT_RATE'], config['RATELIMIT_BURST']))
+        return [(f'{client} {endpoint}', rate, burst),
+                (client, config['RATELIMIT_IP_RATE'], config['RATELIMIT_IP_BURST'])]
+
+    def check(self):
+        # One context-local lookup each: this runs before every request
+        req = request._get_current_object()
+        if req.method in SAFE_METHODS:
+            return None
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED'] or req.endpoint is None:
+            return None
+        client = req.remote_addr or 'unknown'
+        if client in config['RATELIMIT_EXEMPT']:
+            return None
+        wait = self.backend.hit(self.limits(config, client, req.endpoint))
+        if not wait:
+            return None
+        retry_after = math.ceil(wait)
+        return (render_template('429.html', retry_after=retry_after), 429,
+                {'Retry-After': str(retry_after)})
+
+
+rate_limiter = RateLimiter()
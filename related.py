@@ -0,0 +1,277 @@
+"""Related posts, found through the tags posts share.
+
+Two posts score the sum, over the tags they share, of each tag's inverse
+frequency log(1 + N / tag.post_count), N being the highest post id (an
+index lookup rather than a count): a rare tag in common counts for more
+than a popular one. Tags on more than RELATED_MAX_TAG_POSTS posts are
+left out; they say little about a post and would make scoring one post
+read most of posts_tags.
+
+Each post keeps its RELATED_POSTS best as RelatedPost rows, read as
+Post.related, so a post page does one indexed read instead of a self-join
+of posts_tags. Write routes keep them current in their transaction:
+update() after the tags of posts change, and referrers() before /
+recompute() after posts are deleted. The weights drift as tags gain and
+lose posts; rebuild() rescores everything (flask blogly rebuild-related),
+as sparse matrix products when NumPy and SciPy are installed.
+"""
+
+import heapq
+import math
+from collections import defaultdict
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import aliased
+
+import bulk
+from models import db, Post, Tag, PostTag, RelatedPost
+from tagging import CHUNK_SIZE
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy and SciPy are optional; see top_related()
+    np = sparse = None
+
+DEFAULT_RELATED_POSTS = 5
+DEFAULT_MAX_TAG_POSTS = 1000
+
+# SQL, NumPy and Python add the weights in different orders; scores
+# rounded to 1 / SCORE_SCALE rank ties the same way in all three
+SCORE_SCALE = 10 ** 9
+
+# Posts whose scores rebuild() computes per matrix product
+MATRIX_CHUNK = 1024
+
+
+def related_count():
+    return db.get_app().config.get('RELATED_POSTS', DEFAULT_RELATED_POSTS)
+
+
+def max_tag_posts():
+    return db.get_app().config.get('RELATED_MAX_TAG_POSTS', DEFAULT_MAX_TAG_POSTS)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def best(scored, count=None):
+    """(post id, score) pairs ranked best first, scores rounded; the
+    higher id wins a tie"""
+    pairs = ((post_id, round(score * SCORE_SCALE) / SCORE_SCALE)
+             for post_id, score in scored)
+    key = lambda pair: (-pair[1], -pair[0])
+    if count is None:
+        return sorted(pairs, key=key)
+    return heapq.nsmallest(count, pairs, key=key)
+
+
+def highest_post_id():
+    return db.session.query(func.max(Post.id)).scalar() or 0
+
+
+def weights(tag_ids=None, total=None):
+    """{tag id: weight} of the tags that count, of tag_ids or of all;
+    total is highest_post_id(), looked up unless given"""
+    if total is None:
+        total = highest_post_id()
+    query = db.session.query(Tag.id, Tag.post_count).filter(
+        Tag.post_count > 0, Tag.post_count <= max_tag_posts())
+    if tag_ids is not None:
+        query = query.filter(Tag.id.in_(list(tag_ids)))
+    return {tag_id: math.log(1 + total / count) for tag_id, count in query}
+
+
+def _scores(post_ids, known, total):
+    """{post id: [(other post id, score)]}, unordered, of every post sharing
+    a counted tag with each of post_ids (a chunk), from one grouped
+    self-join of posts_tags. known caches the weights of the tags seen so
+    far (None for those that do not count)."""
+    tag_ids = {tag_id for (tag_id,) in
+               db.session.query(PostTag.tag_id)
+               .filter(PostTag.post_id.in_(post_ids)).distinct()}
+    new = tag_ids - known.keys()
+    if new:
+        counted = weights(new, total)
+        known.update((tag_id, counted.get(tag_id)) for tag_id in new)
+    tag_weights = {tag_id: known[tag_id] for tag_id in tag_ids
+                   if known[tag_id] is not None}
+    found = {post_id: [] for post_id in post_ids}
+    if not tag_weights:
+        return found
+    mine, theirs = aliased(PostTag), aliased(PostTag)
+    score = func.sum(case(tag_weights, value=mine.tag_id))
+    rows = (db.session.query(mine.post_id, theirs.post_id, score)
+            .join(theirs, (theirs.tag_id == mine.tag_id)
+                  & (theirs.post_id != mine.post_id))
+            .filter(mine.post_id.in_(post_ids),
+                    mine.tag_id.in_(list(tag_weights)))
+            .group_by(mine.post_id, theirs.post_id))
+    for post_id, other, total_score in rows:
+        found[post_id].append((other, total_score))
+    return found
+
+
+def scores(post_id):
+    """(post id, score) of every post sharing a counted tag with post_id,
+    best first"""
+    return best(_scores([post_id], {}, None)[post_id])
+
+
+def referrers(post_ids):
+    """Ids of the posts listing any of post_ids as related"""
+    found = set()
+    for chunk in _chunks(set(post_ids)):
+        found.update(post_id for (post_id,) in
+                     db.session.query(RelatedPost.post_id)
+                     .filter(RelatedPost.related_id.in_(chunk)))
+    return found
+
+
+def _replace(post_ids):
+    """Score post_ids afresh and store their best; returns {post id: all
+    its scores, unordered}"""
+    count = related_count()
+    total = highest_post_id()
+    known, found, rows = {}, {}, []
+    for chunk in _chunks(post_ids):
+        RelatedPost.query.filter(RelatedPost.post_id.in_(chunk)).delete(
+            synchronize_session=False)
+        scored = _scores(chunk, known, total)
+        found.update(scored)
+        for post_id in chunk:
+            rows.extend({'post_id': post_id, 'related_id': other, 'score': score}
+                        for other, score in best(scored[post_id], count))
+    if rows:
+        db.session.execute(RelatedPost.__table__.insert(), rows)
+    return found
+
+
+def recompute(post_ids):
+    """Rescore post_ids, e.g. the referrers() of deleted posts"""
+    _replace(set(post_ids))
+
+
+def _offer(offers):
+    """Put offered (post id, score) pairs into the lists of the posts they
+    were offered to wherever they rank among the best"""
+    count = related_count()
+    table = RelatedPost.__table__
+    for chunk in _chunks(offers):
+        current = defaultdict(list)
+        for post_id, related_id, score in (
+                db.session.query(RelatedPost.post_id, RelatedPost.related_id,
+                                 RelatedPost.score)
+                .filter(RelatedPost.post_id.in_(chunk))):
+            current[post_id].append((related_id, score))
+        rows = []
+        for post_id in chunk:
+            have = dict(current[post_id])
+            kept = dict(best(current[post_id] + offers[post_id], count))
+            rows.extend({'post_id': post_id, 'related_id': other, 'score': score}
+                        for other, score in kept.items() if other not in have)
+            dropped = [other for other in have if other not in kept]
+            if dropped:
+                db.session.execute(table.delete().where(
+                    (table.c.post_id == post_id) & table.c.related_id.in_(dropped)))
+        if rows:
+            db.session.execute(table.insert(), rows)
+
+
+def update(post_ids):
+    """Bring the related posts up to date after the tags of post_ids
+    changed: their own lists, the lists that showed them and the lists
+    they now rank in"""
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    # Lists that showed these posts scored them by their old tags
+    stale = referrers(post_ids) - post_ids
+    offers = defaultdict(list)
+    for post_id, scored in _replace(post_ids).items():
+        # Scores are symmetric: post_id scores the same in other's list
+        for other, score in scored:
+            if other not in post_ids and other not in stale:
+                offers[other].append((post_id, score))
+    _offer(offers)
+    _replace(stale)
+
+
+# Bulk rebuild
+
+def _top_related_numpy(pairs, tag_weights, count):
+    data = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    posts, rows = np.unique(data[:, 0], return_inverse=True)
+    tags, cols = np.unique(data[:, 1], return_inverse=True)
+    weight = np.array([tag_weights[tag_id] for tag_id in tags.tolist()])
+    shape = (len(posts), len(tags))
+    weighted = sparse.csr_matrix((weight[cols], (rows, cols)), shape=shape)
+    # tags x posts: which posts carry each tag
+    carriers = sparse.csr_matrix((np.ones(len(rows)), (cols, rows)),
+                                 shape=shape[::-1])
+    for start in range(0, len(posts), MATRIX_CHUNK):
+        # (chunk x posts): the summed weights of the tags each pair shares
+        block = (weighted[start:start + MATRIX_CHUNK] @ carriers).tocsr()
+        block.sort_indices()
+        row = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        col = block.indices
+        score = np.rint(block.data * SCORE_SCALE).astype(np.int64)
+        other = col != row + start
+        # Reversed, so ids run high to low within each row and a stable
+        # sort by row, then best score, keeps that order among ties
+        row, col, score = row[other][::-1], col[other][::-1], score[other][::-1]
+        if not len(row):
+            continue
+        order = np.argsort(row * (score.max() + 1) - score, kind='stable')
+        row, col, score = row[order], col[order], score[order]
+        starts = np.cumsum(np.bincount(row)) - np.bincount(row)
+        top = np.arange(len(row)) - starts[row] < count
+        yield from zip(posts[row[top] + start].tolist(), posts[col[top]].tolist(),
+                       (score[top] / SCORE_SCALE).tolist())
+
+
+def _top_related_python(pairs, tag_weights, count):
+    tags_of, posts_of = defaultdict(list), defaultdict(list)
+    for post_id, tag_id in pairs:
+        tags_of[post_id].append(tag_id)
+        posts_of[tag_id].append(post_id)
+    for post_id in sorted(tags_of):
+        totals = defaultdict(float)
+        for tag_id in tags_of[post_id]:
+            for other in posts_of[tag_id]:
+                totals[other] += tag_weights[tag_id]
+        del totals[post_id]
+        for other, score in best(totals.items(), count):
+            yield post_id, other, score
+
+
+def top_related(pairs, tag_weights, count):
+    """(post id, related id, score) of the count best related posts of
+    every post, from (post id, tag id) pairs of counted tags"""
+    pairs = list(pairs)
+    if not pairs:
+        return iter(())
+    if np is not None:
+        return _top_related_numpy(pairs, tag_weights, count)
+    return _top_related_python(pairs, tag_weights, count)
+
+
+def rebuild():
+    """Rescore every post from posts_tags; returns the number of rows"""
+    RelatedPost.query.delete(synchronize_session=False)
+    tag_weights = weights()
+    pairs = (db.session.query(PostTag.post_id, PostTag.tag_id)
+             .join(Tag, Tag.id == PostTag.tag_id)
+             .filter(Tag.post_count > 0, Tag.post_count <= max_tag_posts()))
+    total = 0
+    for chunk in bulk.chunked(top_related(pairs, tag_weights, related_count()),
+                              bulk.DEFAULT_CHUNK_SIZE):
+        bulk.insert_rows(RelatedPost.__table__,
+                         [{'post_id': post_id, 'related_id': other, 'score': score}
+                          for post_id, other, score in chunk])
+        total += len(chunk)
+    db.session.commit()
+    return total
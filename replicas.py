@@ -0,0 +1,156 @@
+"""Read-replica routing.
+
+Views marked with @replica_reads send their queries, on GET and HEAD, to
+one of the REPLICA_URLS (round robin); everything else, and every flush,
+uses the primary SQLALCHEMY_DATABASE_URI. The replicas are registered as
+SQLAlchemy binds named replica0, replica1, ... and have no models of their
+own, so create_all and drop_all never touch them.
+
+Read your writes: after a POST the browser's session is pinned to the
+primary for REPLICA_STICKY_SECONDS, so the page it is redirected to shows
+the write. Replicas more than REPLICA_MAX_LAG seconds behind (checked at
+most every REPLICA_LAG_CHECK_SECONDS) are skipped; with none left, reads
+go to the primary. Fragments rendered from a replica are not cached
+while it may still be missing the change that invalidated them.
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+from flask import current_app, g, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+
+SAFE_METHODS = ('GET', 'HEAD')
+STICKY_KEY = '_primary_until'
+
+# Seconds since the last replayed transaction, or 0 when every received
+# WAL record has been replayed (an idle primary is not lag)
+POSTGRES_LAG = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END')
+
+log = logging.getLogger('blogly.replicas')
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from the engine in info['replica'] when set"""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing:
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_reads(view):
+    """Mark a read-only view as safe to serve from a replica"""
+    view.replica_reads = True
+    return view
+
+
+def measure_lag(engine):
+    """Replication lag of engine in seconds"""
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as connection:
+        return float(connection.execute(POSTGRES_LAG).scalar() or 0)
+
+
+class ReplicaRouter:
+    """Chooses the replica, if any, for each request"""
+
+    def __init__(self, db=None, app=None):
+        self.db = db
+        self.measure_lag = measure_lag
+        self._lags = {}
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, db=None):
+        self.db = db or self.db
+        app.config.setdefault('REPLICA_URLS', [])
+        app.config.setdefault('REPLICA_MAX_LAG', 5.0)
+        app.config.setdefault('REPLICA_LAG_CHECK_SECONDS', 1.0)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5.0)
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update({f'replica{n}': url
+                      for n, url in enumerate(app.config['REPLICA_URLS'])})
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.extensions['replicas'] = self
+        app.before_request(self._route)
+        app.after_request(self._stick)
+        app.teardown_request(self._unroute)
+
+    def names(self, app):
+        return [f'replica{n}' for n in range(len(app.config['REPLICA_URLS']))]
+
+    def lag(self, app, name):
+        """Lag of a replica, re-measured at most every
+        REPLICA_LAG_CHECK_SECONDS; infinite if it cannot be reached"""
+        now = time.monotonic()
+        with self._lock:
+            checked, lag = self._lags.get((app, name), (None, None))
+        if checked is not None and now - checked < app.config['REPLICA_LAG_CHECK_SECONDS']:
+            return lag
+        try:
+            lag = self.measure_lag(self.db.get_engine(app, bind=name))
+        except Exception as e:
+            log.warning('Replica %s unavailable: %s', name, e)
+            lag = float('inf')
+        with self._lock:
+            self._lags[(app, name)] = (now, lag)
+        return lag
+
+    def choose(self, app):
+        """Bind name of a replica fresh enough to read from, or None"""
+        names = self.names(app)
+        if not names:
+            return None
+        start = next(self._turn)
+        for offset in range(len(names)):
+            name = names[(start + offset) % len(names)]
+            if self.lag(app, name) <= app.config['REPLICA_MAX_LAG']:
+                return name
+        return None
+
+    def _route(self):
+        app = current_app._get_current_object()
+        view = app.view_functions.get(request.endpoint)
+        if (request.method not in SAFE_METHODS
+                or not getattr(view, 'replica_reads', False)
+                or session.get(STICKY_KEY, 0) > time.time()):
+            return
+        name = self.choose(app)
+        if name is not None:
+            self.db.session().info['replica'] = self.db.get_engine(app, bind=name)
+            # Upper bound on how far behind the replica is; the fragment
+            # cache does not keep fragments of changes more recent than this
+            g.replica_lag = (self.lag(app, name)
+                             + app.config['REPLICA_LAG_CHECK_SECONDS'])
+
+    def _stick(self, response):
+        if request.method not in SAFE_METHODS and self.names(current_app):
+            session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+    def _unroute(self, exc):
+        if self.db.session.registry.has():
+            self.db.session().info.pop('replica', None)
+
+    def reset(self):
+        with self._lock:
+            self._lags.clear()
+
+
+replica_router = ReplicaRouter()
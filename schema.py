@@ -0,0 +1,168 @@
+"""Schema migrations.
+
+The revisions in migrations/versions, run with Alembic, are the schema's
+history: flask blogly init-db builds a new database by running all of them
+and flask blogly migrate brings an existing one up to date. A database that
+db.create_all() made has no alembic_version table; migrate first stamps it
+with the revision whose schema it has: head when it has the models' tables,
+columns and indexes, the initial revision when it has the initial
+migration's (the four tables db.create_all() made before there were
+migrations). Any other schema is refused rather than guessed at. The
+feeds, which the migrations cannot build, are rebuilt once a database with
+posts but no feed entries reaches head.
+
+Alembic is optional. Without it init-db falls back to db.create_all(),
+which creates missing tables but never changes existing ones.
+"""
+
+import os
+
+from sqlalchemy import create_engine, inspect
+
+import feed
+from models import db, FeedEntry, Post
+
+try:
+    from alembic import command
+    from alembic.config import Config
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+    from alembic.script import ScriptDirectory
+except ImportError:  # Alembic is optional; see init_db
+    command = None
+
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'migrations')
+INITIAL = '0001'
+VERSION_TABLE = 'alembic_version'
+
+# Postgres-only full-text search objects made in DDL (see models.py), which
+# the models do not map
+UNMAPPED = {('column', 'search_vector'), ('index', 'ix_posts_search_vector')}
+
+
+class UnknownSchema(Exception):
+    """A database without a revision whose schema matches none we know"""
+
+
+def available():
+    return command is not None
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Leave the unmapped search objects out of autogenerate"""
+    return (type_, name) not in UNMAPPED
+
+
+def alembic_config(app=None):
+    """Alembic config running the migrations against app's database"""
+    config = Config()
+    config.set_main_option('script_location', DIRECTORY)
+    config.attributes['engine'] = db.get_engine(app or db.get_app())
+    return config
+
+
+def current(app=None):
+    """The database's revision, or None when it has none"""
+    with db.get_engine(app or db.get_app()).connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def shape(bind):
+    """{table: (column names, index names)} of a database, without the
+    version table and the unmapped search objects"""
+    inspector = inspect(bind)
+    found = {}
+    for table in inspector.get_table_names():
+        if table == VERSION_TABLE:
+            continue
+        columns = {c['name'] for c in inspector.get_columns(table)
+                   if ('column', c['name']) not in UNMAPPED}
+        # Not the indexes Postgres makes for unique constraints
+        indexes = {i['name'] for i in inspector.get_indexes(table)
+                   if not i.get('duplicates_constraint')
+                   and ('index', i['name']) not in UNMAPPED}
+        found[table] = (columns, indexes)
+    return found
+
+
+def _scratch_shape(build):
+    """shape() of an in-memory SQLite database made by build(connection)"""
+    engine = create_engine('sqlite://')
+    try:
+        with engine.begin() as connection:
+            build(connection)
+            return shape(connection)
+    finally:
+        engine.dispose()
+
+
+def _run_initial(config):
+    module = ScriptDirectory.from_config(config).get_revision(INITIAL).module
+
+    def build(connection):
+        with Operations.context(MigrationContext.configure(connection)):
+            module.upgrade()
+    return build
+
+
+def _searchable(engine):
+    """Whether posts has the search vector, which 0002 adds on Postgres"""
+    return any(c['name'] == 'search_vector'
+               for c in inspect(engine).get_columns('posts'))
+
+
+def created_revision(engine, config):
+    """The revision a database made by db.create_all() is at"""
+    live = shape(engine)
+    searchable = _searchable(engine)
+    if (live == _scratch_shape(db.metadata.create_all)
+            and searchable == (engine.dialect.name == 'postgresql')):
+        return 'head'
+    if live == _scratch_shape(_run_initial(config)) and not searchable:
+        return INITIAL
+    raise UnknownSchema(
+        f'{engine.url.render_as_string()} has no {VERSION_TABLE} table and '
+        "neither the models' schema nor the initial one; stamp it with "
+        '`alembic stamp <revision>` first')
+
+
+def upgrade(revision='head', app=None):
+    """Run the migrations up to revision, stamping a database made by
+    db.create_all() first; returns the revision it was at"""
+    engine = db.get_engine(app or db.get_app())
+    names = inspect(engine).get_table_names()
+    config = alembic_config(app)
+    if VERSION_TABLE not in names and 'users' in names:
+        command.stamp(config, created_revision(engine, config))
+    before = current(app)
+    command.upgrade(config, revision)
+    head = ScriptDirectory.from_config(config).get_current_head()
+    if current(app) == head:
+        _fill_feeds(app)
+    return before
+
+
+def _fill_feeds(app=None):
+    """Rebuild the feeds of a database with posts but no feed entries"""
+    with (app or db.get_app()).app_context():
+        empty = not db.session.query(FeedEntry.query.exists()).scalar()
+        if empty and db.session.query(Post.query.exists()).scalar():
+            feed.rebuild()
+
+
+def downgrade(revision, app=None):
+    command.downgrade(alembic_config(app), revision)
+
+
+def init_db(drop=False, app=None):
+    """Create the schema, with migrations when Alembic is installed"""
+    engine = db.get_engine(app or db.get_app())
+    if drop:
+        db.drop_all(app=app)
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS {VERSION_TABLE}')
+    if available():
+        upgrade(app=app)
+    else:
+        db.create_all(app=app)
@@ -0,0 +1,204 @@
+"""Full-text search over posts.
+
+On Postgres this uses the generated posts.search_vector column and its GIN
+index (see models.py): results are ranked with ts_rank_cd and highlighted
+with ts_headline. Other databases (SQLite in test runs) fall back to a
+pure-Python inverted index built over the candidate posts.
+"""
+
+import heapq
+import math
+import re
+from collections import defaultdict, namedtuple
+
+from markupsafe import Markup, escape
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import joinedload
+
+from models import db, Post, PostTag
+
+SEARCH_CONFIG = 'english'
+DEFAULT_PER_PAGE = 20
+SNIPPET_WORDS = 30
+
+# Markers ts_headline puts around matches; swapped for <mark> after escaping
+START_SEL = '[[['
+STOP_SEL = ']]]'
+TITLE_OPTIONS = f'StartSel="{START_SEL}", StopSel="{STOP_SEL}", HighlightAll=true'
+SNIPPET_OPTIONS = (f'StartSel="{START_SEL}", StopSel="{STOP_SEL}", '
+                   f'MaxWords={SNIPPET_WORDS}, MinWords=10, MaxFragments=2')
+
+TITLE_WEIGHT = 2.0
+CONTENT_WEIGHT = 1.0
+
+SearchResult = namedtuple('SearchResult',
+                          ['post', 'rank', 'title_html', 'snippet_html'])
+SearchPage = namedtuple('SearchPage',
+                        ['query', 'results', 'page', 'per_page', 'has_next'])
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Lower-cased word tokens of text"""
+    return _WORD.findall((text or '').lower())
+
+
+def _marked(text):
+    """Escape ts_headline output and turn its markers into <mark> tags"""
+    html = str(escape(text))
+    html = html.replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+    return Markup(html)
+
+
+def highlight(text, terms, max_words=None):
+    """Escape text and wrap the words in terms with <mark>. With max_words,
+    return only a window of that many words around the first match."""
+    words = list(_WORD.finditer(text or ''))
+    start, end = 0, len(text or '')
+    if max_words and len(words) > max_words:
+        first = next((i for i, w in enumerate(words)
+                      if w.group().lower() in terms), 0)
+        lo = max(0, min(first - max_words // 3, len(words) - max_words))
+        start = words[lo].start()
+        end = words[lo + max_words - 1].end()
+    out = []
+    position = start
+    for word in words:
+        if word.start() < start or word.end() > end:
+            continue
+        out.append(str(escape(text[position:word.start()])))
+        if word.group().lower() in terms:
+            out.append(f'<mark>{escape(word.group())}</mark>')
+        else:
+            out.append(str(escape(word.group())))
+        position = word.end()
+    out.append(str(escape(text[position:end])))
+    html = ''.join(out)
+    if start > 0:
+        html = '&hellip;' + html
+    if end < len(text or ''):
+        html += '&hellip;'
+    return Markup(html)
+
+
+class InvertedIndex:
+    """In-memory term -> {post id: weighted term frequency} index ranked by
+    tf-idf, used when the database has no full-text search."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id, title, content):
+        self.remove(doc_id)
+        weights = defaultdict(float)
+        for term in tokenize(title):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(content):
+            weights[term] += CONTENT_WEIGHT
+        for term, weight in weights.items():
+            self.postings[term][doc_id] = weight
+        self.documents[doc_id] = list(weights)
+
+    def remove(self, doc_id):
+        for term in self.documents.pop(doc_id, ()):
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def search(self, query, limit=None):
+        """(doc id, score) pairs for the documents containing every query
+        term, best first; only the best limit of them if limit is given"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        lists = sorted((self.postings.get(term, {}) for term in terms), key=len)
+        if not lists[0]:
+            return []
+        matches = set(lists[0])
+        for postings in lists[1:]:
+            matches.intersection_update(postings)
+        total = len(self.documents)
+        scores = defaultdict(float)
+        for postings in lists:
+            idf = math.log(1 + total / len(postings))
+            for doc_id in matches:
+                scores[doc_id] += (1 + math.log(postings[doc_id])) * idf
+        key = lambda item: (item[1], item[0])
+        if limit is not None:
+            return heapq.nlargest(limit, scores.items(), key=key)
+        return sorted(scores.items(), key=key, reverse=True)
+
+
+def _filtered(query, tag_id=None, user_id=None):
+    if tag_id is not None:
+        query = query.filter(Post.id.in_(
+            db.session.query(PostTag.post_id).filter(PostTag.tag_id == tag_id)))
+    if user_id is not None:
+        query = query.filter(Post.user_id == user_id)
+    return query
+
+
+def _search_postgres(q, tag_id, user_id, page, per_page):
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    vector = literal_column('posts.search_vector')
+    rank = func.ts_rank_cd(vector, tsquery)
+    ranked = (_filtered(db.session.query(Post.id.label('id'),
+                                         rank.label('rank')),
+                        tag_id, user_id)
+              .filter(vector.op('@@')(tsquery))
+              .order_by(rank.desc(), Post.id.desc())
+              .offset((page - 1) * per_page)
+              .limit(per_page + 1)
+              .subquery())
+    # Headlines are only computed for the rows on this page
+    rows = (db.session.query(
+                Post, ranked.c.rank,
+                func.ts_headline(SEARCH_CONFIG, Post.title, tsquery,
+                                 TITLE_OPTIONS),
+                func.ts_headline(SEARCH_CONFIG, Post.content, tsquery,
+                                 SNIPPET_OPTIONS))
+            .join(ranked, ranked.c.id == Post.id)
+            .options(joinedload(Post.user))
+            .order_by(ranked.c.rank.desc(), Post.id.desc())
+            .all())
+    return [SearchResult(post, rank, _marked(title), _marked(snippet))
+            for post, rank, title, snippet in rows]
+
+
+def _search_fallback(q, tag_id, user_id, page, per_page):
+    index = InvertedIndex()
+    candidates = _filtered(
+        db.session.query(Post.id, Post.title, Post.content), tag_id, user_id)
+    for post_id, title, content in candidates:
+        index.add(post_id, title, content)
+    start = (page - 1) * per_page
+    hits = index.search(q, limit=start + per_page + 1)[start:]
+    posts = {post.id: post for post in
+             Post.query.options(joinedload(Post.user))
+             .filter(Post.id.in_([post_id for post_id, score in hits]))}
+    terms = set(tokenize(q))
+    return [SearchResult(posts[post_id], score,
+                         highlight(posts[post_id].title, terms),
+                         highlight(posts[post_id].content, terms, SNIPPET_WORDS))
+            for post_id, score in hits]
+
+
+def search_posts(q, tag_id=None, user_id=None, page=1,
+                 per_page=DEFAULT_PER_PAGE):
+    """Return the SearchPage of posts matching q, best match first,
+    optionally limited to one tag and/or one author"""
+    page = max(1, page)
+    if not q or not q.strip():
+        return SearchPage(q, [], page, per_page, False)
+    if db.session().get_bind(Post.__mapper__).dialect.name == 'postgresql':
+        results = _search_postgres(q, tag_id, user_id, page, per_page)
+    else:
+        results = _search_fallback(q, tag_id, user_id, page, per_page)
+    return SearchPage(q, results[:per_page], page, per_page,
+                      len(results) > per_page)
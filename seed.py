@@ -1,52 +1,187 @@
-# """Seed file to make sample data for db."""
-
-from models import db, connect_db, User, Post, Tag, PostTag
-from app import app
-
-# Create all tables
-db.drop_all()
-db.create_all()
-
-u1 = User(first_name='Phil', last_name='Browne')
-u2 = User(first_name='Sonny', last_name='Rollins')
-u3 = User(first_name='Charles', last_name='Johnson')
-u4 = User(first_name='Kenny', last_name='Jackson')
-
-p1 = Post(title='First Post', content='Hello World!!!!1', user_id=1)
-p2 = Post(title='Jazz Time', content='Time to practice my saxophone!', user_id=2)
-p3 = Post(title='Philosophy',
-          content='What is the meaning of life? What is life?', user_id=3)
-p4 = Post(title='I dunno',
-          content='What is the point of these seeds lol', user_id=1)
-p5 = Post(title='Seeding',
-          content='I need to think of better content for these', user_id=4)
-p6 = Post(title='Python is Cool', content='I enjoy SQLAlchemy!', user_id=1)
-p7 = Post(title='Good Practice', content='So many different posts', user_id=2)
-
-t1 = Tag(name='Fun')
-t2 = Tag(name='Funny')
-t3 = Tag(name='Sad')
-t4 = Tag(name='Wholesome')
-t5 = Tag(name='Silly')
-t6 = Tag(name='Thankful')
-t7 = Tag(name='Happy')
-
-pt1 = PostTag(post_id=1, tag_id=1)
-pt2 = PostTag(post_id=1, tag_id=7)
-pt3 = PostTag(post_id=2, tag_id=4)
-pt4 = PostTag(post_id=2, tag_id=6)
-pt5 = PostTag(post_id=2, tag_id=7)
-pt6 = PostTag(post_id=4, tag_id=3)
-
-
-db.session.add_all([u1, u2, u3, u4])
-db.session.commit()
-
-db.session.add_all([p1, p2, p3, p4, p5, p6, p7])
-db.session.commit()
-
-db.session.add_all([t1, t2, t3, t4, t5, t6, t7])
-db.session.commit()
-
-db.session.add_all([pt1, pt2, pt3, pt4, pt5, pt6])
-db.session.commit()
+"""Seed file to make sample data for db.
+
+    python seed.py                  # the small hand-written sample data
+    python seed.py --users 1000 --posts 100000 --tags 200 --fanout 3
+
+With sizes, the data is generated from a seeded RNG (--seed), so the same
+arguments always produce the same rows. Authors and tags are drawn with a
+long-tailed (Zipf-like) popularity, as in a real blog. Both drop and
+recreate every table first.
+"""
+
+import argparse
+import datetime
+import itertools
+import random
+
+import bulk
+import feed
+import related
+from models import db, User, Post, Tag, PostTag
+
+FIRST_NAMES = ('Phil Sonny Charles Kenny Ella Miles Nina Billie Dizzy Thelonious '
+               'Herbie Wayne Chet Sarah Ornette Art Max Bud Dexter Cannonball '
+               'Horace Lee Freddie Abbey Betty Carmen Oscar Ahmad Bill Stan').split()
+LAST_NAMES = ('Browne Rollins Johnson Jackson Fitzgerald Davis Simone Holiday '
+              'Gillespie Monk Hancock Shorter Baker Vaughan Coleman Blakey Roach '
+              'Powell Gordon Adderley Silver Morgan Hubbard Lincoln Carter McRae '
+              'Peterson Jamal Evans Getz').split()
+WORDS = ('jazz saxophone python flask seed philosophy meaning life practice '
+         'cool query index posts tags users blog coffee music travel code '
+         'garden winter summer river mountain city night morning book fun '
+         'silly happy sad wholesome thankful record vinyl piano drums bass '
+         'trumpet improvise solo chorus bridge swing bebop modal groove tempo '
+         'rehearsal concert festival club session studio album review').split()
+
+# Generated created_at values fall in the year before this fixed instant,
+# so they do not depend on when the seed runs
+EPOCH = datetime.datetime(2024, 1, 1)
+SPAN_SECONDS = 365 * 24 * 3600
+
+
+def seed_sample():
+    """The original hand-written users, posts and tags"""
+    u1 = User(first_name='Phil', last_name='Browne')
+    u2 = User(first_name='Sonny', last_name='Rollins')
+    u3 = User(first_name='Charles', last_name='Johnson')
+    u4 = User(first_name='Kenny', last_name='Jackson')
+
+    p1 = Post(title='First Post', content='Hello World!!!!1', user_id=1)
+    p2 = Post(title='Jazz Time', content='Time to practice my saxophone!', user_id=2)
+    p3 = Post(title='Philosophy',
+              content='What is the meaning of life? What is life?', user_id=3)
+    p4 = Post(title='I dunno',
+              content='What is the point of these seeds lol', user_id=1)
+    p5 = Post(title='Seeding',
+              content='I need to think of better content for these', user_id=4)
+    p6 = Post(title='Python is Cool', content='I enjoy SQLAlchemy!', user_id=1)
+    p7 = Post(title='Good Practice', content='So many different posts', user_id=2)
+
+    t1 = Tag(name='Fun')
+    t2 = Tag(name='Funny')
+    t3 = Tag(name='Sad')
+    t4 = Tag(name='Wholesome')
+    t5 = Tag(name='Silly')
+    t6 = Tag(name='Thankful')
+    t7 = Tag(name='Happy')
+
+    pt1 = PostTag(post_id=1, tag_id=1)
+    pt2 = PostTag(post_id=1, tag_id=7)
+    pt3 = PostTag(post_id=2, tag_id=4)
+    pt4 = PostTag(post_id=2, tag_id=6)
+    pt5 = PostTag(post_id=2, tag_id=7)
+    pt6 = PostTag(post_id=4, tag_id=3)
+
+    db.session.add_all([u1, u2, u3, u4])
+    db.session.commit()
+
+    db.session.add_all([p1, p2, p3, p4, p5, p6, p7])
+    db.session.commit()
+
+    db.session.add_all([t1, t2, t3, t4, t5, t6, t7])
+    db.session.commit()
+
+    db.session.add_all([pt1, pt2, pt3, pt4, pt5, pt6])
+    db.session.commit()
+
+    feed.rebuild()
+    related.rebuild()
+
+
+# Synthetic data
+
+def zipf_weights(count):
+    """Cumulative weights giving item n a popularity of 1 / (n + 1)"""
+    return list(itertools.accumulate(1 / (rank + 1) for rank in range(count)))
+
+
+def tag_name(n):
+    """Deterministic, unique name of the nth generated tag (0-based)"""
+    word = WORDS[n % len(WORDS)].capitalize()
+    return word if n < len(WORDS) else f'{word}{n // len(WORDS)}'
+
+
+def generate_users(count, seed=0):
+    """Records for users 1..count"""
+    rng = random.Random(f'{seed}:users')
+    for user_id in range(1, count + 1):
+        yield {'id': user_id,
+               'first_name': rng.choice(FIRST_NAMES),
+               'last_name': rng.choice(LAST_NAMES)}
+
+
+def generate_tags(count):
+    """Records for count tags; posts refer to them by name"""
+    for n in range(count):
+        yield {'name': tag_name(n)}
+
+
+def generate_posts(count, users, tags, fanout, seed=0):
+    """Records for posts 1..count by users 1..users, each with on average
+    fanout of the generated tags, in created_at order"""
+    rng = random.Random(f'{seed}:posts')
+    author_weights = zipf_weights(users)
+    tag_weights = zipf_weights(tags) if tags else None
+    step = SPAN_SECONDS / max(count, 1)
+    for post_id in range(1, count + 1):
+        words = rng.choices(WORDS, k=rng.randint(20, 80))
+        title = ' '.join(rng.choices(WORDS, k=rng.randint(1, 4))).capitalize()
+        k = min(tags, rng.randint(0, 2 * fanout)) if tags else 0
+        picked = set(rng.choices(range(tags), cum_weights=tag_weights, k=k)) if k else ()
+        yield {'id': post_id,
+               'title': title[:50],
+               'content': ' '.join(words).capitalize() + '.',
+               'created_at': EPOCH - datetime.timedelta(
+                   seconds=SPAN_SECONDS - post_id * step + rng.random() * step),
+               'user_id': rng.choices(range(1, users + 1),
+                                      cum_weights=author_weights)[0],
+               'tags': sorted(tag_name(n) for n in picked)}
+
+
+def seed_synthetic(users, posts, tags, fanout=2, seed=0,
+                   chunk_size=bulk.DEFAULT_CHUNK_SIZE, progress=None):
+    """Bulk load generated users, tags and posts into empty tables"""
+    if posts and not users:
+        raise ValueError('Posts need at least one user')
+    # Into empty tables: nothing else writes to them yet
+    bulk.import_records('users', generate_users(users, seed), chunk_size,
+                        progress=progress, exclusive=True)
+    bulk.import_records('tags', generate_tags(tags), chunk_size,
+                        progress=progress, exclusive=True)
+    bulk.import_records('posts',
+                        generate_posts(posts, users, tags, fanout, seed),
+                        chunk_size, progress=progress, exclusive=True)
+    feed.rebuild()
+    related.rebuild()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=0)
+    parser.add_argument('--posts', type=int, default=0)
+    parser.add_argument('--tags', type=int, default=0)
+    parser.add_argument('--fanout', type=int, default=2,
+                        help='average tags per post')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int,
+                        default=bulk.DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app()
+    app.app_context().push()
+
+    # Create all tables
+    db.drop_all()
+    db.create_all()
+
+    if args.users or args.posts or args.tags:
+        seed_synthetic(args.users, args.posts, args.tags, args.fanout,
+                       args.seed, args.chunk_size,
+                       progress=lambda stats: print(stats))
+    else:
+        seed_sample()
+
+
+if __name__ == '__main__':
+    main()
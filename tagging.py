@@ -0,0 +1,97 @@
+"""Bulk synchronisation of the posts_tags association table."""
+
+from collections import namedtuple
+
+from sqlalchemy import func
+
+from models import db, Post, Tag, PostTag
+
+# Keeps IN lists comfortably under driver/database parameter limits
+CHUNK_SIZE = 500
+
+TagDiff = namedtuple('TagDiff', ['added', 'removed'])
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def existing_ids(model, ids):
+    """The subset of ids that are primary keys of model rows"""
+    found = set()
+    for chunk in _chunks(set(ids)):
+        found.update(row_id for (row_id,) in
+                     db.session.query(model.id).filter(model.id.in_(chunk)))
+    return found
+
+
+def _apply(rows, delete_where):
+    """Insert the association rows and run the delete statements"""
+    table = PostTag.__table__
+    if rows:
+        db.session.execute(table.insert(), rows)
+    for where in delete_where:
+        db.session.execute(table.delete().where(where))
+
+
+def sync_post_tags(post_id, tag_ids):
+    """Make the tags of post_id exactly tag_ids (unknown ids are ignored)
+    and return the TagDiff of tag ids added and removed."""
+    wanted = existing_ids(Tag, tag_ids)
+    current = {tag_id for (tag_id,) in
+               db.session.query(PostTag.tag_id).filter_by(post_id=post_id)}
+    added, removed = wanted - current, current - wanted
+    _apply([{'post_id': post_id, 'tag_id': tag_id} for tag_id in added],
+           [(PostTag.post_id == post_id) & PostTag.tag_id.in_(chunk)
+            for chunk in _chunks(removed)])
+    return TagDiff(added, removed)
+
+
+def sync_tag_posts(tag_id, post_ids, scope=None):
+    """Make the posts of tag_id exactly post_ids and return the TagDiff of
+    post ids added and removed.
+
+    If scope is given only posts whose ids are in scope are touched, so a
+    form that showed one page of posts leaves the other pages alone.
+    """
+    wanted = existing_ids(Post, post_ids)
+    query = db.session.query(PostTag.post_id).filter_by(tag_id=tag_id)
+    if scope is not None:
+        scope = set(scope)
+        wanted &= scope
+        current = set()
+        for chunk in _chunks(scope):
+            current.update(post_id for (post_id,) in
+                           query.filter(PostTag.post_id.in_(chunk)))
+    else:
+        current = {post_id for (post_id,) in query}
+    added, removed = wanted - current, current - wanted
+    _apply([{'post_id': post_id, 'tag_id': tag_id} for post_id in added],
+           [(PostTag.tag_id == tag_id) & PostTag.post_id.in_(chunk)
+            for chunk in _chunks(removed)])
+    return TagDiff(added, removed)
+
+
+def reconcile_post_counts(batch_size=CHUNK_SIZE, dry_run=False):
+    """Set Tag.post_count from posts_tags wherever it has drifted, a batch
+    of tag ids per statement (committing each batch unless dry_run).
+    Returns the number of tags that were (or, with dry_run, would be)
+    corrected."""
+    actual = (db.session.query(func.count(PostTag.post_id))
+              .filter(PostTag.tag_id == Tag.id)
+              .scalar_subquery())
+    max_id = db.session.query(func.max(Tag.id)).scalar() or 0
+    fixed = 0
+    for start in range(0, max_id, batch_size):
+        drifted = ((Tag.id > start) & (Tag.id <= start + batch_size)
+                   & (Tag.post_count != actual))
+        if dry_run:
+            fixed += db.session.query(func.count(Tag.id)).filter(drifted).scalar()
+            continue
+        result = db.session.execute(
+            Tag.__table__.update().where(drifted).values(post_count=actual))
+        db.session.commit()
+        fixed += result.rowcount
+    return fixed
@@ -0,0 +1,104 @@
+"""Jinja bytecode cache and streamed template rendering.
+
+With TEMPLATE_BYTECODE_CACHE on, compiled templates are written to
+TEMPLATE_CACHE_DIR (default: a directory under the system temp dir), so a
+new worker loads them instead of compiling base.html and the page again.
+`flask blogly warm-templates` compiles every template ahead of time, e.g.
+in the deploy step.
+
+stream_template() sends a page as Jinja generates it, for the views whose
+size grows with the data (every tag on the post forms). Combined with a
+yield_per query the rows are fetched, rendered and sent a chunk at a time.
+
+With TEMPLATE_COLLAPSE_WHITESPACE on, each run of whitespace in the
+templates' own text (not in the values they insert, nor inside <pre>,
+<textarea>, <script> or <style>) is cut to one space, or one newline if it
+had any. That happens when a template is compiled, so rendering costs
+nothing more; a page with a row per post loses the indentation of every
+row.
+"""
+
+import re
+
+from flask import (Response, current_app, get_flashed_messages,
+                   stream_with_context, before_render_template,
+                   template_rendered)
+from jinja2 import FileSystemBytecodeCache
+from jinja2.ext import Extension
+from jinja2.lexer import Token
+
+# Rows fetched per round trip by the queries behind streamed pages
+STREAM_CHUNK_SIZE = 500
+
+WHITESPACE = re.compile(r'\s{2,}|[\t\r\n\f\v]')
+RAW_TAGS = re.compile(r'<(/?)(pre|textarea|script|style)\b', re.IGNORECASE)
+
+
+def _collapse_run(match):
+    return '\n' if '\n' in match.group() else ' '
+
+
+class CollapseWhitespace(Extension):
+    """Collapses the whitespace in template text at compile time"""
+
+    def filter_stream(self, stream):
+        raw = None  # the element whose content is kept as written
+        for token in stream:
+            if token.type != 'data':
+                yield token
+                continue
+            parts, position = [], 0
+            for match in RAW_TAGS.finditer(token.value):
+                closing, name = match.group(1), match.group(2).lower()
+                if raw is None and not closing:
+                    parts.append(WHITESPACE.sub(
+                        _collapse_run, token.value[position:match.start()]))
+                    position, raw = match.start(), name
+                elif raw == name and closing:
+                    parts.append(token.value[position:match.start()])
+                    position, raw = match.start(), None
+            rest = token.value[position:]
+            parts.append(rest if raw else WHITESPACE.sub(_collapse_run, rest))
+            yield Token(token.lineno, 'data', ''.join(parts))
+
+
+def init_app(app):
+    app.config.setdefault('TEMPLATE_BYTECODE_CACHE', True)
+    app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+    app.config.setdefault('TEMPLATE_COLLAPSE_WHITESPACE', True)
+    pattern = 'blogly-%s.cache'
+    if app.config['TEMPLATE_COLLAPSE_WHITESPACE']:
+        app.jinja_env.add_extension(CollapseWhitespace)
+        # The cache key is the template source; keep the two kinds apart
+        pattern = 'blogly-collapsed-%s.cache'
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        # Set before the first template is loaded
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE_DIR'], pattern=pattern)
+
+
+def warm(app):
+    """Compile every template of app into the bytecode cache; returns the
+    template names"""
+    names = [name for name in app.jinja_env.list_templates()
+             if name.endswith('.html')]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def stream_template(template_name, **context):
+    """Like render_template, but returns a Response that streams the page"""
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    app.update_template_context(context)
+    # The session cookie is sent before the body; take the flashed messages
+    # out of it now (the template then reads them from the request)
+    get_flashed_messages(with_categories=True)
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        yield from template.generate(context)
+        template_rendered.send(app, template=template, context=context)
+
+    return Response(stream_with_context(generate()))
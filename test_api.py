@@ -0,0 +1,131 @@
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from queries import count_queries
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Tests for the /api/v1 JSON API"""
+
+    def setUp(self):
+        """Add a user with two tagged posts"""
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        tag = Tag(name='Test_Tag')
+        posts = [Post(title=f'API_{i}', content='Content', user=user)
+                 for i in range(3)]
+        posts[0].tags.append(tag)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.post_id = posts[0].id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_post_fields_and_include(self):
+        with app.test_client() as client:
+            resp = client.get(f'/api/v1/posts/{self.post_id}'
+                              '?fields=id,title&include=tags,user')
+            data = resp.get_json()['data']
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(set(data), {'id', 'title', 'tags', 'user'})
+            self.assertEqual(data['tags'], [{'id': data['tags'][0]['id'],
+                                             'name': 'Test_Tag',
+                                             'post_count': 1}])
+            self.assertEqual(data['user']['full_name'], 'Test_First Test_Last')
+
+    def test_collection_cursor(self):
+        with app.test_client() as client:
+            data = client.get('/api/v1/posts?per_page=2&fields=title').get_json()
+            self.assertEqual([p['title'] for p in data['data']], ['API_0', 'API_1'])
+            resp = client.get(f'/api/v1/posts?per_page=2&after={data["next_cursor"]}')
+            self.assertEqual([p['title'] for p in resp.get_json()['data']], ['API_2'])
+
+    def test_unknown_field(self):
+        with app.test_client() as client:
+            resp = client.get('/api/v1/users?fields=password')
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('password', resp.get_json()['description'])
+
+    def test_not_found(self):
+        with app.test_client() as client:
+            resp = client.get('/api/v1/tags/999999')
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(resp.get_json()['error'], 'Not Found')
+
+    def shared_versions(self):
+        """Have the cache backend stand in for one every worker shares"""
+        fragment_cache.backend.shares_versions = True
+        self.addCleanup(delattr, fragment_cache.backend, 'shares_versions')
+
+    def test_conditional_get(self):
+        """An unchanged resource is a 304 with no queries"""
+        self.shared_versions()
+        with app.test_client() as client:
+            url = f'/api/v1/users/{self.user_id}?include=posts'
+            resp = client.get(url)
+            etag = resp.headers['ETag']
+            last_modified = resp.headers['Last-Modified']
+            with count_queries() as counter:
+                resp = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(len(counter), 0)
+            resp = client.get(url, headers={'If-Modified-Since': last_modified})
+            self.assertEqual(resp.status_code, 304)
+
+    def test_per_process_versions_give_no_collection_validators(self):
+        """Another worker's write would not change a per-process ETag"""
+        with app.test_client() as client:
+            resp = client.get(f'/api/v1/users/{self.user_id}?include=posts')
+            self.assertNotIn('ETag', resp.headers)
+            self.assertNotIn('Last-Modified', resp.headers)
+            resp = client.get('/api/v1/posts')
+            self.assertNotIn('ETag', resp.headers)
+            # A single item is validated by its row
+            resp = client.get(f'/api/v1/posts/{self.post_id}')
+            self.assertIn('ETag', resp.headers)
+
+    def test_conditional_get_compressed(self):
+        """A gzipped response, whose ETag is weak, still revalidates"""
+        self.shared_versions()
+        user = db.session.get(User, self.user_id)
+        db.session.add_all([Post(title=f'API_MORE_{i}', content='Content', user=user)
+                            for i in range(20)])
+        db.session.commit()
+        with app.test_client() as client:
+            url = '/api/v1/posts?include=tags,user'
+            gzip = {'Accept-Encoding': 'gzip'}
+            resp = client.get(url, headers=gzip)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            etag = resp.headers['ETag']
+            self.assertTrue(etag.startswith('W/'))
+            resp = client.get(url, headers={**gzip, 'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['ETag'], etag)
+            strong = etag[2:]
+            resp = client.get(url, headers={'If-None-Match': strong})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['ETag'], strong)
+
+    def test_write_changes_etag(self):
+        with app.test_client() as client:
+            url = f'/api/v1/posts/{self.post_id}'
+            etag = client.get(url).headers['ETag']
+            client.post(f'/posts/{self.post_id}/edit',
+                        data={'title': 'API_NEW', 'content': 'Content'})
+            resp = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()['data']['title'], 'API_NEW')
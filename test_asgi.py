@@ -0,0 +1,142 @@
+from unittest import TestCase, skipUnless
+import asyncio
+import importlib.util
+from urllib.parse import urlencode
+
+from sqlalchemy import event, select
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from asgi import BloglyASGI, async_url, wsgi_environ
+from pagination import keyset, paginate
+import queries
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+HAS_ASYNC_DRIVER = (importlib.util.find_spec('greenlet') is not None
+                    and importlib.util.find_spec('aiosqlite') is not None)
+
+
+def scope(path, method='GET', query=b'', headers=()):
+    return {'type': 'http', 'method': method, 'path': path,
+            'query_string': query, 'headers': list(headers),
+            'http_version': '1.1', 'scheme': 'http',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+
+
+class ASGITestCase(TestCase):
+    """Tests for serving the app over ASGI"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        post = Post(title='SETUP_TITLE', content='Hello *world*', user=user)
+        db.session.add_all([user, post])
+        db.session.commit()
+        self.user_id, self.post_id = user.id, post.id
+        self.asgi = BloglyASGI(app)
+
+    def tearDown(self):
+        db.session.rollback()
+        self.asgi.executor.shutdown()
+
+    def call(self, *args, body=b'', **kwargs):
+        """(status, headers dict, body) of one request"""
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.asgi(scope(*args, **kwargs), receive, send))
+        start, response = messages
+        headers = {name.decode(): value.decode() for name, value in start['headers']}
+        return start['status'], headers, response['body'].decode()
+
+    def test_get(self):
+        status, headers, html = self.call('/users')
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith('text/html'))
+        self.assertIn('Test_First Test_Last', html)
+
+    def test_form_post_and_session(self):
+        form = urlencode({'first_name': 'New', 'last_name': 'User',
+                          'image_url': ''}).encode()
+        status, headers, _ = self.call(
+            '/users/new', 'POST', body=form,
+            headers=[(b'content-type', b'application/x-www-form-urlencoded'),
+                     (b'content-length', str(len(form)).encode())])
+        self.assertEqual(status, 302)
+        cookie = headers['set-cookie'].split(';')[0]
+        _, _, html = self.call('/users', headers=[(b'cookie', cookie.encode())])
+        self.assertIn('Created New User!', html)
+        self.assertIn('New User', html)
+
+    def test_lifespan(self):
+        sent = []
+        messages = iter([{'type': 'lifespan.startup'},
+                         {'type': 'lifespan.shutdown'}])
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.asgi({'type': 'lifespan'}, receive, send))
+        self.assertEqual(sent, ['lifespan.startup.complete',
+                                'lifespan.shutdown.complete'])
+
+    def test_environ_headers(self):
+        environ = wsgi_environ(scope('/a', query=b'x=1', headers=[
+            (b'content-type', b'text/plain'), (b'accept', b'a'),
+            (b'accept', b'b')]), b'')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'a,b')
+        self.assertEqual(environ['QUERY_STRING'], 'x=1')
+
+    def test_async_url(self):
+        self.assertEqual(str(async_url('postgresql:///blogly')),
+                         'postgresql+asyncpg:///blogly')
+        self.assertEqual(str(async_url('sqlite:////tmp/x.db')),
+                         'sqlite+aiosqlite:////tmp/x.db')
+
+    def test_keyset_runs_selects(self):
+        """The async loaders page a select() like the views page a query"""
+        db.session.add_all([User(first_name=f'F{i}', last_name='L') for i in range(5)])
+        db.session.commit()
+        expected = paginate(queries.users_by_name(), queries.USER_ORDER, per_page=2)
+        statement, finish = keyset(select(User), queries.USER_ORDER, per_page=2)
+        page = finish(db.session.execute(statement).scalars().all())
+        self.assertEqual([u.id for u in page], [u.id for u in expected])
+        self.assertEqual(page.next_cursor, expected.next_cursor)
+
+    @skipUnless(HAS_ASYNC_DRIVER, 'greenlet and aiosqlite are not installed')
+    def test_prefetched_views_skip_the_sync_engine(self):
+        statements = []
+
+        def record(*args):
+            statements.append(args[2])
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            _, _, users = self.call('/users')
+            _, _, post = self.call(f'/posts/{self.post_id}')
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertIn('Test_First Test_Last', users)
+        self.assertIn('<p>Hello <em>world</em></p>', post)
+        self.assertEqual(statements, [])
+        status, _, _ = self.call('/users', query=b'after=not-a-cursor')
+        self.assertEqual(status, 400)
@@ -0,0 +1,131 @@
+from unittest import TestCase, skipUnless
+import gzip
+import json
+import os
+import tempfile
+
+from app import create_app
+from models import db
+import assets
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+CSS = b'body {\n  margin: 0;\n}\n' * 40
+
+
+class AssetsTestCase(TestCase):
+    """Tests for the fingerprinted, precompressed static files"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'static')
+        self.target = os.path.join(self.source, 'dist')
+        os.makedirs(os.path.join(self.source, 'js'))
+        for name, data in (('style.css', CSS), ('logo.png', b'\x89PNG' * 100),
+                           ('js/app.js', b'let a = 1;\n')):
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(data)
+        self.manifest = assets.build(self.source, self.target)
+        self.saved = app.extensions['assets']
+        app.extensions['assets'] = assets.Assets(self.target)
+
+    def tearDown(self):
+        app.extensions['assets'] = self.saved
+        self.directory.cleanup()
+
+    def built(self, name):
+        return os.path.join(self.target, self.manifest[name])
+
+    def test_build_writes_manifest_and_copies(self):
+        self.assertEqual(sorted(self.manifest), ['js/app.js', 'logo.png', 'style.css'])
+        self.assertRegex(self.manifest['style.css'], r'^style\.[0-9a-f]{12}\.css$')
+        self.assertTrue(self.manifest['js/app.js'].startswith('js/app.'))
+        with open(os.path.join(self.target, assets.MANIFEST)) as f:
+            self.assertEqual(json.load(f), self.manifest)
+        with open(self.built('style.css') + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), CSS)
+        # Too small, or not text
+        self.assertFalse(os.path.exists(self.built('js/app.js') + '.gz'))
+        self.assertFalse(os.path.exists(self.built('logo.png') + '.gz'))
+
+    def test_rebuild_is_stable(self):
+        with open(self.built('style.css') + '.gz', 'rb') as f:
+            before = f.read()
+        os.remove(self.built('style.css'))
+        self.assertEqual(assets.build(self.source, self.target), self.manifest)
+        with open(self.built('style.css') + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), before)
+        with open(os.path.join(self.source, 'style.css'), 'ab') as f:
+            f.write(b'p { color: red; }\n')
+        changed = assets.build(self.source, self.target)
+        self.assertNotEqual(changed['style.css'], self.manifest['style.css'])
+        self.assertEqual(changed['logo.png'], self.manifest['logo.png'])
+
+    def test_asset_url(self):
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('style.css'),
+                             f'/assets/{self.manifest["style.css"]}')
+            # Not built: the file under /static/
+            self.assertEqual(assets.asset_url('other.css'), '/static/other.css')
+            app.extensions['assets'] = assets.Assets(self.directory.name)
+            self.assertEqual(assets.asset_url('style.css'), '/static/style.css')
+
+    def test_serves_gzip_when_accepted(self):
+        url = f'/assets/{self.manifest["style.css"]}'
+        with app.test_client() as client:
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertEqual(gzip.decompress(resp.data), CSS)
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+            resp = client.get(url)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.data, CSS)
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip;q=0'})
+            self.assertEqual(resp.data, CSS)
+
+    def test_conditional_requests(self):
+        url = f'/assets/{self.manifest["style.css"]}'
+        with app.test_client() as client:
+            etag = client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip',
+                                            'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            # The plain copy is a different representation
+            resp = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+    @skipUnless(assets.brotli, 'brotli is not installed')
+    def test_prefers_brotli(self):
+        url = f'/assets/{self.manifest["style.css"]}'
+        with app.test_client() as client:
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(assets.brotli.decompress(resp.data), CSS)
+
+    def test_only_built_names_are_served(self):
+        with app.test_client() as client:
+            self.assertEqual(client.get('/assets/style.css').status_code, 404)
+            self.assertEqual(client.get('/assets/manifest.json').status_code, 404)
+            self.assertEqual(client.get(
+                f'/assets/{self.manifest["style.css"]}.gz').status_code, 404)
+
+    def test_build_command(self):
+        with tempfile.TemporaryDirectory() as target:
+            saved = app.config['ASSETS_DIR']
+            app.config['ASSETS_DIR'] = target
+            try:
+                result = app.test_cli_runner().invoke(args=['blogly', 'build-assets'])
+                self.assertEqual(result.exit_code, 0, result.output)
+                self.assertIn('style.css', app.extensions['assets'].manifest)
+                with app.test_request_context():
+                    self.assertTrue(assets.asset_url('style.css').startswith('/assets/'))
+            finally:
+                app.config['ASSETS_DIR'] = saved
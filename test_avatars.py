@@ -0,0 +1,186 @@
+from unittest import TestCase
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from avatars import AvatarStore, AvatarError, avatar_url, version
+import avatars
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+def png(width=1, height=1):
+    """A valid, blank RGB PNG"""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    rows = b''.join(b'\x00' + b'\xff\xff\xff' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+class AvatarTestCase(TestCase):
+    """Tests for the avatar proxy"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        self.directory = tempfile.TemporaryDirectory()
+        app.extensions['avatars'] = AvatarStore(self.directory.name)
+        self.fetched = []
+        app.config['AVATAR_FETCHER'] = self.fetch
+        user = User(first_name='Test_First', last_name='Test_Last',
+                    image_url='https://example.com/me.png')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['AVATAR_FETCHER'] = None
+        app.config['AVATAR_PREWARM'] = False
+        app.config['AVATAR_FAILURE_TTL'] = 300
+        self.directory.cleanup()
+
+    def fetch(self, url, timeout, max_bytes):
+        self.fetched.append(url)
+        if 'broken' in url:
+            raise AvatarError(f'Could not fetch {url}')
+        if 'page' in url:
+            return b'<html></html>', 'image/png'
+        return png(300, 200), 'image/png'
+
+    def url(self, size=40, image_url='https://example.com/me.png'):
+        with app.test_request_context():
+            return avatar_url(self.user_id, image_url, size)
+
+    def objects(self):
+        return [name for _, _, names in os.walk(
+            os.path.join(self.directory.name, 'objects')) for name in names]
+
+    def test_fetches_once_and_caches_for_a_year(self):
+        with app.test_client() as client:
+            resp = client.get(self.url())
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'image/png')
+            self.assertIn('max-age=31536000', resp.headers['Cache-Control'])
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            etag = resp.headers['ETag']
+            resp = client.get(self.url())
+            self.assertEqual(resp.headers['ETag'], etag)
+            resp = client.get(self.url(), headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+        self.assertEqual(self.fetched, ['https://example.com/me.png'])
+
+    def test_same_image_stored_once(self):
+        other = User(first_name='Other', last_name='User',
+                     image_url='https://example.com/me.png')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+        with app.test_client() as client:
+            client.get(self.url())
+            client.get(f'/avatars/{other_id}?s=40')
+        self.assertEqual(len(self.objects()), 1)
+
+    def test_link_changes_with_image(self):
+        self.assertNotEqual(self.url(), self.url(image_url='https://example.com/new.png'))
+        self.assertIn(f'v={version("https://example.com/me.png")}', self.url())
+
+    def test_stale_link_is_not_cached(self):
+        with app.test_client() as client:
+            resp = client.get(f'/avatars/{self.user_id}?s=40&v=old')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('no-cache', resp.headers['Cache-Control'])
+
+    def test_unknown_size(self):
+        with app.test_client() as client:
+            resp = client.get(f'/avatars/{self.user_id}?s=41')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_fetch_error_redirects_to_source(self):
+        user = db.session.get(User, self.user_id)
+        user.image_url = 'https://example.com/broken.png'
+        db.session.commit()
+        with app.test_client() as client:
+            resp = client.get(f'/avatars/{self.user_id}?s=40')
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.headers['Location'], 'https://example.com/broken.png')
+
+    def test_fetch_error_is_remembered(self):
+        user = db.session.get(User, self.user_id)
+        user.image_url = 'https://example.com/broken.png'
+        db.session.commit()
+        with app.test_client() as client:
+            for _ in range(3):
+                resp = client.get(f'/avatars/{self.user_id}?s=40')
+                self.assertEqual(resp.status_code, 302)
+            self.assertEqual(self.fetched, ['https://example.com/broken.png'])
+            app.config['AVATAR_FAILURE_TTL'] = 0
+            client.get(f'/avatars/{self.user_id}?s=40')
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_not_an_image_is_not_served(self):
+        user = db.session.get(User, self.user_id)
+        user.image_url = 'https://example.com/page.png'
+        db.session.commit()
+        with app.test_client() as client:
+            resp = client.get(f'/avatars/{self.user_id}?s=40')
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.objects(), [])
+
+    def test_refuses_internal_addresses(self):
+        for url in ('http://127.0.0.1/a.png', 'http://localhost:8080/a.png',
+                    'http://169.254.169.254/latest/meta-data',
+                    'http://10.0.0.1/a.png', 'https://192.168.1.1/a.png',
+                    'http://[::1]/a.png', 'http://0.0.0.0/a.png'):
+            with self.subTest(url=url):
+                with self.assertRaisesRegex(AvatarError, 'public address'):
+                    avatars.fetch_url(url, 1, 1000)
+        with self.assertRaises(AvatarError):
+            avatars.fetch_url('file:///etc/passwd', 1, 1000)
+
+    def test_concurrent_writes_of_a_thumbnail(self):
+        store = app.extensions['avatars']
+        errors = []
+
+        def write():
+            try:
+                for _ in range(50):
+                    store.store('https://example.com/me.png', 40, png(), 'png')
+                    store.fail('https://example.com/other.png', 40)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertIsNotNone(store.lookup('https://example.com/me.png', 40))
+        leftovers = [name for _, _, names in os.walk(self.directory.name)
+                     for name in names if name.endswith('.tmp')]
+        self.assertEqual(leftovers, [])
+
+    def test_add_user_prewarms_every_size(self):
+        app.config['AVATAR_PREWARM'] = True
+        with app.test_client() as client:
+            client.post('/users/new', data={'first_name': 'New', 'last_name': 'User',
+                                             'image_url': 'https://example.com/new.png'})
+        self.assertEqual(self.fetched, ['https://example.com/new.png'] * len(avatars.SIZES))
+        store = app.extensions['avatars']
+        for size in avatars.SIZES:
+            self.assertIsNotNone(store.lookup('https://example.com/new.png', size))
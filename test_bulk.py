@@ -0,0 +1,110 @@
+from unittest import TestCase, skipIf
+import io
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from bulk import import_records, export_records, read_records, write_records
+from queries import count_queries
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class BulkTestCase(TestCase):
+    """Tests for streaming import and export"""
+
+    def setUp(self):
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def load(self, kind, text, fmt='ndjson', **kwargs):
+        kwargs.setdefault('exclusive', True)
+        return import_records(kind, read_records(io.StringIO(text), fmt), **kwargs)
+
+    def test_import_posts_resolves_tags(self):
+        self.load('users', '{"first_name": "Sonny", "last_name": "Rollins"}\n')
+        user_id = User.query.one().id
+        posts = ''.join(
+            f'{{"title": "Post {i}", "content": "Body", "user_id": {user_id}, '
+            f'"tags": ["Jazz", "Tag{i % 3}"]}}\n' for i in range(10))
+        stats = self.load('posts', posts, chunk_size=4)
+        self.assertEqual(stats.rows, 10)
+        self.assertEqual(Post.query.count(), 10)
+        self.assertEqual(sorted(t.name for t in Tag.query),
+                         ['Jazz', 'Tag0', 'Tag1', 'Tag2'])
+        self.assertEqual(PostTag.query.count(), 20)
+
+    def test_import_queries_per_chunk(self):
+        """Statements grow with the number of chunks, not of rows"""
+        self.load('users', '{"first_name": "Sonny", "last_name": "Rollins"}\n')
+        user_id = User.query.one().id
+        posts = ''.join(f'{{"title": "Post {i}", "content": "Body", '
+                        f'"user_id": {user_id}, "tags": ["Jazz"]}}\n'
+                        for i in range(200))
+        with count_queries() as counter:
+            self.load('posts', posts, chunk_size=100)
+        self.assertLess(len(counter), 20)
+
+    def test_mixed_ids_are_refused(self):
+        """Records with ids are never given other ones, so the posts that
+        refer to them keep pointing at the right users"""
+        users = ('{"id": 7, "first_name": "Sonny", "last_name": "Rollins"}\n'
+                 '{"first_name": "Max", "last_name": "Roach"}\n')
+        with self.assertRaisesRegex(ValueError, 'users records have an id'):
+            self.load('users', users)
+        db.session.rollback()
+        self.assertEqual(User.query.count(), 0)
+        # Nor across chunks
+        with self.assertRaises(ValueError):
+            self.load('users', users, chunk_size=1)
+        db.session.rollback()
+        self.assertEqual([user.id for user in User.query], [7])
+        User.query.delete()
+        db.session.commit()
+        self.load('users', users.splitlines()[0] + '\n')
+        self.assertEqual(User.query.one().id, 7)
+
+    def test_csv_round_trip(self):
+        user = User(first_name='Sonny', last_name='Rollins')
+        post = Post(title='Jazz Time', content='Saxophone', user=user)
+        post.tags.extend([Tag(name='Fun'), Tag(name='Happy')])
+        db.session.add(user)
+        db.session.commit()
+        out = io.StringIO()
+        count = write_records(out, export_records('posts', chunk_size=1),
+                              'posts', 'csv')
+        self.assertEqual(count, 1)
+        records = list(read_records(io.StringIO(out.getvalue()), 'csv'))
+        self.assertEqual(records[0]['title'], 'Jazz Time')
+        self.assertEqual(records[0]['tags'], ['Fun', 'Happy'])
+        self.assertEqual(records[0]['user_id'], user.id)
+
+    @skipIf(db.engine.dialect.name == 'postgresql', 'ids come from a sequence')
+    def test_import_needs_exclusive_use_without_sequences(self):
+        with self.assertRaisesRegex(ValueError, 'exclusive'):
+            self.load('users', '{"first_name": "A", "last_name": "B"}\n',
+                      exclusive=False)
+        self.assertEqual(User.query.count(), 0)
+        result = app.test_cli_runner().invoke(
+            args=['blogly', 'import', 'users', '-'],
+            input='{"first_name": "A", "last_name": "B"}\n')
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('--exclusive', result.output)
+
+    def test_cli_round_trip(self):
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['blogly', 'import', 'users', '-', '--exclusive'],
+                               input='{"id": 7, "first_name": "A", "last_name": "B"}\n')
+        self.assertIn('Imported users: 1 rows', result.output)
+        result = runner.invoke(args=['blogly', 'export', 'users', '-'])
+        self.assertIn('"first_name": "A"', result.output)
+        self.assertEqual(User.query.get(7).full_name, 'A B')
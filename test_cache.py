@@ -0,0 +1,129 @@
+from unittest import TestCase
+import time
+
+from flask import Flask
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import LRUCache, FragmentCache, fragment_cache
+from config import ProductionConfig
+import feed
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class LRUCacheTestCase(TestCase):
+    """Tests for the in-process LRU backend"""
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertEqual(cache.get('a'), '1')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), '3')
+
+    def test_expires_after_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', '1')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_versions(self):
+        cache = LRUCache()
+        self.assertEqual(cache.versions(['posts', 'tags']), [0, 0])
+        cache.bump(['posts'])
+        self.assertEqual(cache.versions(['posts', 'tags']), [1, 0])
+
+
+class FragmentCacheTestCase(TestCase):
+    """Tests for versioned fragments"""
+
+    def setUp(self):
+        self.cache = FragmentCache()
+        self.cache.backend = LRUCache()
+        self.renders = 0
+
+    def render(self):
+        self.renders += 1
+        return f'<p>{self.renders}</p>'
+
+    def test_hit_and_miss(self):
+        self.cache.fragment('page', ['posts'], self.render)
+        html = self.cache.fragment('page', ['posts'], self.render)
+        self.assertEqual(html, '<p>1</p>')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_invalidate_only_dependents(self):
+        self.cache.fragment('posts', ['posts'], self.render)
+        self.cache.fragment('tags', ['tags'], self.render)
+        self.cache.invalidate('posts')
+        self.cache.fragment('posts', ['posts'], self.render)
+        self.cache.fragment('tags', ['tags'], self.render)
+        self.assertEqual(self.cache.stats()['fragments'],
+                         {'posts': {'hits': 0, 'misses': 2},
+                          'tags': {'hits': 1, 'misses': 1}})
+
+    def test_production_per_process_cache_is_short_lived(self):
+        production = Flask(__name__)
+        production.config.from_object(ProductionConfig)
+        production.config['CACHE_BACKEND'] = 'simple'
+        with self.assertLogs('blogly.cache', 'WARNING'):
+            cache = FragmentCache(production)
+        if ProductionConfig.CACHE_BACKEND != 'redis':
+            self.assertLessEqual(cache.backend.ttl, 10)
+
+
+class CachedViewsTestCase(TestCase):
+    """Tests that write routes invalidate the cached pages"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        post = Post(title='CACHED_TITLE', content='CACHED_CONTENT', user=user)
+        tag = Tag(name='CACHED_TAG')
+        post.tags.append(tag)
+        db.session.add(user)
+        db.session.commit()
+        # Written behind the routes' back, so rebuild the feeds
+        feed.rebuild()
+        self.post_id = post.id
+        self.tag_id = tag.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_home_served_from_cache(self):
+        with app.test_client() as client:
+            client.get('/')
+            resp = client.get('/')
+            self.assertIn('CACHED_TITLE', resp.get_data(as_text=True))
+            self.assertEqual(fragment_cache.stats()['fragments']['home'],
+                             {'hits': 1, 'misses': 1})
+
+    def test_edit_post_invalidates_tag_page(self):
+        with app.test_client() as client:
+            client.get(f'/tags/{self.tag_id}')
+            data = {'title': 'RENAMED_TITLE', 'content': 'CACHED_CONTENT',
+                    str(self.tag_id): str(self.tag_id)}
+            client.post(f'/posts/{self.post_id}/edit', data=data)
+            resp = client.get(f'/tags/{self.tag_id}')
+            self.assertIn('RENAMED_TITLE', resp.get_data(as_text=True))
+
+    def test_edit_tag_invalidates_tag_list(self):
+        with app.test_client() as client:
+            client.get('/tags')
+            client.post(f'/tags/{self.tag_id}/edit', data={'name': 'NEW_NAME'})
+            resp = client.get('/tags')
+            self.assertIn('NEW_NAME', resp.get_data(as_text=True))
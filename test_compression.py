@@ -0,0 +1,159 @@
+from unittest import TestCase, skipUnless
+import gzip
+import io
+
+from werkzeug.test import Client
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from compression import CompressionMiddleware, choose_encoding, brotli
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+BODY = b'<p>Hello, world</p>\n' * 200
+
+
+def wsgi_app(body=BODY, mimetype='text/html', chunks=1, lazy=False, **headers):
+    """A WSGI app sending body in chunks, starting the response before it
+    returns or, with lazy, with its first chunk"""
+    size = -(-len(body) // chunks)
+    parts = [body[i:i + size] for i in range(0, len(body), size)]
+    closed = []
+
+    def application(environ, start_response):
+        response_headers = [('Content-Type', mimetype), *headers.items()]
+        if chunks == 1:
+            response_headers.append(('Content-Length', str(len(body))))
+
+        def generate():
+            if lazy:
+                start_response('200 OK', response_headers)
+            yield from parts
+        if not lazy:
+            start_response('200 OK', response_headers)
+        return Closing(generate(), closed)
+    application.closed = closed
+    return application
+
+
+class Closing:
+    def __init__(self, iterable, closed):
+        self.iterable = iterable
+        self.closed = closed
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        self.closed.append(True)
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Tests for the response compression middleware"""
+
+    def get(self, application, accept='gzip', method='GET', **kwargs):
+        client = Client(CompressionMiddleware(application, **kwargs))
+        headers = {'Accept-Encoding': accept} if accept else {}
+        return client.open('/', method=method, headers=headers)
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding('gzip, deflate'), 'gzip')
+        self.assertIsNone(choose_encoding('gzip;q=0, deflate'))
+        self.assertIsNone(choose_encoding(''))
+        self.assertIsNone(choose_encoding(None))
+        self.assertEqual(choose_encoding('*'), 'br' if brotli else 'gzip')
+        self.assertEqual(choose_encoding('br;q=0.5, gzip'), 'gzip')
+
+    def test_compresses_text(self):
+        application = wsgi_app()
+        resp = self.get(application)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gzip.decompress(resp.get_data()), BODY)
+        resp.close()
+        self.assertEqual(application.closed, [True])
+
+    def test_passes_through(self):
+        cases = [
+            ('not accepted', wsgi_app(), {'accept': None}),
+            ('small', wsgi_app(body=b'<p>hi</p>'), {}),
+            ('small streamed', wsgi_app(body=b'<p>hi</p>' * 10, chunks=3), {}),
+            ('image', wsgi_app(mimetype='image/png'), {}),
+            ('encoded', wsgi_app(**{'Content-Encoding': 'gzip'}), {}),
+            ('no-transform', wsgi_app(**{'Cache-Control': 'no-transform'}), {}),
+            ('head', wsgi_app(), {'method': 'HEAD'}),
+        ]
+        for name, application, kwargs in cases:
+            with self.subTest(name):
+                resp = self.get(application, **kwargs)
+                self.assertEqual(resp.headers.get('Content-Encoding'),
+                                 'gzip' if name == 'encoded' else None)
+                if kwargs.get('method') != 'HEAD':
+                    self.assertIn(resp.get_data(), (BODY, b'<p>hi</p>',
+                                                    b'<p>hi</p>' * 10))
+
+    def test_streams_in_pieces(self):
+        body = b''.join(b'<li>%d</li>\n' % i for i in range(5000))
+        application = wsgi_app(body=body, chunks=50, lazy=True)
+        client = Client(CompressionMiddleware(application, stream_buffer=4096))
+        resp = client.get('/', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+        pieces = [piece for piece in resp.response if piece]
+        self.assertGreater(len(pieces), 5)
+        # Every piece up to then is decodable: nothing waits for the end
+        self.assertTrue(gzip.GzipFile(
+            fileobj=io.BytesIO(b''.join(pieces[:3]))).read(100))
+        self.assertEqual(gzip.decompress(b''.join(pieces)), body)
+        resp.close()
+        self.assertEqual(application.closed, [True])
+
+    def test_weak_etag(self):
+        resp = self.get(wsgi_app(ETag='"abc"', Vary='Cookie'))
+        self.assertEqual(resp.headers['ETag'], 'W/"abc"')
+        self.assertEqual(resp.headers['Vary'], 'Cookie, Accept-Encoding')
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli(self):
+        resp = self.get(wsgi_app(), accept='gzip, br')
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(resp.get_data()), BODY)
+
+
+class CompressedPagesTestCase(TestCase):
+    """Tests for the compressed Blogly pages"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        tags = [Tag(name=f'Tag_{i:03}') for i in range(200)]
+        db.session.add_all([user, *tags])
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_pages_are_compressed(self):
+        with app.test_client() as client:
+            for path in ('/tags', f'/users/{self.user_id}/posts/new'):
+                with self.subTest(path):
+                    plain = client.get(path).get_data()
+                    resp = client.get(path, headers={'Accept-Encoding': 'gzip'})
+                    self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+                    self.assertEqual(gzip.decompress(resp.get_data()), plain)
+                    self.assertLess(len(resp.get_data()), len(plain) / 3)
+
+    def test_disabled(self):
+        self.assertIsInstance(app.wsgi_app, CompressionMiddleware)
+        off = create_app(type('Off', (TestingConfig,), {'COMPRESS_ENABLED': False}))
+        self.assertNotIsInstance(off.wsgi_app, CompressionMiddleware)
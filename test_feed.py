@@ -0,0 +1,165 @@
+from unittest import TestCase
+import datetime
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag, FeedEntry
+from cache import fragment_cache
+import feed
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+START = datetime.datetime(2024, 1, 1)
+
+
+class FeedTestCase(TestCase):
+    """Tests for the precomputed recent-posts feeds"""
+
+    def setUp(self):
+        """Add two users and ten posts, one minute apart"""
+        fragment_cache.clear()
+        # Other test modules build their own apps; read this one's FEED_SIZE
+        self.context = app.app_context()
+        self.context.push()
+        app.config['FEED_SIZE'] = 5
+        FeedEntry.query.delete()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        alice = User(first_name='Alice', last_name='Adams')
+        bob = User(first_name='Bob', last_name='Brown')
+        jazz = Tag(name='Jazz')
+        db.session.add_all([alice, bob, jazz])
+        db.session.flush()
+        posts = [Post(title=f'Post_{i}', content=f'Content {i}',
+                      user=alice if i % 2 else bob,
+                      created_at=START + datetime.timedelta(minutes=i))
+                 for i in range(10)]
+        db.session.add_all(posts)
+        db.session.flush()
+        for post in posts[:3]:
+            db.session.add(PostTag(post_id=post.id, tag_id=jazz.id))
+        db.session.commit()
+        self.alice_id, self.bob_id, self.jazz_id = alice.id, bob.id, jazz.id
+        self.post_ids = [post.id for post in posts]
+        feed.rebuild()
+
+    def tearDown(self):
+        """Clean up any fouled transaction"""
+        db.session.rollback()
+        app.config['FEED_SIZE'] = feed.DEFAULT_FEED_SIZE
+        self.context.pop()
+
+    def titles(self, scope):
+        return [entry.title for entry in feed.read(scope)]
+
+    def assert_matches_rebuild(self):
+        """The incrementally maintained feeds equal freshly built ones"""
+        def snapshot():
+            return sorted((e.scope, e.post_id, e.title, e.author_name, e.tags)
+                          for e in FeedEntry.query)
+        kept = snapshot()
+        feed.rebuild()
+        self.assertEqual(kept, snapshot())
+
+    def test_rebuild(self):
+        self.assertEqual(self.titles(feed.GLOBAL),
+                         ['Post_9', 'Post_8', 'Post_7', 'Post_6', 'Post_5'])
+        self.assertEqual(self.titles(feed.user_scope(self.alice_id)),
+                         ['Post_9', 'Post_7', 'Post_5', 'Post_3', 'Post_1'])
+        self.assertEqual(self.titles(feed.tag_scope(self.jazz_id)),
+                         ['Post_2', 'Post_1', 'Post_0'])
+        entry = feed.read(feed.tag_scope(self.jazz_id))[0]
+        self.assertEqual(entry.author_name, 'Bob Brown')
+        self.assertEqual(entry.tags, [[self.jazz_id, 'Jazz']])
+
+    def test_new_post_trims_feeds(self):
+        with app.test_client() as client:
+            client.post(f'/users/{self.alice_id}/posts/new',
+                        data={'title': 'Newest', 'content': 'Hi',
+                              str(self.jazz_id): 'on'})
+        self.assertEqual(self.titles(feed.GLOBAL)[0], 'Newest')
+        self.assertEqual(len(self.titles(feed.GLOBAL)), 5)
+        self.assertEqual(self.titles(feed.user_scope(self.alice_id))[0], 'Newest')
+        self.assertEqual(self.titles(feed.tag_scope(self.jazz_id))[0], 'Newest')
+        self.assert_matches_rebuild()
+
+    def test_edit_post_updates_entries(self):
+        post_id = self.post_ids[9]
+        with app.test_client() as client:
+            client.post(f'/posts/{post_id}/edit',
+                        data={'title': 'Renamed', 'content': '',
+                              str(self.jazz_id): 'on'})
+        self.assertEqual(self.titles(feed.GLOBAL)[0], 'Renamed')
+        self.assertEqual(self.titles(feed.tag_scope(self.jazz_id))[0], 'Renamed')
+        self.assert_matches_rebuild()
+
+    def test_delete_post_refills(self):
+        post_id = self.post_ids[9]
+        with app.test_client() as client:
+            client.post(f'/posts/{post_id}/delete')
+        self.assertEqual(self.titles(feed.GLOBAL),
+                         ['Post_8', 'Post_7', 'Post_6', 'Post_5', 'Post_4'])
+        self.assertEqual(self.titles(feed.user_scope(self.alice_id)),
+                         ['Post_7', 'Post_5', 'Post_3', 'Post_1'])
+        self.assert_matches_rebuild()
+
+    def test_edit_user_renames_author(self):
+        with app.test_client() as client:
+            client.post(f'/users/{self.alice_id}/edit',
+                        data={'first_name': 'Alicia', 'last_name': '',
+                              'image_url': ''})
+        names = {entry.author_name
+                 for entry in feed.read(feed.user_scope(self.alice_id))}
+        self.assertEqual(names, {'Alicia Adams'})
+        self.assert_matches_rebuild()
+
+    def test_delete_user_refills_other_feeds(self):
+        with app.test_client() as client:
+            client.post(f'/users/{self.alice_id}/delete')
+        self.assertEqual(self.titles(feed.GLOBAL),
+                         ['Post_8', 'Post_6', 'Post_4', 'Post_2', 'Post_0'])
+        self.assertEqual(self.titles(feed.tag_scope(self.jazz_id)),
+                         ['Post_2', 'Post_0'])
+        self.assert_matches_rebuild()
+
+    def test_rename_and_delete_tag(self):
+        with app.test_client() as client:
+            client.post(f'/tags/{self.jazz_id}/edit',
+                        data={'name': 'Bebop',
+                              **{str(post_id): 'on' for post_id in self.post_ids[:3]}})
+            entry = feed.read(feed.user_scope(self.bob_id))[-1]
+            self.assertEqual(entry.tags, [[self.jazz_id, 'Bebop']])
+            self.assert_matches_rebuild()
+            client.post(f'/tags/{self.jazz_id}/delete')
+        entry = feed.read(feed.user_scope(self.bob_id))[-1]
+        self.assertEqual(entry.tags, [])
+        self.assertEqual(feed.read(feed.tag_scope(self.jazz_id)), [])
+        self.assert_matches_rebuild()
+
+    def test_user_page_pages_past_the_feed(self):
+        app.config['FEED_SIZE'] = 2
+        feed.rebuild()
+        with app.test_client() as client:
+            resp = client.get(f'/users/{self.alice_id}')
+            html = resp.get_data(as_text=True)
+            self.assertIn('Post_9', html)
+            self.assertNotIn('Post_5', html)
+            self.assertIn('?after=', html)
+            cursor = html.split('?after=')[1].split('&')[0]
+            resp = client.get(f'/users/{self.alice_id}?after={cursor}')
+            html = resp.get_data(as_text=True)
+            self.assertIn('Post_5', html)
+            self.assertIn('Post_1', html)
+            self.assertNotIn('Post_9', html)
+
+    def test_home_reads_global_feed(self):
+        with app.test_client() as client:
+            html = client.get('/').get_data(as_text=True)
+        self.assertIn('Post_9', html)
+        self.assertIn('Content 9', html)
+        self.assertNotIn('Post_4', html)
@@ -1,18 +1,13 @@
 from unittest import TestCase
 
-from app import app
+from app import create_app
 from models import db, User, Post, Tag, PostTag
+from queries import count_queries
+from cache import fragment_cache
 from sqlalchemy.sql import asc, desc, func
 
-# Use test database and don't clutter tests with SQL
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
-app.config['SQLALCHEMY_ECHO'] = False
-
-# Make Flask errors be real errors, rather than HTML pages with error info
-app.config['TESTING'] = True
-
-# This is a bit of hack, but don't use Flask DebugToolbar
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
 
 db.drop_all()
 db.create_all()
@@ -21,6 +16,7 @@ class UserViewsTestCase(TestCase):
     """Test for views for Users"""
     def setUp(self):
         """Aad sample user"""
+        fragment_cache.clear()
         PostTag.query.delete()
         Tag.query.delete()
         Post.query.delete()
@@ -49,9 +45,8 @@ class UserViewsTestCase(TestCase):
             html = resp.get_data(as_text=True)
             self.assertEqual(resp.status_code, 200)
             self.assertIn('<h1>Test_First Test_Last</h1>', html)
-            # Check if Default Image is In Html
-            self.assertIn(
-                'https://randomuser.me/api/portraits/lego/1.jpg', html)
+            # Default image, through the avatar proxy
+            self.assertIn(f'/avatars/{self.user_id}?s=160', html)
 
     def test_add_user(self):
         with app.test_client() as client:
@@ -83,6 +78,7 @@ class UserViewsTestCase(TestCase):
 class PostViewsTestCase(TestCase):
     def setUp(self):
         """Aad sample post with tag"""
+        fragment_cache.clear()
         PostTag.query.delete()
         User.query.delete()
         Post.query.delete()
@@ -147,6 +143,7 @@ class PostViewsTestCase(TestCase):
 class TagViewsTestCase(TestCase):
     def setUp(self):
         """Aad sample post with tag"""
+        fragment_cache.clear()
         PostTag.query.delete()
         User.query.delete()
         Post.query.delete()
@@ -207,4 +204,211 @@ class TagViewsTestCase(TestCase):
             
         
             
-        
\ No newline at end of file
+        
+
+class QueryCountTestCase(TestCase):
+    """Guards against N+1 queries on the listing pages"""
+    MAX_QUERIES = 5
+
+    def setUp(self):
+        """Add several users with tagged posts"""
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        tags = [Tag(name=f'Tag_{i}') for i in range(3)]
+        for i in range(3):
+            user = User(first_name=f'First_{i}', last_name=f'Last_{i}')
+            for j in range(3):
+                post = Post(title=f'Title_{i}_{j}', content='Content', user=user)
+                post.tags.extend(tags)
+            db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.post_id = post.id
+        self.tag_id = tags[0].id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def assertMaxQueries(self, url):
+        """GET url and fail if it sends more than MAX_QUERIES statements"""
+        db.session.expire_all()
+        with app.test_client() as client:
+            with count_queries() as counter:
+                resp = client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertLessEqual(len(counter), self.MAX_QUERIES,
+                                 f'{url} sent {len(counter)} queries')
+
+    def test_home_queries(self):
+        self.assertMaxQueries('/')
+
+    def test_all_posts_queries(self):
+        self.assertMaxQueries('/posts')
+
+    def test_user_details_queries(self):
+        self.assertMaxQueries(f'/users/{self.user_id}')
+
+    def test_show_post_queries(self):
+        self.assertMaxQueries(f'/posts/{self.post_id}')
+
+    def test_tag_details_queries(self):
+        self.assertMaxQueries(f'/tags/{self.tag_id}')
+
+
+class PaginationViewsTestCase(TestCase):
+    """Tests for keyset pagination of the listing pages"""
+    def setUp(self):
+        """Add five posts and tags"""
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        tag = Tag(name='Paged_Tag')
+        for i in range(5):
+            post = Post(title=f'PAGED_{i}', content='Content', user=user)
+            post.tags.append(tag)
+            db.session.add(Tag(name=f'TAG_{i}'))
+        db.session.add(user)
+        db.session.commit()
+        self.tag_id = tag.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_posts_next_and_prev(self):
+        """Follows next links through /posts and back again"""
+        with app.test_client() as client:
+            resp = client.get('/posts?per_page=2')
+            html = resp.get_data(as_text=True)
+            self.assertIn('PAGED_0', html)
+            self.assertIn('PAGED_1', html)
+            self.assertNotIn('PAGED_2', html)
+            self.assertNotIn('Previous', html)
+            next_link = html.split('href="?after=')[1].split('"')[0]
+            resp = client.get(f'/posts?after={next_link}')
+            html = resp.get_data(as_text=True)
+            self.assertIn('PAGED_2', html)
+            self.assertIn('PAGED_3', html)
+            self.assertNotIn('PAGED_1', html)
+            prev_link = html.split('href="?before=')[1].split('"')[0]
+            resp = client.get(f'/posts?before={prev_link}')
+            html = resp.get_data(as_text=True)
+            self.assertIn('PAGED_0', html)
+            self.assertNotIn('PAGED_2', html)
+
+    def test_tag_details_paged(self):
+        with app.test_client() as client:
+            resp = client.get(f'/tags/{self.tag_id}?per_page=3')
+            html = resp.get_data(as_text=True)
+            self.assertIn('PAGED_2', html)
+            self.assertNotIn('PAGED_3', html)
+            self.assertIn('Next', html)
+
+    def test_bad_cursor(self):
+        with app.test_client() as client:
+            resp = client.get('/tags?after=not-a-cursor')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_edit_tag_keeps_other_pages(self):
+        """Saving one page of the edit form leaves other pages tagged"""
+        with app.test_client() as client:
+            posts = Post.query.order_by(Post.title).all()
+            shown = ','.join(str(post.id) for post in posts[:2])
+            data = {'name': 'Paged_Tag', 'shown_posts': shown,
+                    str(posts[0].id): str(posts[0].id)}
+            client.post(f'/tags/{self.tag_id}/edit', data=data)
+            tag = Tag.query.get(self.tag_id)
+            self.assertEqual({post.title for post in tag.posts},
+                             {'PAGED_0', 'PAGED_2', 'PAGED_3', 'PAGED_4'})
+
+    def test_edit_tag_page_buttons_save_first(self):
+        """Turning a page of the edit form submits it, so its checkboxes
+        are not lost"""
+        with app.test_client() as client:
+            html = client.get(f'/tags/{self.tag_id}/edit?per_page=2').get_data(as_text=True)
+            self.assertNotIn('href="?after=', html)
+            self.assertIn('name="after"', html)
+            self.assertLess(html.index('id="addbtn"'), html.index('name="after"'))
+            posts = Post.query.order_by(Post.title).all()
+            shown = ','.join(str(post.id) for post in posts[:2])
+            cursor = html.split('name="after" value="')[1].split('"')[0]
+            resp = client.post(f'/tags/{self.tag_id}/edit',
+                               data={'name': 'Paged_Tag', 'shown_posts': shown,
+                                     str(posts[1].id): str(posts[1].id),
+                                     'after': cursor, 'per_page': '2'})
+            self.assertEqual(resp.status_code, 302)
+            self.assertIn(f'/tags/{self.tag_id}/edit?after=', resp.location)
+            self.assertIn('per_page=2', resp.location)
+            db.session.expire_all()
+            titles = {post.title for post in Tag.query.get(self.tag_id).posts}
+            self.assertIn('PAGED_1', titles)
+            self.assertNotIn('PAGED_0', titles)
+            html = client.get(resp.location).get_data(as_text=True)
+            self.assertIn('PAGED_2', html)
+            self.assertNotIn('PAGED_1<', html)
+
+    def test_edit_tag_empty_page_touches_nothing(self):
+        """Saving a page of the edit form that lists no posts keeps every
+        post tagged"""
+        with app.test_client() as client:
+            before = {post.id for post in Tag.query.get(self.tag_id).posts}
+            client.post(f'/tags/{self.tag_id}/edit',
+                        data={'name': 'Paged_Tag', 'shown_posts': ''})
+            db.session.expire_all()
+            tag = Tag.query.get(self.tag_id)
+            self.assertEqual({post.id for post in tag.posts}, before)
+            self.assertEqual(tag.post_count, len(before))
+
+
+class TagCloudViewsTestCase(TestCase):
+    """Tests for the tag cloud and the post counts on tag pages"""
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        popular, rare = Tag(name='Popular'), Tag(name='Rare')
+        db.session.add(Tag(name='Unused'))
+        for i in range(4):
+            post = Post(title=f'CLOUD_{i}', content='Content', user=user)
+            post.tags.append(popular)
+            if i == 0:
+                post.tags.append(rare)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.popular_id = popular.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cloud_sorted_by_post_count(self):
+        with app.test_client() as client:
+            html = client.get('/tags/cloud').get_data(as_text=True)
+            self.assertLess(html.index('Popular'), html.index('Rare'))
+            self.assertNotIn('Unused', html)
+            self.assertIn('class="cloud-5"', html)
+            self.assertIn('class="cloud-1"', html)
+
+    def test_counts_follow_post_writes(self):
+        with app.test_client() as client:
+            html = client.get(f'/tags/{self.popular_id}').get_data(as_text=True)
+            self.assertIn('4 posts', html)
+            client.get('/tags')
+            client.post(f'/users/{self.user_id}/posts/new',
+                        data={'title': 'CLOUD_new', 'content': 'Content',
+                              str(self.popular_id): 'on'})
+            html = client.get(f'/tags/{self.popular_id}').get_data(as_text=True)
+            self.assertIn('5 posts', html)
+            html = client.get('/tags').get_data(as_text=True)
+            self.assertIn('Popular</a> <span class="badge rounded-pill bg-secondary">5', html)
+            client.post(f'/users/{self.user_id}/delete')
+            html = client.get('/tags/cloud').get_data(as_text=True)
+            self.assertNotIn('Popular', html)
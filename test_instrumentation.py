@@ -0,0 +1,110 @@
+from unittest import TestCase
+import json
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from instrumentation import instrumentation
+from cache import fragment_cache
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class InstrumentationTestCase(TestCase):
+    """Tests for request metrics and the slow-request log"""
+
+    def setUp(self):
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Sonny', last_name='Rollins')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        fragment_cache.clear()
+        instrumentation.reset()
+        app.config['METRICS_SAMPLE_RATE'] = 1.0
+        app.config['SLOW_REQUEST_MS'] = 500
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['METRICS_ALLOWED_IPS'] = ['127.0.0.0/8', '::1']
+        app.config['METRICS_TOKEN'] = None
+
+    def metrics(self):
+        with app.test_client() as client:
+            return client.get('/metrics').get_data(as_text=True)
+
+    def test_metrics_count_requests_and_sql(self):
+        with app.test_client() as client:
+            client.get('/users')
+            client.get('/users')
+            client.get('/no/such/page')
+        text = self.metrics()
+        labels = '{endpoint="blogly.list_users",method="GET"}'
+        self.assertIn(f'blogly_request_duration_seconds_count{labels} 2', text)
+        self.assertIn(f'blogly_request_duration_seconds_bucket'
+                      '{endpoint="blogly.list_users",method="GET",le="+Inf"} 2', text)
+        self.assertIn(f'blogly_sampled_requests_total{labels} 2', text)
+        self.assertIn(f'blogly_sql_statements_total{labels} 2', text)
+        self.assertIn('blogly_request_duration_seconds_count'
+                      '{endpoint="unmatched",method="GET"} 1', text)
+        self.assertIn('# TYPE blogly_request_duration_seconds histogram', text)
+
+    def test_metrics_include_fragment_cache_stats(self):
+        with app.test_client() as client:
+            client.get('/tags')
+            client.get('/tags')
+        text = self.metrics()
+        self.assertIn('blogly_fragment_cache_hits_total{fragment="tags"} 1', text)
+        self.assertIn('blogly_fragment_cache_misses_total{fragment="tags"} 1', text)
+
+    def test_metrics_only_for_allowed_clients(self):
+        outside = {'REMOTE_ADDR': '203.0.113.5'}
+        with app.test_client() as client:
+            self.assertEqual(client.get('/metrics').status_code, 200)
+            resp = client.get('/metrics', environ_base=outside)
+            self.assertEqual(resp.status_code, 403)
+            app.config['METRICS_ALLOWED_IPS'] = ['203.0.113.0/24']
+            resp = client.get('/metrics', environ_base=outside)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(client.get('/metrics').status_code, 403)
+
+    def test_metrics_with_token(self):
+        app.config['METRICS_ALLOWED_IPS'] = []
+        app.config['METRICS_TOKEN'] = 's3cret'
+        with app.test_client() as client:
+            self.assertEqual(client.get('/metrics').status_code, 403)
+            resp = client.get('/metrics', headers={'Authorization': 'Bearer wrong'})
+            self.assertEqual(resp.status_code, 403)
+            resp = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_unsampled_requests_are_only_timed(self):
+        app.config['METRICS_SAMPLE_RATE'] = 0.0
+        with app.test_client() as client:
+            client.get('/users')
+        text = self.metrics()
+        labels = '{endpoint="blogly.list_users",method="GET"}'
+        self.assertIn(f'blogly_request_duration_seconds_count{labels} 1', text)
+        self.assertIn(f'blogly_sampled_requests_total{labels} 0', text)
+        self.assertIn(f'blogly_sql_statements_total{labels} 0', text)
+
+    def test_slow_requests_are_logged(self):
+        app.config['SLOW_REQUEST_MS'] = 0
+        with self.assertLogs('blogly.slow', 'WARNING') as logs:
+            with app.test_client() as client:
+                client.get(f'/users/{self.user_id}')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['endpoint'], 'blogly.user_details')
+        self.assertEqual(entry['status'], 200)
+        self.assertTrue(entry['sampled'])
+        self.assertGreaterEqual(entry['sql_count'], 1)
+        self.assertTrue(entry['slowest_sql'].startswith('SELECT'))
+        self.assertGreater(entry['template_ms'], 0)
+        self.assertGreaterEqual(entry['duration_ms'],
+                                entry['sql_ms'] + entry['template_ms'])
@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag, FeedEntry, Job
+from cache import fragment_cache
+from jobs import job_runner
+import feed
+import jobs
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+@jobs.handler('explode')
+def explode(target_id):
+    yield 1
+    raise RuntimeError(f'boom {target_id}')
+
+
+class JobsTestCase(TestCase):
+    """Tests for batched background deletes"""
+
+    def setUp(self):
+        """Add a prolific user with tagged posts and a quiet user"""
+        fragment_cache.clear()
+        self.context = app.app_context()
+        self.context.push()
+        app.config.update(ASYNC_DELETE_THRESHOLD=3, DELETE_BATCH_SIZE=2,
+                          JOBS_INLINE=True)
+        Job.query.delete()
+        FeedEntry.query.delete()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        prolific = User(first_name='Prolific', last_name='Writer')
+        quiet = User(first_name='Quiet', last_name='Writer')
+        tag = Tag(name='Busy')
+        posts = [Post(title=f'Post_{i}', content='Content', user=prolific)
+                 for i in range(5)]
+        db.session.add_all([prolific, quiet, tag, *posts,
+                            Post(title='Quiet_Post', content='Content', user=quiet)])
+        db.session.flush()
+        db.session.add_all(PostTag(post_id=post.id, tag_id=tag.id) for post in posts)
+        db.session.commit()
+        feed.rebuild()
+        self.prolific_id, self.quiet_id, self.tag_id = prolific.id, quiet.id, tag.id
+
+    def tearDown(self):
+        """Clean up any fouled transaction"""
+        db.session.rollback()
+        app.config.update(ASYNC_DELETE_THRESHOLD=1000, DELETE_BATCH_SIZE=1000,
+                          JOBS_INLINE=True)
+        self.context.pop()
+
+    def test_delete_user_in_batches(self):
+        with app.test_client() as client:
+            resp = client.post(f'/users/{self.prolific_id}/delete',
+                               follow_redirects=True)
+            self.assertIn('in the background', resp.get_data(as_text=True))
+            job = Job.query.one()
+            status = client.get(f'/jobs/{job.id}').json
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(status['kind'], 'delete_user')
+        # Five posts in batches of two, then the user
+        self.assertEqual(status['progress'], 6)
+        self.assertIsNone(db.session.get(User, self.prolific_id))
+        self.assertEqual(Post.query.count(), 1)
+        self.assertEqual(db.session.get(Tag, self.tag_id).post_count, 0)
+        self.assertEqual([entry.title for entry in feed.read(feed.GLOBAL)],
+                         ['Quiet_Post'])
+
+    def test_delete_tag_in_batches(self):
+        with app.test_client() as client:
+            client.post(f'/tags/{self.tag_id}/delete')
+        job = Job.query.one()
+        self.assertEqual((job.kind, job.status, job.progress), ('delete_tag', 'done', 6))
+        self.assertIsNone(db.session.get(Tag, self.tag_id))
+        self.assertEqual(Post.query.count(), 6)
+        self.assertEqual(PostTag.query.count(), 0)
+        self.assertEqual({tuple(map(tuple, entry.tags)) for entry in FeedEntry.query},
+                         {()})
+
+    def test_small_delete_stays_in_request(self):
+        with app.test_client() as client:
+            client.post(f'/users/{self.quiet_id}/delete')
+        self.assertIsNone(db.session.get(User, self.quiet_id))
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_enqueue_reuses_active_job(self):
+        app.config['JOBS_INLINE'] = False
+        job = Job(kind='delete_user', target_id=self.prolific_id, status='running')
+        db.session.add(job)
+        db.session.commit()
+        self.assertEqual(jobs.enqueue('delete_user', self.prolific_id).id, job.id)
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_failed_job_records_error(self):
+        job = jobs.enqueue('explode', 7)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, 'RuntimeError: boom 7')
+        self.assertEqual(job.progress, 1)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_worker_thread(self):
+        app.config['JOBS_INLINE'] = False
+        job = Job(kind='delete_user', target_id=self.prolific_id)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+        job_runner.submit(job_id).result(timeout=10)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Job, job_id).status, 'done')
+        self.assertIsNone(db.session.get(User, self.prolific_id))
+
+    def test_resume_requeues_running_jobs(self):
+        job = Job(kind='delete_tag', target_id=self.tag_id, status='running')
+        db.session.add(job)
+        db.session.commit()
+        self.assertEqual(jobs.resume(), 1)
+        self.assertEqual(db.session.get(Job, job.id).status, 'done')
+        self.assertIsNone(db.session.get(Tag, self.tag_id))
@@ -0,0 +1,134 @@
+from unittest import TestCase
+from unittest import mock
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+import bulk
+import feed
+import markup
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class RenderTestCase(TestCase):
+    """Tests for the Markdown renderer"""
+
+    def test_blocks_and_inline(self):
+        html = markup.to_html('# Title\n\nSome **bold**, *italic* and `co*de*`.\n\n'
+                              '- one\n- two\n\n> quoted\n\n```\nx = 1\n```')
+        self.assertEqual(html, '<h1>Title</h1>'
+                               '<p>Some <strong>bold</strong>, <em>italic</em> '
+                               'and <code>co*de*</code>.</p>'
+                               '<ul><li>one</li><li>two</li></ul>'
+                               '<blockquote><p>quoted</p></blockquote>'
+                               '<pre><code>x = 1</code></pre>')
+
+    def test_html_is_escaped(self):
+        html = markup.to_html('<script>alert(1)</script> [x](javascript:alert(1))')
+        self.assertNotIn('<script>', html)
+        self.assertNotIn('href', html)
+        self.assertIn('&lt;script&gt;', html)
+
+    def test_links(self):
+        self.assertEqual(markup.to_html('[Blogly](https://example.com/?a=1&b=2)'),
+                         '<p><a href="https://example.com/?a=1&amp;b=2" '
+                         'rel="nofollow">Blogly</a></p>')
+
+    def test_excerpt_is_plain_text(self):
+        content_html, excerpt = markup.render('# Hi\n\n**Bold** & ' + 'word ' * 100)
+        self.assertTrue(excerpt.startswith('Hi Bold & word'))
+        self.assertTrue(excerpt.endswith('…'))
+        self.assertLessEqual(len(excerpt), markup.EXCERPT_CHARS + 1)
+
+    def test_hash_follows_renderer_version(self):
+        before = markup.content_hash('text')
+        with mock.patch.object(markup, 'RENDERER_VERSION', markup.RENDERER_VERSION + 1):
+            self.assertNotEqual(markup.content_hash('text'), before)
+
+
+class RenderedPostsTestCase(TestCase):
+    """Tests for storing rendered post content"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        self.context = app.app_context()
+        self.context.push()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        post = Post(title='SETUP_TITLE', content='Hello *world*', user=user)
+        db.session.add_all([user, post])
+        db.session.commit()
+        self.user_id, self.post_id = user.id, post.id
+        feed.rebuild()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def test_rendered_on_write(self):
+        post = db.session.get(Post, self.post_id)
+        self.assertEqual(post.content_html, '<p>Hello <em>world</em></p>')
+        self.assertEqual(post.excerpt, 'Hello world')
+        self.assertEqual(post.content_hash, markup.content_hash('Hello *world*'))
+
+    def test_only_changed_content_is_rendered(self):
+        post = db.session.get(Post, self.post_id)
+        with mock.patch.object(markup, 'render', wraps=markup.render) as render:
+            post.title = 'New title'
+            db.session.commit()
+            render.assert_not_called()
+            post.content = '**Changed**'
+            db.session.commit()
+            render.assert_called_once_with('**Changed**')
+        self.assertEqual(post.excerpt, 'Changed')
+
+    def test_post_page_shows_html(self):
+        with app.test_client() as client:
+            html = client.get(f'/posts/{self.post_id}').get_data(as_text=True)
+        self.assertIn('<p>Hello <em>world</em></p>', html)
+
+    def test_listings_show_the_excerpt(self):
+        long = 'Intro **words**\n\n' + 'filler ' * 500 + 'THE_END'
+        with app.test_client() as client:
+            client.post(f'/posts/{self.post_id}/edit',
+                        data={'title': 'Long', 'content': long})
+            home = client.get('/').get_data(as_text=True)
+            user = client.get(f'/users/{self.user_id}').get_data(as_text=True)
+        self.assertIn('Intro words filler', home)
+        self.assertNotIn('**', home)
+        self.assertNotIn('THE_END', home)
+        self.assertNotIn('THE_END', user)
+
+    def test_bulk_import_renders(self):
+        bulk.import_records('posts', [{'title': 'Imported', 'content': '`code`',
+                                       'user_id': self.user_id}], exclusive=True)
+        post = Post.query.filter_by(title='Imported').one()
+        self.assertEqual(post.content_html, '<p><code>code</code></p>')
+        self.assertEqual(post.excerpt, 'code')
+
+    def test_rerender_command(self):
+        db.session.execute(Post.__table__.update().values(
+            content_html=None, excerpt=None, content_hash=None))
+        db.session.commit()
+        with app.test_client() as client:
+            html = client.get(f'/posts/{self.post_id}').get_data(as_text=True)
+        self.assertIn('<p>Hello <em>world</em></p>', html)
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['blogly', 'rerender'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Rendered 1 posts', result.output)
+        post = db.session.get(Post, self.post_id)
+        self.assertEqual(post.excerpt, 'Hello world')
+        result = runner.invoke(args=['blogly', 'rerender'])
+        self.assertIn('Rendered 0 posts', result.output)
+        result = runner.invoke(args=['blogly', 'rerender', '--force'])
+        self.assertIn('Rendered 1 posts', result.output)
@@ -1,11 +1,11 @@
 from unittest import TestCase
 
-from app import app
+from app import create_app
 from models import db, User, Post, Tag, PostTag
 from sqlalchemy.sql import func, desc, asc
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql:///blogly_test'
-app.config['SQLALCHEMY_ECHO'] = False
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
 
 db.drop_all()
 db.create_all()
@@ -0,0 +1,188 @@
+from unittest import TestCase, skipUnless
+from unittest import mock
+import os
+import tempfile
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from ratelimit import MemoryBuckets, SharedBuckets, rate_limiter, fcntl
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class BucketsTestCase(TestCase):
+    """Tests for the token buckets"""
+
+    def make(self, clock):
+        return MemoryBuckets(clock=clock)
+
+    def test_burst_then_refill(self):
+        clock = Clock()
+        buckets = self.make(clock)
+        limits = [('a', 2.0, 3)]
+        self.assertEqual([buckets.hit(limits) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(buckets.hit(limits), 0.5)
+        clock.now += 0.5
+        self.assertEqual(buckets.hit(limits), 0)
+        self.assertAlmostEqual(buckets.hit(limits), 0.5)
+        clock.now += 100
+        self.assertEqual([buckets.hit(limits) for _ in range(3)], [0, 0, 0])
+
+    def test_refused_hit_takes_nothing(self):
+        clock = Clock()
+        buckets = self.make(clock)
+        buckets.hit([('ip', 1.0, 1)])
+        self.assertAlmostEqual(buckets.hit([('route', 1.0, 1), ('ip', 1.0, 1)]), 1)
+        # route still has its token
+        self.assertEqual(buckets.hit([('route', 1.0, 1)]), 0)
+
+    def test_keys_are_separate(self):
+        buckets = self.make(Clock())
+        self.assertEqual(buckets.hit([('a', 1.0, 1)]), 0)
+        self.assertEqual(buckets.hit([('b', 1.0, 1)]), 0)
+        self.assertGreater(buckets.hit([('a', 1.0, 1)]), 0)
+
+
+class MemoryBucketsTestCase(TestCase):
+    """Tests for the in-process backend"""
+
+    def test_prunes_refilled_buckets(self):
+        clock = Clock()
+        buckets = MemoryBuckets(max_keys=10, clock=clock)
+        for i in range(10):
+            buckets.hit([(f'old{i}', 1.0, 5)])
+        clock.now += 10
+        buckets.hit([('busy', 1.0, 5)])
+        buckets.hit([('new', 1.0, 5)])
+        self.assertEqual(set(buckets._buckets), {'busy', 'new'})
+
+    def test_prunes_soonest_full_when_all_are_busy(self):
+        clock = Clock()
+        buckets = MemoryBuckets(max_keys=10, clock=clock)
+        for i in range(11):
+            buckets.hit([(f'key{i}', 1.0 + i, 5)])
+        self.assertEqual(len(buckets._buckets), 10)
+        self.assertNotIn('key10', buckets._buckets)
+
+
+@skipUnless(fcntl, 'fcntl is not available')
+class SharedBucketsTestCase(BucketsTestCase):
+    """Tests for the backend shared between processes"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(prefix='blogly-ratelimit-')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def make(self, clock):
+        return SharedBuckets(self.path, slots=64, clock=clock)
+
+    def test_processes_share_buckets(self):
+        clock = Clock()
+        first, second = self.make(clock), self.make(clock)
+        self.assertEqual(first.hit([('a', 1.0, 2)]), 0)
+        self.assertEqual(second.hit([('a', 1.0, 2)]), 0)
+        self.assertGreater(first.hit([('a', 1.0, 2)]), 0)
+        second.clear()
+        self.assertEqual(first.hit([('a', 1.0, 2)]), 0)
+
+    def test_full_set_reuses_the_oldest_slot(self):
+        clock = Clock()
+        buckets = SharedBuckets(self.path, slots=4, clock=clock)
+        for i in range(4):
+            buckets.hit([(f'key{i}', 1.0, 1)])
+            clock.now += 0.1
+        buckets.hit([('key4', 1.0, 1)])
+        # key0 was evicted and starts full again; key3 is still empty
+        self.assertEqual(buckets.hit([('key0', 1.0, 1)]), 0)
+        self.assertGreater(buckets.hit([('key3', 1.0, 1)]), 0)
+
+
+class RateLimitedRoutesTestCase(TestCase):
+    """Tests for refusing write requests over the limits"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        rate_limiter.backend.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        db.session.commit()
+        self.config = mock.patch.dict(app.config, {
+            'RATELIMIT_ENABLED': True, 'RATELIMIT_RATE': 0.01,
+            'RATELIMIT_BURST': 2, 'RATELIMIT_IP_RATE': 0.01,
+            'RATELIMIT_IP_BURST': 3,
+            'RATELIMIT_ROUTES': {'blogly.delete_user': (0.01, 1)}})
+        self.config.start()
+
+    def tearDown(self):
+        self.config.stop()
+        rate_limiter.backend.clear()
+        db.session.rollback()
+
+    def add_user(self, client, name='Limited', **kwargs):
+        return client.post('/users/new', data={
+            'first_name': name, 'last_name': 'User', 'image_url': ''}, **kwargs)
+
+    def test_route_limit(self):
+        with app.test_client() as client:
+            statuses = [self.add_user(client).status_code for _ in range(3)]
+            self.assertEqual(statuses, [302, 302, 429])
+            resp = self.add_user(client)
+            self.assertEqual(resp.status_code, 429)
+            self.assertEqual(resp.headers['Retry-After'], '100')
+            self.assertIn('Too Many Requests', resp.get_data(as_text=True))
+            # Reads are not limited
+            self.assertEqual(client.get('/users').status_code, 200)
+        self.assertEqual(User.query.filter_by(first_name='Limited').count(), 2)
+
+    def test_ip_limit_spans_routes(self):
+        with app.test_client() as client:
+            self.add_user(client)
+            self.add_user(client)
+            user_id = User.query.filter_by(first_name='Limited').first().id
+            resp = client.post(f'/users/{user_id}/delete')
+            self.assertEqual(resp.status_code, 302)
+            resp = client.post(f'/users/{user_id}/delete')
+            self.assertEqual(resp.status_code, 429)
+
+    def test_route_overrides(self):
+        with mock.patch.dict(app.config, {'RATELIMIT_IP_BURST': 100}), \
+                app.test_client() as client:
+            self.add_user(client, 'First')
+            self.add_user(client, 'Second')
+            ids = [user.id for user in User.query]
+            self.assertEqual(client.post(f'/users/{ids[0]}/delete').status_code, 302)
+            # delete_user allows a burst of one
+            self.assertEqual(client.post(f'/users/{ids[1]}/delete').status_code, 429)
+            self.assertEqual(client.post('/tags/new', data={'name': 'T'}).status_code,
+                             302)
+
+    def test_clients_are_separate(self):
+        with app.test_client() as client:
+            for _ in range(3):
+                self.add_user(client)
+            resp = self.add_user(client, environ_base={'REMOTE_ADDR': '10.0.0.9'})
+        self.assertEqual(resp.status_code, 302)
+
+    def test_exempt_clients(self):
+        with mock.patch.dict(app.config, {'RATELIMIT_EXEMPT': ['127.0.0.1']}):
+            with app.test_client() as client:
+                statuses = {self.add_user(client).status_code for _ in range(5)}
+        self.assertEqual(statuses, {302})
@@ -0,0 +1,171 @@
+from unittest import TestCase
+from unittest import mock
+import random
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag, RelatedPost
+from cache import fragment_cache
+from queries import count_queries
+from tagging import sync_post_tags
+import related
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+WEIGHTS = related.weights
+
+
+def fixed_weights(tag_ids=None, total=None):
+    """Weights that do not move as tags gain posts, so lists kept up to
+    date one write at a time match a rebuild"""
+    return {tag_id: 1.0 + tag_id % 4 for tag_id in WEIGHTS(tag_ids, total)}
+
+
+class RelatedPostsTestCase(TestCase):
+    """Tests for the precomputed related posts"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        self.context = app.app_context()
+        self.context.push()
+        RelatedPost.query.delete()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        self.tags = [Tag(name=name) for name in ('common', 'rare', 'other')]
+        self.posts = [Post(title=f'POST_{i}', content='Content', user=user)
+                      for i in range(4)]
+        db.session.add_all([user, *self.tags, *self.posts])
+        db.session.commit()
+        self.user_id = user.id
+        self.tag_ids = [tag.id for tag in self.tags]
+        self.post_ids = [post.id for post in self.posts]
+        common, rare, other = self.tag_ids
+        first, second, third, fourth = self.post_ids
+        # first shares common with second and third, rare only with fourth
+        for post_id, tag_ids in ((first, [common, rare]), (second, [common]),
+                                 (third, [common, other]), (fourth, [rare])):
+            sync_post_tags(post_id, tag_ids)
+        db.session.commit()
+        related.rebuild()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def lists(self):
+        """{post id: [(related id, score)]} as stored, best first"""
+        found = {}
+        for row in (RelatedPost.query.order_by(RelatedPost.post_id,
+                                               RelatedPost.score.desc(),
+                                               RelatedPost.related_id.desc())):
+            found.setdefault(row.post_id, []).append(
+                (row.related_id, round(row.score, 6)))
+        return found
+
+    def test_rare_tags_count_for_more(self):
+        first, second, third, fourth = self.post_ids
+        self.assertEqual([other for other, _ in related.scores(first)],
+                         [fourth, third, second])
+        self.assertEqual([post.id for post in db.session.get(Post, first).related],
+                         [fourth, third, second])
+
+    def test_count_and_common_tags(self):
+        first, second, third, fourth = self.post_ids
+        with mock.patch.dict(app.config, {'RELATED_POSTS': 1}):
+            related.rebuild()
+        self.assertEqual(self.lists()[first], [(fourth, mock.ANY)])
+        with mock.patch.dict(app.config, {'RELATED_MAX_TAG_POSTS': 2}):
+            related.rebuild()
+        # common is on three posts: only rare links anything now
+        self.assertEqual(set(self.lists()), {first, fourth})
+
+    def test_post_page_shows_related(self):
+        first, second, third, fourth = self.post_ids
+        with app.test_client() as client:
+            html = client.get(f'/posts/{first}').get_data(as_text=True)
+        self.assertIn('Related posts', html)
+        self.assertIn(f'<a href="/posts/{fourth}">POST_3</a>', html)
+
+    def test_routes_keep_lists_current(self):
+        first, second, third, fourth = self.post_ids
+        common, rare, other = self.tag_ids
+        with app.test_client() as client:
+            client.post(f'/posts/{second}/edit',
+                        data={'title': '', 'content': '', str(other): 'on'})
+            self.assertEqual([o for o, _ in self.lists()[second]], [third])
+            self.assertNotIn(second, [o for o, _ in self.lists()[first]])
+
+            client.post(f'/posts/{fourth}/delete')
+            self.assertEqual([o for o, _ in self.lists()[first]], [third])
+
+            client.post(f'/tags/{common}/delete')
+            self.assertNotIn(first, self.lists())
+
+            client.post(f'/users/{self.user_id}/posts/new',
+                        data={'title': 'NEW', 'content': 'New', str(other): 'on'})
+        new = Post.query.filter_by(title='NEW').one().id
+        self.assertEqual(dict(self.lists()[third]).keys(), {new, second})
+
+    def test_updates_match_rebuild(self):
+        rng = random.Random(0)
+        tags = [Tag(name=f'TAG_{i}') for i in range(6)]
+        posts = [Post(title=f'MORE_{i}', content='Content', user_id=self.user_id)
+                 for i in range(15)]
+        db.session.add_all(tags + posts)
+        db.session.commit()
+        post_ids = self.post_ids + [post.id for post in posts]
+        tag_ids = self.tag_ids + [tag.id for tag in tags]
+        with mock.patch.object(related, 'weights', fixed_weights), \
+                mock.patch.dict(app.config, {'RELATED_POSTS': 3}):
+            related.rebuild()
+            for _ in range(40):
+                post_id = rng.choice(post_ids)
+                sync_post_tags(post_id, rng.sample(tag_ids, rng.randint(0, 3)))
+                related.update([post_id])
+                db.session.commit()
+            updated = self.lists()
+            related.rebuild()
+            self.assertEqual(updated, self.lists())
+
+    def test_update_queries_do_not_grow_with_posts(self):
+        other = self.tag_ids[2]
+        posts = [Post(title=f'MORE_{i}', content='Content', user_id=self.user_id)
+                 for i in range(40)]
+        db.session.add_all(posts)
+        db.session.flush()
+        db.session.execute(PostTag.__table__.insert(), [
+            {'post_id': post.id, 'tag_id': other} for post in posts])
+        db.session.commit()
+        post_ids = self.post_ids + [post.id for post in posts]
+        with count_queries() as counter:
+            related.update(post_ids)
+        # A handful per chunk of posts, not a few per post
+        self.assertLessEqual(len(counter), 10)
+        updated = self.lists()
+        related.rebuild()
+        self.assertEqual(updated, self.lists())
+
+    def test_numpy_and_python_agree(self):
+        if related.np is None:
+            self.skipTest('NumPy and SciPy are not installed')
+        rng = random.Random(1)
+        pairs = {(rng.randint(1, 300), rng.randint(1, 40)) for _ in range(900)}
+        weights = {tag_id: rng.choice([0.5, 1.0, 2.0, 3.5]) for tag_id in range(1, 41)}
+        with_numpy = list(related.top_related(pairs, weights, 4))
+        with mock.patch.object(related, 'np', None):
+            without = list(related.top_related(pairs, weights, 4))
+        self.assertEqual(with_numpy, without)
+
+    def test_rebuild_command(self):
+        RelatedPost.query.delete()
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=['blogly', 'rebuild-related'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('with 8 rows', result.output)
@@ -0,0 +1,121 @@
+from unittest import TestCase
+import os
+import tempfile
+import time
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from replicas import replica_router, measure_lag, STICKY_KEY
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+REPLICA_PATH = os.path.join(tempfile.gettempdir(), 'blogly_replica_test.db')
+
+
+class ReplicaConfig(TestingConfig):
+    REPLICA_URLS = [f'sqlite:///{REPLICA_PATH}']
+    REPLICA_LAG_CHECK_SECONDS = 0
+
+
+replica_app = create_app(ReplicaConfig)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Tests for sending read-only views to a replica"""
+
+    def setUp(self):
+        """The primary and the replica each hold a user the other lacks"""
+        fragment_cache.clear()
+        replica_router.reset()
+        replica_router.measure_lag = measure_lag
+        self.context = replica_app.app_context()
+        self.context.push()
+        self.replica = db.get_engine(replica_app, bind='replica0')
+        db.Model.metadata.drop_all(bind=self.replica)
+        db.Model.metadata.create_all(bind=self.replica)
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Primary', last_name='Only')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        with self.replica.begin() as connection:
+            connection.execute(User.__table__.insert(),
+                               {'id': user.id, 'first_name': 'Replica',
+                                'last_name': 'Only', 'image_url': ''})
+
+    def tearDown(self):
+        db.session.rollback()
+        replica_router.measure_lag = measure_lag
+        self.context.pop()
+
+    def get(self, client, path):
+        return client.get(path).get_data(as_text=True)
+
+    def test_marked_views_read_the_replica(self):
+        with replica_app.test_client() as client:
+            html = self.get(client, '/users')
+            self.assertIn('Replica Only', html)
+            self.assertNotIn('Primary Only', html)
+            self.assertIn('Replica Only', self.get(client, f'/users/{self.user_id}'))
+
+    def test_other_views_read_the_primary(self):
+        with replica_app.test_client() as client:
+            html = self.get(client, f'/users/{self.user_id}/edit')
+        self.assertIn('Primary', html)
+
+    def test_primary_after_a_write(self):
+        with replica_app.test_client() as client:
+            resp = client.post('/users/new', data={'first_name': 'Just',
+                                                   'last_name': 'Written',
+                                                   'image_url': ''},
+                               follow_redirects=True)
+            html = resp.get_data(as_text=True)
+            self.assertIn('Just Written', html)
+            self.assertIn('Primary Only', html)
+            with client.session_transaction() as session:
+                self.assertGreater(session[STICKY_KEY], time.time())
+                session[STICKY_KEY] = time.time() - 1
+            html = self.get(client, '/users')
+            self.assertNotIn('Just Written', html)
+            self.assertIn('Replica Only', html)
+
+    def test_lagging_replica_is_skipped(self):
+        replica_router.measure_lag = lambda engine: 60.0
+        with replica_app.test_client() as client:
+            self.assertIn('Primary Only', self.get(client, '/users'))
+
+    def test_unreachable_replica_is_skipped(self):
+        def unreachable(engine):
+            raise OSError('connection refused')
+        replica_router.measure_lag = unreachable
+        with replica_app.test_client() as client:
+            self.assertIn('Primary Only', self.get(client, '/users'))
+
+    def test_fresh_changes_are_not_cached_from_replica(self):
+        fragment_cache.invalidate('users')
+        replica_app.config['REPLICA_LAG_CHECK_SECONDS'] = 60
+        try:
+            with replica_app.test_client() as client:
+                self.get(client, '/')
+                self.get(client, '/')
+        finally:
+            replica_app.config['REPLICA_LAG_CHECK_SECONDS'] = 0
+        self.assertEqual(fragment_cache.stats()['fragments']['home'],
+                         {'hits': 0, 'misses': 2})
+
+    def test_no_replicas_configured(self):
+        with app.test_client() as client:
+            client.post('/users/new', data={'first_name': 'Just',
+                                            'last_name': 'Written',
+                                            'image_url': ''})
+            with client.session_transaction() as session:
+                self.assertNotIn(STICKY_KEY, session)
@@ -0,0 +1,268 @@
+from unittest import TestCase, skipUnless
+import os
+import re
+import tempfile
+
+from sqlalchemy import (event, inspect, Column, DateTime, ForeignKey, Integer,
+                        MetaData, String, Table)
+
+from app import create_app
+from config import TestingConfig
+from models import db, Tag
+import feed
+import schema
+import seed
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+LISTING_INDEXES = ['ix_users_last_name_first_name_id', 'ix_posts_title_id',
+                   'ix_posts_created_at_id', 'ix_posts_user_id_created_at_id',
+                   'ix_posts_tags_tag_id_post_id', 'ix_tags_post_count_name']
+
+
+# The tables as db.create_all() made them before there were migrations
+BASELINE = MetaData()
+Table('users', BASELINE,
+      Column('id', Integer, primary_key=True, autoincrement=True),
+      Column('first_name', String(50), nullable=False),
+      Column('last_name', String(50), nullable=False),
+      Column('image_url', String, nullable=False))
+Table('posts', BASELINE,
+      Column('id', Integer, primary_key=True, autoincrement=True),
+      Column('title', String(50), nullable=False),
+      Column('content', String(5000), nullable=False),
+      Column('created_at', DateTime(timezone=True)),
+      Column('user_id', Integer, ForeignKey(
+          'users.id', onupdate='CASCADE', ondelete='CASCADE')))
+Table('tags', BASELINE,
+      Column('id', Integer, primary_key=True, autoincrement=True),
+      Column('name', String(50), nullable=False, unique=True))
+Table('posts_tags', BASELINE,
+      Column('post_id', Integer, ForeignKey(
+          'posts.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True),
+      Column('tag_id', Integer, ForeignKey(
+          'tags.id', onupdate='CASCADE', ondelete='CASCADE'), primary_key=True))
+
+
+def file_app(path):
+    """An app on its own SQLite file"""
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    return create_app(FileConfig)
+
+
+def describe(engine):
+    """Tables, columns, indexes and triggers of a database"""
+    inspector = inspect(engine)
+    tables = {}
+    for table in inspector.get_table_names():
+        if table == schema.VERSION_TABLE:
+            continue
+        tables[table] = (
+            sorted((c['name'], str(c['type']), c['nullable'])
+                   for c in inspector.get_columns(table)),
+            sorted((i['name'], tuple(i['column_names']), bool(i['unique']))
+                   for i in inspector.get_indexes(table)),
+            inspector.get_pk_constraint(table)['constrained_columns'],
+            sorted(fk['referred_table'] for fk in inspector.get_foreign_keys(table)))
+    with engine.connect() as connection:
+        triggers = sorted(connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'").scalars())
+    return tables, triggers
+
+
+@skipUnless(schema.available(), 'Alembic is not installed')
+class MigrationsTestCase(TestCase):
+    """Tests for the migrations in migrations/versions"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.app = file_app(os.path.join(self.directory.name, 'migrated.db'))
+        self.engine = db.get_engine(self.app)
+
+    def tearDown(self):
+        self.engine.dispose()
+        db.app = app
+        self.directory.cleanup()
+
+    def test_migrations_build_the_models_schema(self):
+        schema.init_db(app=self.app)
+        self.assertEqual(schema.current(self.app), '0010')
+        created = file_app(os.path.join(self.directory.name, 'created.db'))
+        db.create_all(app=created)
+        self.assertEqual(describe(self.engine), describe(db.get_engine(created)))
+        db.get_engine(created).dispose()
+
+    def test_downgrade_removes_everything(self):
+        schema.init_db(app=self.app)
+        schema.downgrade('base', app=self.app)
+        self.assertEqual(inspect(self.engine).get_table_names(),
+                         [schema.VERSION_TABLE])
+
+    def keep_a_user(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                "INSERT INTO users (first_name, last_name, image_url) "
+                "VALUES ('Kept', 'User', '')")
+
+    def count_users(self):
+        with self.engine.connect() as connection:
+            return connection.exec_driver_sql('SELECT count(*) FROM users').scalar()
+
+    def test_migrate_stamps_a_created_database(self):
+        """A database made by today's db.create_all() is stamped head"""
+        db.create_all(app=self.app)
+        self.keep_a_user()
+        self.assertEqual(schema.upgrade(app=self.app), '0010')
+        self.assertEqual(schema.current(self.app), '0010')
+        self.assertEqual(self.count_users(), 1)
+
+    def test_migrate_stamps_an_initial_database(self):
+        """A database made by db.create_all() before there were migrations
+        gets the later changes without its tables being created again"""
+        schema.upgrade(schema.INITIAL, app=self.app)
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(f'DROP TABLE {schema.VERSION_TABLE}')
+        self.keep_a_user()
+        self.assertEqual(schema.upgrade(app=self.app), '0001')
+        self.assertEqual(schema.current(self.app), '0010')
+        names = {index['name'] for table in ('users', 'posts', 'posts_tags', 'tags')
+                 for index in inspect(self.engine).get_indexes(table)}
+        self.assertLessEqual(set(LISTING_INDEXES), names)
+        self.assertEqual(self.count_users(), 1)
+
+    def test_migrate_upgrades_a_baseline_database(self):
+        """The tables db.create_all() made before there were migrations get
+        every later revision, their tag counts and their feeds"""
+        BASELINE.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                "INSERT INTO users (id, first_name, last_name, image_url) "
+                "VALUES (1, 'Kept', 'User', '')")
+            connection.exec_driver_sql(
+                "INSERT INTO posts (id, title, content, created_at, user_id) "
+                "VALUES (1, 'First', 'Hello', '2026-01-01 00:00:00', 1), "
+                "(2, 'Second', 'Again', '2026-01-02 00:00:00', 1)")
+            connection.exec_driver_sql(
+                "INSERT INTO tags (id, name) VALUES (1, 'jazz'), (2, 'rock')")
+            connection.exec_driver_sql(
+                "INSERT INTO posts_tags (post_id, tag_id) "
+                "VALUES (1, 1), (2, 1), (2, 2)")
+        self.assertEqual(schema.upgrade(app=self.app), '0001')
+        self.assertEqual(schema.current(self.app), '0010')
+        with self.engine.connect() as connection:
+            counts = connection.exec_driver_sql(
+                'SELECT name, post_count FROM tags ORDER BY name').fetchall()
+            scopes = connection.exec_driver_sql(
+                'SELECT scope, count(*) FROM feed_entries '
+                'GROUP BY scope ORDER BY scope').fetchall()
+        self.assertEqual(counts, [('jazz', 2), ('rock', 1)])
+        self.assertEqual(scopes, [('global', 2), ('tag:1', 2), ('tag:2', 1),
+                                  ('user:1', 2)])
+        # The triggers keep the backfilled counts current
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DELETE FROM posts_tags WHERE post_id = 2')
+            counts = connection.exec_driver_sql(
+                'SELECT name, post_count FROM tags ORDER BY name').fetchall()
+        self.assertEqual(counts, [('jazz', 1), ('rock', 0)])
+
+    def test_migrate_refuses_an_unknown_schema(self):
+        db.create_all(app=self.app)
+        with self.engine.begin() as connection:
+            for name in LISTING_INDEXES:
+                connection.exec_driver_sql(f'DROP INDEX {name}')
+        with self.assertRaises(schema.UnknownSchema):
+            schema.upgrade(app=self.app)
+        self.assertIsNone(schema.current(self.app))
+        result = self.app.test_cli_runner().invoke(args=['blogly', 'migrate'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('stamp', result.output)
+
+    def test_init_db_command(self):
+        result = self.app.test_cli_runner().invoke(
+            args=['blogly', 'init-db', '--drop'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(schema.current(self.app), '0010')
+        result = self.app.test_cli_runner().invoke(args=['blogly', 'migrate'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('from 0010 to 0010', result.output)
+
+
+class IndexUsageTestCase(TestCase):
+    """Every read route's queries find their rows through an index"""
+
+    # The SQLite search fallback reads every post into memory by design
+    SQLITE_PATHS = ['/', '/users', '/users/1', '/users/1?after=WzAsIDBd',
+                    '/users/1/edit', '/users/1/posts/new', '/posts',
+                    '/posts/5', '/posts/5/edit', '/tags', '/tags/cloud',
+                    '/tags/{tag_id}', '/tags/{tag_id}/edit', '/api/v1/users',
+                    '/api/v1/users/1?include=posts',
+                    '/api/v1/posts?include=tags,user', '/api/v1/posts/5',
+                    '/api/v1/tags', '/api/v1/tags/{tag_id}?include=posts']
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+        seed.seed_synthetic(users=20, posts=300, tags=10, fanout=3, seed=1,
+                            chunk_size=100)
+        feed.rebuild()
+        self.tag_id = Tag.query.order_by(Tag.id).first().id
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.context.pop()
+
+    def statements(self, path):
+        """The SELECTs a GET of path runs"""
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            with app.test_client() as client:
+                resp = client.get(path)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(resp.status_code, 200, path)
+        return statements
+
+    def full_scans(self, connection, statement, parameters):
+        """Tables the statement reads without an index"""
+        if connection.dialect.name == 'postgresql':
+            # With sequential scans priced out, one left means no index fits
+            connection.exec_driver_sql('SET enable_seqscan = off')
+            plan = connection.exec_driver_sql(
+                f'EXPLAIN {statement}', parameters).scalars()
+            return [m.group(1) for line in plan
+                    for m in [re.search(r'Seq Scan on (\w+)', line)] if m]
+        plan = connection.exec_driver_sql(
+            f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+        scans = []
+        for row in plan:
+            m = re.fullmatch(r'SCAN (\w+)(?: AS \w+)?', row[-1])
+            # Walking a table in rowid order is its primary key index
+            if m and not re.search(rf'ORDER BY {m.group(1)}\.id\b', statement):
+                scans.append(m.group(1))
+        return scans
+
+    def test_routes_use_indexes(self):
+        paths = self.SQLITE_PATHS
+        if db.engine.dialect.name == 'postgresql':
+            paths = paths + ['/search?q=jazz']
+        for path in paths:
+            path = path.format(tag_id=self.tag_id)
+            statements = self.statements(path)
+            with db.engine.connect() as connection:
+                for statement, parameters in statements:
+                    with self.subTest(path=path, statement=statement):
+                        self.assertEqual(
+                            self.full_scans(connection, statement, parameters), [])
@@ -0,0 +1,93 @@
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+from search import InvertedIndex, highlight
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class InvertedIndexTestCase(TestCase):
+    """Tests for the pure-Python search fallback"""
+
+    def test_ranks_title_matches_first(self):
+        index = InvertedIndex()
+        index.add(1, 'Jazz', 'Practice scales')
+        index.add(2, 'Practice', 'More jazz today')
+        index.add(3, 'Cooking', 'Nothing here')
+        self.assertEqual([doc for doc, score in index.search('jazz')], [1, 2])
+
+    def test_all_terms_required(self):
+        index = InvertedIndex()
+        index.add(1, 'Jazz', 'Practice scales')
+        index.add(2, 'Jazz', 'Listening')
+        self.assertEqual([doc for doc, score in index.search('jazz scales')], [1])
+
+    def test_remove(self):
+        index = InvertedIndex()
+        index.add(1, 'Jazz', 'Practice')
+        index.remove(1)
+        self.assertEqual(index.search('jazz'), [])
+        self.assertEqual(len(index), 0)
+
+    def test_highlight_escapes(self):
+        html = highlight('<b>jazz</b> time', {'jazz'})
+        self.assertEqual(html, '&lt;b&gt;<mark>jazz</mark>&lt;/b&gt; time')
+
+
+class SearchViewsTestCase(TestCase):
+    """Tests for /search and /search.json"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Sonny', last_name='Rollins')
+        other = User(first_name='Test_First', last_name='Test_Last')
+        jazz = Post(title='Jazz Time', content='Time to practice my saxophone!',
+                    user=user)
+        other_post = Post(title='Saxophone repairs',
+                          content='Fixing a saxophone', user=other)
+        tag = Tag(name='Music')
+        jazz.tags.append(tag)
+        db.session.add_all([user, other, other_post])
+        db.session.commit()
+        self.user_id = user.id
+        self.tag_id = tag.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_search_page(self):
+        with app.test_client() as client:
+            resp = client.get('/search?q=saxophone')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('<mark>saxophone</mark>', html)
+            self.assertIn('Jazz Time', html)
+            self.assertIn('<mark>Saxophone</mark> repairs', html)
+
+    def test_search_json_filters(self):
+        with app.test_client() as client:
+            resp = client.get(f'/search.json?q=saxophone&tag={self.tag_id}')
+            data = resp.get_json()
+            self.assertEqual([r['title'] for r in data['results']], ['Jazz Time'])
+            resp = client.get(f'/search.json?q=saxophone&user={self.user_id}')
+            data = resp.get_json()
+            self.assertEqual([r['title'] for r in data['results']], ['Jazz Time'])
+
+    def test_search_paginates(self):
+        with app.test_client() as client:
+            data = client.get('/search.json?q=saxophone&per_page=1').get_json()
+            self.assertEqual(len(data['results']), 1)
+            self.assertTrue(data['has_next'])
+            data = client.get('/search.json?q=saxophone&per_page=1&page=2').get_json()
+            self.assertEqual(len(data['results']), 1)
+            self.assertFalse(data['has_next'])
@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+import seed
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class SeedTestCase(TestCase):
+    """Tests for the synthetic data generator"""
+
+    def setUp(self):
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_generated_posts_are_deterministic(self):
+        first = list(seed.generate_posts(50, 5, 10, 2, seed=7))
+        again = list(seed.generate_posts(50, 5, 10, 2, seed=7))
+        other = list(seed.generate_posts(50, 5, 10, 2, seed=8))
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertEqual([p['id'] for p in first], list(range(1, 51)))
+        times = [p['created_at'] for p in first]
+        self.assertEqual(times, sorted(times))
+        for post in first:
+            self.assertIn(post['user_id'], range(1, 6))
+            self.assertLessEqual(len(post['tags']), 4)
+            self.assertLessEqual(len(post['title']), 50)
+
+    def test_tag_names_are_unique(self):
+        names = [seed.tag_name(n) for n in range(500)]
+        self.assertEqual(len(set(names)), 500)
+
+    def test_seed_synthetic_loads_every_table(self):
+        seed.seed_synthetic(users=10, posts=200, tags=8, fanout=3, seed=1,
+                            chunk_size=64)
+        self.assertEqual(User.query.count(), 10)
+        self.assertEqual(Post.query.count(), 200)
+        self.assertEqual(Tag.query.count(), 8)
+        links = PostTag.query.count()
+        self.assertGreater(links, 200)
+        self.assertLess(links, 200 * 6)
+        # User 1 is the most prolific author
+        counts = dict(db.session.query(Post.user_id, db.func.count())
+                      .group_by(Post.user_id).all())
+        self.assertEqual(max(counts, key=counts.get), 1)
@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from queries import count_queries
+from tagging import sync_post_tags, sync_tag_posts, reconcile_post_counts
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class TagSyncTestCase(TestCase):
+    """Tests for bulk syncing of posts_tags"""
+
+    def setUp(self):
+        """Add a user with posts and some tags"""
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        self.posts = [Post(title=f'Post_{i}', content='Content', user=user)
+                      for i in range(20)]
+        self.tags = [Tag(name=f'Tag_{i}') for i in range(20)]
+        db.session.add(user)
+        db.session.add_all(self.tags)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any bad transactions"""
+        db.session.rollback()
+
+    def tag_ids_of(self, post):
+        return {row.tag_id for row in PostTag.query.filter_by(post_id=post.id)}
+
+    def test_sync_post_tags_diff(self):
+        """Only the difference is inserted and deleted"""
+        post = self.posts[0]
+        ids = [tag.id for tag in self.tags]
+        sync_post_tags(post.id, ids[:3])
+        diff = sync_post_tags(post.id, ids[1:4])
+        db.session.commit()
+        self.assertEqual(diff.added, {ids[3]})
+        self.assertEqual(diff.removed, {ids[0]})
+        self.assertEqual(self.tag_ids_of(post), set(ids[1:4]))
+
+    def test_sync_ignores_unknown_ids(self):
+        post = self.posts[0]
+        sync_post_tags(post.id, [self.tags[0].id, 999999])
+        db.session.commit()
+        self.assertEqual(self.tag_ids_of(post), {self.tags[0].id})
+
+    def test_sync_tag_posts_scope(self):
+        """Posts outside the scope keep their association"""
+        tag = self.tags[0]
+        ids = [post.id for post in self.posts]
+        sync_tag_posts(tag.id, ids)
+        sync_tag_posts(tag.id, [ids[0]], scope=ids[:5])
+        db.session.commit()
+        tagged = {row.post_id for row in PostTag.query.filter_by(tag_id=tag.id)}
+        self.assertEqual(tagged, {ids[0]} | set(ids[5:]))
+
+    def test_sync_query_count_is_constant(self):
+        """Tagging many posts does not cost a query per post"""
+        tag_id = self.tags[0].id
+        ids = [post.id for post in self.posts]
+        with count_queries() as counter:
+            sync_tag_posts(tag_id, ids)
+        self.assertLessEqual(len(counter), 3)
+
+
+class PostCountTestCase(TestCase):
+    """Tests for the trigger-maintained Tag.post_count"""
+
+    def setUp(self):
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        self.user = User(first_name='Test_First', last_name='Test_Last')
+        self.other = User(first_name='Other_First', last_name='Other_Last')
+        self.posts = [Post(title=f'Post_{i}', content='Content',
+                           user=self.user if i < 3 else self.other)
+                      for i in range(5)]
+        self.tags = [Tag(name=f'Tag_{i}') for i in range(3)]
+        db.session.add_all([self.user, self.other, *self.tags])
+        db.session.commit()
+        self.tag_ids = [tag.id for tag in self.tags]
+        for post in self.posts:
+            sync_post_tags(post.id, self.tag_ids[:2])
+        sync_post_tags(self.posts[0].id, self.tag_ids)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self):
+        db.session.expire_all()
+        return [db.session.get(Tag, tag_id).post_count for tag_id in self.tag_ids]
+
+    def test_inserts_and_deletes_are_counted(self):
+        self.assertEqual(self.counts(), [5, 5, 1])
+        sync_post_tags(self.posts[1].id, [self.tag_ids[2]])
+        db.session.commit()
+        self.assertEqual(self.counts(), [4, 4, 2])
+
+    def test_cascades_from_post_and_user_deletes(self):
+        Post.query.filter_by(id=self.posts[0].id).delete()
+        db.session.commit()
+        self.assertEqual(self.counts(), [4, 4, 0])
+        User.query.filter_by(id=self.other.id).delete()
+        db.session.commit()
+        self.assertEqual(self.counts(), [2, 2, 0])
+
+    def test_reconcile_repairs_drift(self):
+        db.session.execute(Tag.__table__.update().values(post_count=42))
+        db.session.commit()
+        self.assertEqual(reconcile_post_counts(batch_size=2, dry_run=True), 3)
+        self.assertEqual(self.counts(), [42, 42, 42])
+        self.assertEqual(reconcile_post_counts(batch_size=2), 3)
+        self.assertEqual(self.counts(), [5, 5, 1])
+        self.assertEqual(reconcile_post_counts(), 0)
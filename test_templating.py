@@ -0,0 +1,126 @@
+from unittest import TestCase
+import os
+import tempfile
+
+from app import create_app
+from config import TestingConfig
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class BytecodeCacheTestCase(TestCase):
+    """Tests for the Jinja bytecode cache"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        class CachedConfig(TestingConfig):
+            TEMPLATE_BYTECODE_CACHE = True
+            TEMPLATE_CACHE_DIR = self.directory.name
+        self.config = CachedConfig
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_testing_profile_has_no_cache(self):
+        self.assertIsNone(app.jinja_env.bytecode_cache)
+
+    def test_warm_then_load_without_compiling(self):
+        warm_app = create_app(self.config)
+        result = warm_app.test_cli_runner().invoke(args=['blogly', 'warm-templates'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Compiled', result.output)
+        files = os.listdir(self.directory.name)
+        self.assertTrue(files)
+        self.assertTrue(all(name.startswith('blogly-') for name in files))
+
+        def compile(*args, **kwargs):
+            raise AssertionError('template compiled again')
+        cold_app = create_app(self.config)
+        cold_app.jinja_env.compile = compile
+        cold_app.jinja_env.get_template('new_post.html')
+        cold_app.jinja_env.get_template('base.html')
+
+    def test_warm_refuses_without_cache(self):
+        result = app.test_cli_runner().invoke(args=['blogly', 'warm-templates'])
+        self.assertNotEqual(result.exit_code, 0)
+
+
+class StreamedViewsTestCase(TestCase):
+    """Tests for the streamed post forms"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        tags = [Tag(name=f'Tag_{i:03}') for i in range(120)]
+        post = Post(title='SETUP_TITLE', content='SETUP_CONTENT', user=user,
+                    tags=tags[:2])
+        db.session.add_all([user, post, *tags])
+        db.session.commit()
+        self.user_id, self.post_id = user.id, post.id
+        self.tag_ids = [tag.id for tag in tags]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_new_post_form_lists_every_tag(self):
+        with app.test_client() as client:
+            resp = client.get(f'/users/{self.user_id}/posts/new')
+            self.assertTrue(resp.is_streamed)
+            html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Add Post for Test_First Test_Last', html)
+        self.assertEqual(html.count('type="checkbox"'), 120)
+        self.assertLess(html.index('Tag_000'), html.index('Tag_119'))
+
+    def test_edit_post_form_checks_post_tags(self):
+        with app.test_client() as client:
+            html = client.get(f'/posts/{self.post_id}/edit').get_data(as_text=True)
+        self.assertEqual(html.count(' checked>'), 2)
+        self.assertIn(f'value="{self.tag_ids[0]}" checked>', html)
+        self.assertIn(f'value="{self.tag_ids[1]}" checked>', html)
+
+    def test_flash_shown_once(self):
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session['_flashes'] = [('success', 'FLASHED_ONCE')]
+            html = client.get(f'/users/{self.user_id}/posts/new').get_data(as_text=True)
+            self.assertIn('FLASHED_ONCE', html)
+            html = client.get(f'/users/{self.user_id}/posts/new').get_data(as_text=True)
+            self.assertNotIn('FLASHED_ONCE', html)
+
+
+class CollapseWhitespaceTestCase(TestCase):
+    """Tests for collapsing the whitespace of template text"""
+
+    def render(self, source, **context):
+        return app.jinja_env.from_string(source).render(**context)
+
+    def test_collapses_template_text_only(self):
+        html = self.render('<ul>\n    <li>  {{ a }}</li>\t<li>x</li>\n\n</ul>',
+                           a='kept   as   is')
+        self.assertEqual(html, '<ul>\n<li> kept   as   is</li> <li>x</li>\n</ul>')
+
+    def test_keeps_raw_elements(self):
+        source = ('<div>\n    <pre>  a\n    b</pre>\n    <textarea rows="3">\n'
+                  '  {{ c }}  </textarea>   <script>\n  let x;\n</script>\n  </div>')
+        self.assertEqual(self.render(source, c='text'),
+                         '<div>\n<pre>  a\n    b</pre>\n<textarea rows="3">\n'
+                         '  text  </textarea> <script>\n  let x;\n</script>\n</div>')
+
+    def test_off_keeps_templates_as_written(self):
+        class PlainConfig(TestingConfig):
+            TEMPLATE_COLLAPSE_WHITESPACE = False
+        plain = create_app(PlainConfig)
+        source = '<p>\n    a   b\n</p>'
+        self.assertEqual(plain.jinja_env.from_string(source).render(), source)
@@ -0,0 +1,166 @@
+from unittest import TestCase
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import create_app
+from models import db, User, Post, Tag, PostTag
+from cache import fragment_cache
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class OptimisticLockingTestCase(TestCase):
+    """Tests for refusing edits made from a stale copy"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        tag = Tag(name='SETUP_TAG')
+        post = Post(title='SETUP_TITLE', content='SETUP_CONTENT', user=user)
+        other = Post(title='OTHER_TITLE', content='OTHER_CONTENT', user=user)
+        db.session.add_all([user, tag, post, other])
+        db.session.commit()
+        self.user_id, self.tag_id = user.id, tag.id
+        self.post_id, self.other_id = post.id, other.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def version(self, model, obj_id):
+        db.session.expire_all()
+        return db.session.get(model, obj_id).version
+
+    def test_new_rows_start_at_version_one(self):
+        self.assertEqual(self.version(Post, self.post_id), 1)
+        self.assertEqual(self.version(User, self.user_id), 1)
+        self.assertEqual(self.version(Tag, self.tag_id), 1)
+
+    def test_form_carries_the_version(self):
+        with app.test_client() as client:
+            html = client.get(f'/posts/{self.post_id}/edit').get_data(as_text=True)
+        self.assertIn('name="version" value="1"', html)
+
+    def test_edit_bumps_the_version(self):
+        with app.test_client() as client:
+            resp = client.post(f'/posts/{self.post_id}/edit',
+                               data={'title': 'NEW_TITLE', 'content': '',
+                                     'version': '1'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.version(Post, self.post_id), 2)
+
+    def test_changing_only_tags_bumps_the_version(self):
+        with app.test_client() as client:
+            client.post(f'/posts/{self.post_id}/edit',
+                        data={'title': '', 'content': '', 'version': '1',
+                              str(self.tag_id): 'on'})
+        self.assertEqual(self.version(Post, self.post_id), 2)
+
+    def test_stale_post_edit_is_refused(self):
+        with app.test_client() as client:
+            client.post(f'/posts/{self.post_id}/edit',
+                        data={'title': 'FIRST_EDIT', 'content': '', 'version': '1'})
+            resp = client.post(f'/posts/{self.post_id}/edit',
+                               data={'title': 'SECOND_EDIT', 'content': 'MINE',
+                                     'version': '1', str(self.tag_id): 'on'})
+            html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 409)
+        self.assertIn('Someone else changed this', html)
+        self.assertIn('value="FIRST_EDIT"', html)
+        self.assertIn('name="version" value="2"', html)
+        self.assertIn('MINE', html)
+        post = db.session.get(Post, self.post_id)
+        self.assertEqual(post.title, 'FIRST_EDIT')
+        self.assertEqual(post.tags, [])
+
+    def test_stale_tag_edit_is_refused(self):
+        with app.test_client() as client:
+            client.post(f'/tags/{self.tag_id}/edit',
+                        data={'name': 'FIRST_NAME', 'version': '1'})
+            resp = client.post(f'/tags/{self.tag_id}/edit',
+                               data={'name': 'SECOND_NAME', 'version': '1'})
+            html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 409)
+        self.assertIn('value="FIRST_NAME"', html)
+        self.assertIn('SECOND_NAME', html)
+        self.assertEqual(db.session.get(Tag, self.tag_id).name, 'FIRST_NAME')
+
+    def test_stale_user_edit_is_refused(self):
+        with app.test_client() as client:
+            client.post(f'/users/{self.user_id}/edit',
+                        data={'first_name': 'First', 'last_name': '',
+                              'image_url': '', 'version': '1'})
+            resp = client.post(f'/users/{self.user_id}/edit',
+                               data={'first_name': 'Second', 'last_name': '',
+                                     'image_url': '', 'version': '1'})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(db.session.get(User, self.user_id).first_name, 'First')
+
+    def test_concurrent_update_is_detected(self):
+        """A row changed between reading and writing it is not overwritten"""
+        post = db.session.get(Post, self.post_id)
+        with Session(db.engine) as other:
+            other.get(Post, self.post_id).title = 'CONCURRENT'
+            other.commit()
+        post.title = 'LATE'
+        with self.assertRaises(StaleDataError):
+            db.session.flush()
+        db.session.rollback()
+        self.assertEqual(db.session.get(Post, self.post_id).title, 'CONCURRENT')
+
+
+class ItemETagTestCase(TestCase):
+    """Tests for API item ETags made from row versions"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        PostTag.query.delete()
+        Tag.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        tag = Tag(name='SETUP_TAG')
+        posts = [Post(title=f'POST_{i}', content='Content', user=user)
+                 for i in range(2)]
+        db.session.add_all([user, tag, *posts])
+        db.session.commit()
+        self.tag_id = tag.id
+        self.post_ids = [post.id for post in posts]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_edit_of_another_post_keeps_etag(self):
+        url = f'/api/v1/posts/{self.post_ids[0]}'
+        with app.test_client() as client:
+            etag = client.get(url).headers['ETag']
+            client.post(f'/posts/{self.post_ids[1]}/edit',
+                        data={'title': 'CHANGED', 'content': ''})
+            resp = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            client.post(f'/posts/{self.post_ids[0]}/edit',
+                        data={'title': 'CHANGED', 'content': ''})
+            resp = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_tag_etag_follows_post_count(self):
+        url = f'/api/v1/tags/{self.tag_id}'
+        with app.test_client() as client:
+            etag = client.get(url).headers['ETag']
+            client.post(f'/posts/{self.post_ids[0]}/edit',
+                        data={'title': '', 'content': '', str(self.tag_id): 'on'})
+            resp = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_json()['data']['post_count'], 1)
+
+    def test_missing_item(self):
+        with app.test_client() as client:
+            self.assertEqual(client.get('/api/v1/posts/999999').status_code, 404)
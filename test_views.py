@@ -0,0 +1,129 @@
+from unittest import TestCase
+from unittest import mock
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db, User, Post, PostView
+from cache import fragment_cache
+from counters import view_counter, current_hour
+import counters
+
+# Test database, no SQL echo and no debug toolbar
+app = create_app('testing')
+
+db.drop_all()
+db.create_all()
+
+
+class ViewCounterTestCase(TestCase):
+    """Tests for the written-behind view counts and the trending posts"""
+
+    def setUp(self):
+        fragment_cache.clear()
+        view_counter.clear()
+        self.context = app.app_context()
+        self.context.push()
+        PostView.query.delete()
+        Post.query.delete()
+        User.query.delete()
+        user = User(first_name='Test_First', last_name='Test_Last')
+        posts = [Post(title=f'POST_{i}', content='Content', user=user)
+                 for i in range(3)]
+        db.session.add_all([user, *posts])
+        db.session.commit()
+        self.post_ids = [post.id for post in posts]
+
+    def tearDown(self):
+        view_counter.clear()
+        db.session.rollback()
+        self.context.pop()
+
+    def views(self):
+        db.session.expire_all()
+        return {post.id: post.views for post in Post.query}
+
+    def test_views_are_not_written_per_request(self):
+        post_id = self.post_ids[0]
+        writes = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not statement.lstrip().upper().startswith('SELECT'):
+                writes.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            with app.test_client() as client:
+                for n in range(1, 4):
+                    resp = client.get(f'/posts/{post_id}')
+                    self.assertIn(f'{n} view', resp.get_data(as_text=True))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        self.assertEqual(writes, [])
+        self.assertEqual(view_counter.pending(post_id), 3)
+        self.assertEqual(self.views()[post_id], 0)
+
+    def test_flush_aggregates(self):
+        first, second, third = self.post_ids
+        for post_id in (first, first, second, first):
+            view_counter.record(post_id)
+        self.assertEqual(view_counter.flush(), 4)
+        self.assertEqual(view_counter.pending(first), 0)
+        self.assertEqual(view_counter.flush(), 0)
+        view_counter.record(first)
+        view_counter.flush()
+        self.assertEqual(self.views(), {first: 4, second: 1, third: 0})
+        rows = {(row.post_id, row.hour): row.views for row in PostView.query}
+        self.assertEqual(rows, {(first, current_hour()): 4,
+                                (second, current_hour()): 1})
+
+    def test_views_of_deleted_posts_are_dropped(self):
+        first, second = self.post_ids[:2]
+        view_counter.record(first)
+        view_counter.record(second)
+        Post.query.filter_by(id=second).delete()
+        db.session.commit()
+        self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(PostView.query.count(), 1)
+
+    def test_failed_flush_keeps_counts(self):
+        post_id = self.post_ids[0]
+        view_counter.record(post_id)
+        with mock.patch.object(counters, '_upsert', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                view_counter.flush()
+        self.assertEqual(view_counter.pending(post_id), 1)
+        self.assertEqual(self.views()[post_id], 0)
+        self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(self.views()[post_id], 1)
+
+    def test_trending_decays_and_prunes(self):
+        first, second, third = self.post_ids
+        hour = current_hour()
+        window = app.config['TRENDING_HOURS']
+        half_life = app.config['TRENDING_HALF_LIFE']
+        db.session.add_all([
+            # Many views a day ago count for less than some views now
+            PostView(post_id=first, hour=hour - 4 * half_life, views=100),
+            PostView(post_id=second, hour=hour, views=10),
+            PostView(post_id=third, hour=hour - 1, views=10),
+            PostView(post_id=third, hour=hour - window, views=1000)])
+        db.session.commit()
+        ranked = [post_id for post_id, title, score in counters.trending()]
+        self.assertEqual(ranked, [second, third, first])
+        self.assertEqual(len(counters.trending(limit=1)), 1)
+        view_counter._pruned = None
+        view_counter.record(first)
+        view_counter.flush()
+        self.assertEqual(PostView.query.filter(PostView.hour <= hour - window)
+                         .count(), 0)
+
+    def test_home_page_shows_trending(self):
+        post_id = self.post_ids[1]
+        with app.test_client() as client:
+            client.get(f'/posts/{post_id}')
+            html = client.get('/').get_data(as_text=True)
+            self.assertNotIn('trending-posts', html)
+            view_counter.flush()
+            html = client.get('/').get_data(as_text=True)
+        self.assertIn('trending-posts', html)
+        self.assertIn(f'href="../posts/{post_id}">POST_1</a>', html)